@@ -2,26 +2,25 @@
 # SISTEMA COMPLETO ENTERPRISE
 # Inclui: JWT, Histórico, Exportação (PDF/Excel), WhatsApp e Google Sheets
 
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Body
+from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, Response
+from starlette.background import BackgroundTask
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
 from pathlib import Path
 import shutil
+import base64
+import re
+import tempfile
+import zipfile
 import csv
 import json
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
 import uuid
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, BinaryIO
 import os
-import requests
-import io
-from openpyxl import load_workbook, Workbook
+import asyncio
 
 # Serviço de cache SQLite (opcional)
 try:
@@ -30,6 +29,26 @@ except ImportError:
     cache_service = None
     print("⚠️  cache_service não encontrado, continuando sem cache...")
 
+# Cache em memória das planilhas de dados (data/uploads)
+from report_store import ReportStore, source_cache, query_cache
+from respostas import RespostaJSON, CompressaoMiddleware, metricas_compressao, cabecalhos_cache, nao_modificado
+from versoes import versoes_dados, hash_conteudo
+from sheets_service import sheets_service
+from sheets_scheduler import sheets_scheduler
+from csv_ingest import baixar_stream, ingerir_corpo
+from sheets_delta import sheet_changes, chaves_linhas, calcular_delta
+from sheets_events import sheet_events, MEDIA_TYPE_SSE
+from sheets_reload import reload_jobs
+from sheets_snapshot import sheets_state
+from streaming import stream_json, stream_ndjson, MEDIA_TYPE_NDJSON
+from formatos_binarios import (
+    formato_aceito, media_type, serializar_arrow, serializar_msgpack, FormatoIndisponivel
+)
+from export_service import (
+    excel_stream, renderizar_lote, ler_arquivo, ExportCache, ExportJobManager, ExportQueueFull,
+    MEDIA_TYPE_EXCEL
+)
+
 # =========================
 # CONFIG
 # =========================
@@ -46,7 +65,8 @@ TOKEN_EXPIRE_MIN = 60
 app = FastAPI(
     title="Chat IA Corporativo",
     description="API Enterprise para Análise de Relatórios com IA",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=RespostaJSON
 )
 
 security = HTTPBearer()
@@ -66,6 +86,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compressão brotli/gzip das respostas JSON (acima de COMPRESSAO_MIN_BYTES)
+app.add_middleware(CompressaoMiddleware)
+
 BASE_DIR = Path("data")
 BASE_DIR.mkdir(exist_ok=True)
 LOGS_FILE = BASE_DIR / "logs.csv"
@@ -74,6 +97,10 @@ UPLOADS_DIR.mkdir(exist_ok=True)
 EXPORTS_DIR = BASE_DIR / "exports"
 EXPORTS_DIR.mkdir(exist_ok=True)
 
+# Exportações: cache de arquivos (LRU) e fila de jobs em segundo plano
+export_cache = ExportCache(EXPORTS_DIR)
+export_jobs = ExportJobManager(export_cache)
+
 # Inicializar arquivo de logs
 if not LOGS_FILE.exists():
     with open(LOGS_FILE, "w", encoding="utf-8") as f:
@@ -100,13 +127,27 @@ def criar_token(email: str, role: str = "user"):
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def get_user(token: HTTPAuthorizationCredentials = Depends(security)):
+def decodificar_token(token: str):
     try:
-        payload = jwt.decode(token.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return {"email": payload["sub"], "role": payload.get("role", "user")}
     except JWTError:
         raise HTTPException(403, "Token inválido ou expirado")
 
+
+def get_user(token: HTTPAuthorizationCredentials = Depends(security)):
+    return decodificar_token(token.credentials)
+
+
+def get_user_sse(request: Request, token: Optional[str] = None):
+    """Como get_user, mas aceita ?token= (o EventSource não envia cabeçalhos)"""
+    autorizacao = request.headers.get("authorization", "")
+    if autorizacao.lower().startswith("bearer "):
+        return decodificar_token(autorizacao[7:])
+    if token:
+        return decodificar_token(token)
+    raise HTTPException(403, "Not authenticated")
+
 # =========================
 # AUTH
 # =========================
@@ -212,7 +253,7 @@ def obter_historico(user_data = Depends(get_user)):
     # Últimos 100 registros
     historico = historico[-100:]
     
-    return {"historico": historico}
+    return RespostaJSON({"historico": historico})
 
 # =========================
 # UPLOAD DE PLANILHAS
@@ -236,6 +277,11 @@ def upload_excel(file: UploadFile = File(...), user_data = Depends(get_user)):
     with open(file_path, "wb") as f:
         shutil.copyfileobj(file.file, f)
     
+    # Novo arquivo em data/uploads: descartar fontes e resultados em cache
+    source_cache.invalidate()
+    query_cache.invalidate()
+    versoes_dados.registrar("uploads", hash_conteudo(file_id))
+    
     # Tentar ler para validar
     try:
         if ext == '.csv':
@@ -266,111 +312,242 @@ def upload_excel(file: UploadFile = File(...), user_data = Depends(get_user)):
         raise HTTPException(400, f"Erro ao ler arquivo: {str(e)}")
 
 # =========================
-# EXPORTAÇÃO
+# RELATÓRIOS
 # =========================
 
-def exportar_excel(data: List[Dict], filename: str):
-    """Exportar dados para Excel usando openpyxl diretamente"""
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill
+# Arquivo de dados (em data/uploads) usado por cada tipo de relatório
+ARQUIVOS_RELATORIO = {
+    "nao_cobertos_clientes": "nao_cobertos.xlsx",
+    "nao_cobertos_fornecedor": "nao_cobertos.xlsx",
+    "msl_mini": "msl.xlsx",
+    "msl_super": "msl.xlsx",
+    "msl_otg": "msl.xlsx",
+    "msl_danone": "msl.xlsx",
+    "exp": "msl.xlsx",
+    "novos_clientes": "novos_clientes.xlsx",
+    "queijo_reino": "queijo_reino.xlsx",
+}
+
+
+def carregar_fonte(tipo: str):
+    """Retorna a fonte de dados processada (em cache) de um tipo de relatório"""
+    arquivo_nome = ARQUIVOS_RELATORIO.get(tipo)
+    if not arquivo_nome:
+        raise HTTPException(400, f"Tipo de relatório desconhecido: {tipo}")
     
-    path = EXPORTS_DIR / f"{filename}_{uuid.uuid4().hex[:8]}.xlsx"
+    arquivo_path = UPLOADS_DIR / arquivo_nome
     
-    wb = Workbook()
-    ws = wb.active
-    ws.title = 'Relatório'
+    if not arquivo_path.exists():
+        raise HTTPException(404, f"Arquivo de dados não encontrado: {arquivo_nome}. Faça upload primeiro.")
     
-    if not data:
-        wb.save(path)
-        return path
+    # Ler dados (processados uma única vez por versão do arquivo)
+    try:
+        return source_cache.get(arquivo_path)
+    except Exception as e:
+        raise HTTPException(500, f"Erro ao ler arquivo: {str(e)}")
+
+
+def status_permitidos(tipo: str) -> Optional[set]:
+    """Valores de STATUS aceitos para cada tipo de relatório (None = todos)"""
+    if tipo.startswith("nao_cobertos"):
+        return {"FALTA"}
+    elif tipo.startswith("msl") or tipo == "exp":
+        return {"OK", "FALTA"}
+    return None
+
+
+def filtrar_relatorio(tipo: str, codvd: Any, vendedor: str = ""):
+    """
+    Aplica os filtros de um relatório sobre a fonte de dados em cache
     
-    # Cabeçalho
-    headers = list(data[0].keys())
-    ws.append(headers)
-    
-    # Estilizar cabeçalho
-    for cell in ws[1]:
-        cell.font = Font(bold=True)
-        cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-    
-    # Dados
-    for row in data:
-        ws.append([row.get(h, '') for h in headers])
-    
-    # Ajustar largura das colunas
-    for column in ws.columns:
-        max_length = 0
-        column_letter = column[0].column_letter
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column_letter].width = adjusted_width
-    
-    wb.save(path)
-    return path
-
-
-def exportar_pdf(data: List[Dict], titulo: str, filename: str):
-    """Exportar dados para PDF"""
-    path = EXPORTS_DIR / f"{filename}_{uuid.uuid4().hex[:8]}.pdf"
-    
-    doc = SimpleDocTemplate(str(path), pagesize=A4)
-    styles = getSampleStyleSheet()
-    elementos = []
-    
-    # Título
-    elementos.append(Paragraph(titulo, styles['Title']))
-    elementos.append(Paragraph(f"Gerado em: {datetime.now().strftime('%d/%m/%Y %H:%M')}", styles['Normal']))
-    elementos.append(Paragraph(f"Total de registros: {len(data)}", styles['Normal']))
-    elementos.append(Paragraph("<br/><br/>", styles['Normal']))
+    Returns:
+        Tupla (fonte, posições das linhas filtradas e sem duplicatas)
+    """
+    fonte = carregar_fonte(tipo)
+    store = fonte.store
     
-    if not data:
-        doc.build(elementos)
-        return path
-    
-    # Tabela - limitar a 50 registros e 6 colunas para PDF
-    max_cols = 6
-    max_rows = 50
-    
-    # Limitar colunas
-    headers_limited = headers[:max_cols]
-    data_limited = data[:max_rows]
-    
-    table_data = [headers_limited]
-    for row in data_limited:
-        table_data.append([str(row.get(h, ''))[:30] for h in headers_limited])  # Limitar texto
-    
-    # Criar tabela
-    table = Table(table_data)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        
-        elementos.append(table)
-        
-        if len(df) > 50:
-            elementos.append(Paragraph(f"<br/>Mostrando primeiros 50 de {len(df)} registros", styles['Normal']))
+    permitidos = status_permitidos(tipo)
     
-    doc.build(elementos)
-    return path
+    # Aplicar filtros (interseção dos bitmaps de CODVD e STATUS); linhas
+    # duplicadas já foram marcadas na carga e ficam de fora da seleção
+    def calcular():
+        return store.filtrar(codvd, permitidos, vendedor)
+    
+    # Tipos que usam o mesmo arquivo e as mesmas regras compartilham o resultado
+    chave = (
+        fonte.path.name, frozenset(permitidos) if permitidos is not None else None,
+        str(codvd).strip(), (vendedor or "").upper(), fonte.version
+    )
+    return fonte, query_cache.get_or_compute(chave, calcular)
+
+
+# Paginação por cursor das respostas JSON
+PAGINA_MAX_LIMITE = 5000
+
+
+def _codificar_cursor(offset: int, order_by: Optional[str], versao: Optional[str]) -> str:
+    bruto = json.dumps({"o": offset, "s": order_by or "", "v": versao or ""}).encode("utf-8")
+    return base64.urlsafe_b64encode(bruto).decode("ascii").rstrip("=")
+
+
+def _decodificar_cursor(cursor: str, order_by: Optional[str], versao: Optional[str]) -> int:
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        dados = json.loads(bruto)
+        offset = int(dados["o"])
+    except Exception:
+        raise HTTPException(400, "Cursor inválido")
+    if dados.get("s", "") != (order_by or "") or offset < 0:
+        raise HTTPException(400, "Cursor não corresponde à ordenação solicitada")
+    if dados.get("v", "") != (versao or ""):
+        # O offset se refere a outra versão: linhas seriam puladas ou repetidas
+        raise HTTPException(409, "Os dados mudaram desde a página anterior; recomece a paginação")
+    return offset
+
+
+def selecionar_pagina(store, posicoes, limit=None, cursor=None, fields=None, order_by=None, versao=None) -> Dict[str, Any]:
+    """
+    Aplica ordenação, projeção de colunas e paginação por cursor
+    
+    Args:
+        store: ReportStore com os dados
+        posicoes: Posições das linhas selecionadas (range = todas)
+        limit: Tamanho da página (None = todas as linhas)
+        cursor: Cursor devolvido pela página anterior
+        fields: Colunas a retornar (lista ou texto separado por vírgulas)
+        order_by: Coluna de ordenação ("-coluna" para decrescente)
+        versao: Versão dos dados, gravada no cursor (409 se mudar entre páginas)
+    
+    Returns:
+        Dict com "posicoes" (da página), "campos" (projeção) e "next_cursor"
+    """
+    campos = None
+    if fields:
+        campos = fields.split(",") if isinstance(fields, str) else list(fields)
+        campos = [c.strip() for c in campos if c.strip()]
+        desconhecidos = [c for c in campos if c not in store.columns]
+        if desconhecidos:
+            raise HTTPException(400, f"Colunas desconhecidas: {desconhecidos}")
+    
+    if order_by:
+        coluna = order_by.lstrip("-")
+        decrescente = order_by.startswith("-")
+        if coluna not in store.columns:
+            raise HTTPException(400, f"Coluna de ordenação desconhecida: {coluna}")
+        if isinstance(posicoes, range) and len(posicoes) == len(store):
+            # Relatório inteiro: usa direto a permutação pré-calculada
+            permutacao, _ = store.ordenacao(coluna)
+            posicoes = permutacao[::-1] if decrescente else permutacao
+        else:
+            posicoes = store.ordenar(posicoes, coluna, decrescente)
+    
+    inicio = _decodificar_cursor(cursor, order_by, versao) if cursor else 0
+    if limit is None:
+        fim = len(posicoes)
+    else:
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise HTTPException(400, "Parâmetro limit inválido")
+        if limit < 1 or limit > PAGINA_MAX_LIMITE:
+            raise HTTPException(400, f"limit deve estar entre 1 e {PAGINA_MAX_LIMITE}")
+        fim = min(inicio + limit, len(posicoes))
+    
+    return {
+        "posicoes": posicoes[inicio:fim],
+        "campos": campos,
+        "next_cursor": _codificar_cursor(fim, order_by, versao) if fim < len(posicoes) else None
+    }
+
+
+def paginar(store, posicoes, limit=None, cursor=None, fields=None, order_by=None, versao=None) -> Dict[str, Any]:
+    """Como selecionar_pagina, mas já com as linhas da página (em dados)"""
+    pagina = selecionar_pagina(store, posicoes, limit, cursor, fields, order_by, versao)
+    return {
+        "dados": store.rows(pagina["posicoes"], pagina["campos"]),
+        "next_cursor": pagina["next_cursor"]
+    }
+
+
+def modo_stream(valor: Optional[str], request: Request) -> Optional[str]:
+    """Modo de streaming pedido pelo cliente: "ndjson", "json" ou None"""
+    if not valor and MEDIA_TYPE_NDJSON in request.headers.get("accept", ""):
+        return "ndjson"
+    if valor and valor not in ("ndjson", "json"):
+        raise HTTPException(400, "stream deve ser 'ndjson' ou 'json'")
+    return valor or None
+
+
+def resposta_stream(modo: str, envelope: Dict[str, Any], campo: str, store, pagina: Dict[str, Any], total: int):
+    """Resposta em streaming (NDJSON ou JSON em blocos) de uma página"""
+    headers = {"X-Total-Count": str(total)}
+    if pagina["next_cursor"]:
+        headers["X-Next-Cursor"] = pagina["next_cursor"]
+    
+    if modo == "ndjson":
+        return StreamingResponse(
+            stream_ndjson(store, pagina["posicoes"], pagina["campos"]),
+            media_type=MEDIA_TYPE_NDJSON, headers=headers
+        )
+    envelope = dict(envelope, next_cursor=pagina["next_cursor"])
+    return StreamingResponse(
+        stream_json(envelope, campo, store, pagina["posicoes"], pagina["campos"]),
+        media_type="application/json", headers=headers
+    )
+
+
+def formato_binario(request: Request) -> Optional[str]:
+    """Formato binário pedido no Accept: "msgpack", "arrow" ou None (JSON)"""
+    try:
+        return formato_aceito(request.headers.get("accept", ""))
+    except FormatoIndisponivel as e:
+        raise HTTPException(406, f"Formato '{e}' não disponível neste servidor")
+
+
+def resposta_binaria(formato: str, envelope: Dict[str, Any], campo: str, store, pagina: Dict[str, Any], total: int):
+    """Resposta MessagePack ou Arrow IPC de uma página"""
+    headers = {"X-Total-Count": str(total), "Vary": "Accept"}
+    if pagina["next_cursor"]:
+        headers["X-Next-Cursor"] = pagina["next_cursor"]
+    
+    envelope = dict(envelope, next_cursor=pagina["next_cursor"])
+    if formato == "arrow":
+        corpo = serializar_arrow(envelope, store, pagina["posicoes"], pagina["campos"])
+    else:
+        corpo = serializar_msgpack(envelope, campo, store, pagina["posicoes"], pagina["campos"])
+    return Response(corpo, media_type=media_type(formato), headers=headers)
+
+
+def chave_exportacao(tipo: str, codvd: Any, vendedor: str, formato: str, fonte) -> tuple:
+    """Chave de uma exportação: parâmetros normalizados + versão dos dados"""
+    return (tipo, str(codvd).strip(), (vendedor or "").upper(), formato, fonte.version)
+
+
+def resposta_arquivo(arquivo: BinaryIO, filename: str, media_type: str) -> StreamingResponse:
+    """Envia um arquivo do cache de exportações a partir do handle aberto
+    
+    O arquivo é aberto sob o lock do evict (ExportCache.abrir), então
+    continua legível mesmo se for removido do diretório durante o envio.
+    """
+    return StreamingResponse(
+        ler_arquivo(arquivo),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Content-Length": str(os.fstat(arquivo.fileno()).st_size)
+        },
+        # Cliente desconectado no meio: o handle é fechado mesmo assim
+        background=BackgroundTask(arquivo.close)
+    )
 
-# =========================
-# RELATÓRIOS
-# =========================
 
 @app.post("/api/relatorios/gerar")
-def gerar_relatorio(payload: Dict[str, Any] = Body(...), user_data = Depends(get_user)):
+async def gerar_relatorio(request: Request, payload: Dict[str, Any] = Body(...), user_data = Depends(get_user)):
+    """Gera um relatório em JSON, Excel ou PDF
+    
+    Rota assíncrona: filtro, log e serialização rodam em threads e o PDF é
+    aguardado sem prender uma thread enquanto o pool de processos renderiza.
+    """
     tipo = payload.get("tipo")
     codvd = payload.get("codvd")
     vendedor = payload.get("vendedor", "")
@@ -379,98 +556,293 @@ def gerar_relatorio(payload: Dict[str, Any] = Body(...), user_data = Depends(get
     if not tipo or not codvd:
         raise HTTPException(400, "Tipo e CODVD são obrigatórios")
     
-    # Buscar arquivo de dados correspondente
-    # Por padrão, busca arquivos .xlsx com nome do tipo
-    arquivo_mapeamento = {
-        "nao_cobertos_clientes": "nao_cobertos.xlsx",
-        "nao_cobertos_fornecedor": "nao_cobertos.xlsx",
-        "msl_mini": "msl.xlsx",
-        "msl_super": "msl.xlsx",
-        "msl_otg": "msl.xlsx",
-        "msl_danone": "msl.xlsx",
-        "exp": "msl.xlsx",
-        "novos_clientes": "novos_clientes.xlsx",
-        "queijo_reino": "queijo_reino.xlsx",
-    }
+    fonte, posicoes = await asyncio.to_thread(filtrar_relatorio, tipo, codvd, vendedor)
+    store = fonte.store
     
-    arquivo_nome = arquivo_mapeamento.get(tipo)
-    if not arquivo_nome:
-        raise HTTPException(400, f"Tipo de relatório desconhecido: {tipo}")
+    # Salvar log
+    await asyncio.to_thread(salvar_log, user_data["email"], tipo, codvd, vendedor, len(posicoes))
     
-    arquivo_path = UPLOADS_DIR / arquivo_nome
+    # Exportar
+    headers = store.headers if posicoes else []
+    if exportar == "excel":
+        chave = chave_exportacao(tipo, codvd, vendedor, "excel", fonte)
+        arquivo = await asyncio.to_thread(export_cache.abrir, chave)
+        if arquivo:
+            return resposta_arquivo(arquivo, f"{tipo}.xlsx", MEDIA_TYPE_EXCEL)
+        
+        return StreamingResponse(
+            excel_stream(
+                headers, store.valores(posicoes),
+                destino=export_cache.caminho(chave), ao_concluir=export_cache.registrar
+            ),
+            media_type=MEDIA_TYPE_EXCEL,
+            headers={"Content-Disposition": f'attachment; filename="{tipo}.xlsx"'}
+        )
     
-    if not arquivo_path.exists():
-        raise HTTPException(404, f"Arquivo de dados não encontrado: {arquivo_nome}. Faça upload primeiro.")
+    elif exportar == "pdf":
+        chave = chave_exportacao(tipo, codvd, vendedor, "pdf", fonte)
+        arquivo = await asyncio.to_thread(export_cache.abrir, chave)
+        if not arquivo:
+            # Renderizado no pool e devolvido já aberto (imune a evict concorrente)
+            linhas = await asyncio.to_thread(lambda: [list(valores) for valores in store.valores(posicoes)])
+            [arquivo] = await renderizar_lote(export_cache, [(chave, f"Relatório {tipo.upper()}", headers, linhas)])
+            await asyncio.to_thread(export_cache.evict)
+        return resposta_arquivo(arquivo, f"{tipo}.pdf", "application/pdf")
+    
+    else:
+        return await asyncio.to_thread(responder_relatorio_json, request, payload, fonte, posicoes)
+
+
+def responder_relatorio_json(request: Request, payload: Dict[str, Any], fonte, posicoes) -> Response:
+    """Resposta JSON de /api/relatorios/gerar (paginação opcional: limit, cursor, fields, order_by)
     
-    # Ler dados usando openpyxl
+    Accept: application/msgpack ou Arrow IPC para clientes de máquina.
+    """
+    tipo = payload.get("tipo")
+    codvd = payload.get("codvd")
+    vendedor = payload.get("vendedor", "")
+    store = fonte.store
+    binario = formato_binario(request)
+    stream = None if binario else modo_stream(payload.get("stream"), request)
+    if binario or stream:
+        pagina = selecionar_pagina(
+            store, posicoes, payload.get("limit"), payload.get("cursor"),
+            payload.get("fields"), payload.get("order_by"), fonte.version
+        )
+        envelope = {"tipo": tipo, "codvd": codvd, "vendedor": vendedor, "total_registros": len(posicoes)}
+        if binario:
+            return resposta_binaria(binario, envelope, "dados", store, pagina, len(posicoes))
+        return resposta_stream(stream, envelope, "dados", store, pagina, len(posicoes))
+    
+    pagina = paginar(
+        store, posicoes, payload.get("limit"), payload.get("cursor"),
+        payload.get("fields"), payload.get("order_by"), fonte.version
+    )
+    return RespostaJSON({
+        "tipo": tipo,
+        "codvd": codvd,
+        "vendedor": vendedor,
+        "total_registros": len(posicoes),
+        "dados": pagina["dados"],
+        "next_cursor": pagina["next_cursor"]
+    })
+
+# Limite de vendedores por requisição em lote
+LOTE_MAX_VENDEDORES = 200
+
+
+@app.post("/api/relatorios/lote")
+async def gerar_relatorio_lote(payload: Dict[str, Any] = Body(...), user_data = Depends(get_user)):
+    """Gera o relatório de vários vendedores com uma única passada nos dados
+
+    Payload: tipo, codvds (lista), vendedores (lista opcional, alinhada com
+    codvds) e exportar (json, excel ou pdf). Para excel/pdf retorna um zip
+    com um arquivo por vendedor.
+    """
+    tipo = payload.get("tipo")
+    codvds = payload.get("codvds") or []
+    vendedores = payload.get("vendedores") or [""] * len(codvds)
+    exportar = payload.get("exportar", "json")  # json, excel, pdf
+
+    if not tipo or not isinstance(codvds, list) or not codvds:
+        raise HTTPException(400, "Tipo e lista de CODVDs são obrigatórios")
+    if not isinstance(vendedores, list) or len(vendedores) != len(codvds):
+        raise HTTPException(400, "Lista de vendedores deve ter o mesmo tamanho da lista de CODVDs")
+    if len(codvds) > LOTE_MAX_VENDEDORES:
+        raise HTTPException(400, f"Máximo de {LOTE_MAX_VENDEDORES} vendedores por lote")
+    if exportar not in ("json", "excel", "pdf"):
+        raise HTTPException(400, "Exportar deve ser 'json', 'excel' ou 'pdf'")
+
+    consultas = list(dict.fromkeys((str(c).strip(), v or "") for c, v in zip(codvds, vendedores)))
+    fonte, particoes = await asyncio.to_thread(particionar_lote, tipo, consultas, user_data["email"])
+    store = fonte.store
+
+    if exportar == "json":
+        def responder():
+            return RespostaJSON({
+                "tipo": tipo,
+                "total_vendedores": len(consultas),
+                "resultados": [
+                    {
+                        "codvd": codvd,
+                        "vendedor": vendedor,
+                        "total_registros": len(posicoes),
+                        "dados": store.rows(posicoes)
+                    }
+                    for (codvd, vendedor), posicoes in zip(consultas, particoes)
+                ]
+            })
+        return await asyncio.to_thread(responder)
+
+    # Arquivos por vendedor gerados em paralelo, depois empacotados num zip
+    def montar_itens():
+        return [
+            (
+                chave_exportacao(tipo, codvd, vendedor, exportar, fonte),
+                f"Relatório {tipo.upper()} - {codvd}",
+                store.headers if posicoes else [],
+                [list(valores) for valores in store.valores(posicoes)]
+            )
+            for (codvd, vendedor), posicoes in zip(consultas, particoes)
+        ]
+    arquivos = await renderizar_lote(export_cache, await asyncio.to_thread(montar_itens))
+
+    extensao = "pdf" if exportar == "pdf" else "xlsx"
+    nomes = nomes_arquivos_lote(tipo, consultas, extensao)
+    caminho_zip = await asyncio.to_thread(empacotar_zip, arquivos, nomes)
+    await asyncio.to_thread(export_cache.evict)
+
+    return FileResponse(
+        caminho_zip,
+        filename=f"{tipo}_lote.zip",
+        media_type="application/zip",
+        background=BackgroundTask(os.unlink, caminho_zip)
+    )
+
+
+def trecho_nome_arquivo(valor: Any) -> str:
+    """Trecho seguro de nome de arquivo: só letras, dígitos, _, . e -, sem '..' nem ponto inicial"""
+    trecho = re.sub(r"[^\w.-]+", "_", str(valor))
+    trecho = re.sub(r"\.{2,}", ".", trecho).strip("._")
+    return trecho or "_"
+
+
+def nomes_arquivos_lote(tipo: str, consultas: List[tuple], extensao: str) -> List[str]:
+    """Nomes dos arquivos do zip do lote, saneados e sem repetição"""
+    nomes = []
+    usados = set()
+    for codvd, vendedor in consultas:
+        partes = [tipo, codvd, vendedor] if vendedor else [tipo, codvd]
+        base = "_".join(trecho_nome_arquivo(parte) for parte in partes)
+        nome = f"{base}.{extensao}"
+        sufixo = 1
+        while nome in usados:
+            sufixo += 1
+            nome = f"{base}_{sufixo}.{extensao}"
+        usados.add(nome)
+        nomes.append(nome)
+    return nomes
+
+
+def particionar_lote(tipo: str, consultas: List[tuple], usuario: str):
+    """Filtra os dados de cada (codvd, vendedor) do lote e registra o log"""
+    fonte = carregar_fonte(tipo)
+    particoes = fonte.store.particionar(consultas, status_permitidos(tipo))
+    for (codvd, vendedor), posicoes in zip(consultas, particoes):
+        salvar_log(usuario, tipo, codvd, vendedor, len(posicoes))
+    return fonte, particoes
+
+
+def empacotar_zip(arquivos: List[Any], nomes: List[str]) -> str:
+    """Copia os arquivos (já abertos) para um zip temporário e os fecha"""
+    arquivo_zip = tempfile.NamedTemporaryFile(suffix=".zip", delete=False)
     try:
-        from openpyxl import load_workbook
-        wb = load_workbook(arquivo_path)
-        ws = wb.active
-        
-        # Converter para lista de dicts
-        headers = [cell.value for cell in ws[1]]
-        data_list = []
-        for row in ws.iter_rows(min_row=2, values_only=True):
-            data_list.append(dict(zip(headers, row)))
-    except Exception as e:
-        raise HTTPException(500, f"Erro ao ler arquivo: {str(e)}")
+        with zipfile.ZipFile(arquivo_zip, "w", zipfile.ZIP_STORED) as zf:
+            for arquivo, nome in zip(arquivos, nomes):
+                with zf.open(nome, "w") as destino:
+                    shutil.copyfileobj(arquivo, destino)
+    except Exception:
+        arquivo_zip.close()
+        os.unlink(arquivo_zip.name)
+        raise
+    finally:
+        for arquivo in arquivos:
+            arquivo.close()
+    arquivo_zip.close()
+    return arquivo_zip.name
+
+
+# =========================
+# EXPORTAÇÃO EM SEGUNDO PLANO
+# =========================
+
+@app.post("/api/relatorios/exportar")
+def submeter_exportacao(payload: Dict[str, Any] = Body(...), user_data = Depends(get_user)):
+    """Enfileira a exportação de um relatório e retorna o id do job"""
+    tipo = payload.get("tipo")
+    codvd = payload.get("codvd")
+    vendedor = payload.get("vendedor", "")
+    formato = payload.get("formato", "excel")  # excel, pdf
     
-    # Aplicar filtros
-    filtered_data = []
-    for row in data_list:
-        status = str(row.get("STATUS", "")).upper().strip()
-        codvd_val = str(row.get("CODVD", "")).strip()
-        vendedor_val = str(row.get("VENDEDOR", "")).upper()
-        
-        # Filtro de status por tipo
-        if tipo.startswith("nao_cobertos"):
-            if status != "FALTA":
-                continue
-        elif tipo.startswith("msl") or tipo == "exp":
-            if status not in ["OK", "FALTA"]:
-                continue
-        
-        # Filtrar por CODVD
-        if codvd_val != str(codvd).strip():
-            continue
-        
-        # Filtrar por vendedor se fornecido
-        if vendedor and vendedor.upper() not in vendedor_val:
-            continue
-        
-        filtered_data.append(row)
+    if not tipo or not codvd:
+        raise HTTPException(400, "Tipo e CODVD são obrigatórios")
+    if formato not in ("excel", "pdf"):
+        raise HTTPException(400, "Formato deve ser 'excel' ou 'pdf'")
     
-    # Remover duplicatas (simples - converte para tuplas e usa set)
-    seen = set()
-    unique_data = []
-    for row in filtered_data:
-        row_tuple = tuple(sorted(row.items()))
-        if row_tuple not in seen:
-            seen.add(row_tuple)
-            unique_data.append(row)
+    fonte, posicoes = filtrar_relatorio(tipo, codvd, vendedor)
+    salvar_log(user_data["email"], tipo, codvd, vendedor, len(posicoes))
     
-    # Salvar log
-    salvar_log(user_data["email"], tipo, codvd, vendedor, len(unique_data))
+    headers = fonte.store.headers if posicoes else []
     
-    # Exportar
-    if exportar == "excel":
-        path = exportar_excel(unique_data, tipo)
-        return FileResponse(path, filename=f"{tipo}.xlsx", media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    try:
+        job = export_jobs.submeter(
+            chave=chave_exportacao(tipo, codvd, vendedor, formato, fonte),
+            titulo=f"Relatório {tipo.upper()}",
+            headers=headers,
+            linhas=fonte.store.valores(posicoes),
+            usuario=user_data["email"]
+        )
+    except ExportQueueFull as e:
+        raise HTTPException(503, str(e))
+    
+    return dict(job, total_registros=len(posicoes))
+
+
+def obter_job_exportacao(job_id: str, user_data: dict) -> Dict[str, Any]:
+    job = export_jobs.get(job_id)
+    if not job:
+        raise HTTPException(404, f"Exportação '{job_id}' não encontrada")
+    if user_data["role"] != "admin" and user_data["email"] not in job["usuarios"]:
+        raise HTTPException(403, "Exportação pertence a outro usuário")
+    return job
+
+
+@app.get("/api/relatorios/exportar/{job_id}")
+def status_exportacao(job_id: str, user_data = Depends(get_user)):
+    """Status de um job de exportação"""
+    obter_job_exportacao(job_id, user_data)
+    return export_jobs.status(job_id)
+
+
+@app.get("/api/relatorios/exportar/{job_id}/download")
+def download_exportacao(job_id: str, user_data = Depends(get_user)):
+    """Baixa o arquivo de um job de exportação concluído"""
+    job = obter_job_exportacao(job_id, user_data)
+    status = export_jobs.status(job_id)
+    
+    if status["status"] == "erro":
+        raise HTTPException(500, f"Falha na exportação: {status['erro']}")
+    if status["status"] != "concluido":
+        raise HTTPException(409, f"Exportação ainda em andamento ({status['status']})")
+    
+    arquivo = export_cache.abrir(job["chave"])
+    if arquivo is None:
+        raise HTTPException(410, "Arquivo removido do cache de exportações, solicite novamente")
+    
+    tipo = job["chave"][0]
+    if job["formato"] == "pdf":
+        return resposta_arquivo(arquivo, f"{tipo}.pdf", "application/pdf")
+    return resposta_arquivo(arquivo, f"{tipo}.xlsx", MEDIA_TYPE_EXCEL)
+
+
+@app.post("/api/relatorios/contagem")
+def contar_relatorio(payload: Dict[str, Any] = Body(...), user_data = Depends(get_user)):
+    """Contagem de linhas por STATUS de um relatório, sem montar os dados"""
+    tipo = payload.get("tipo")
+    codvd = payload.get("codvd")
     
-    elif exportar == "pdf":
-        path = exportar_pdf(unique_data, f"Relatório {tipo.upper()}", tipo)
-        return FileResponse(path, filename=f"{tipo}.pdf", media_type="application/pdf")
+    if not tipo or not codvd:
+        raise HTTPException(400, "Tipo e CODVD são obrigatórios")
     
-    else:
-        # JSON
-        return {
-            "tipo": tipo,
-            "codvd": codvd,
-            "vendedor": vendedor,
-            "total_registros": len(unique_data),
-            "dados": unique_data
-        }
+    store = carregar_fonte(tipo).store
+    por_status = store.contar(codvd, status_permitidos(tipo))
+    
+    return {
+        "tipo": tipo,
+        "codvd": codvd,
+        "total_registros": sum(por_status.values()),
+        "por_status": por_status
+    }
 
 # =========================
 # WHATSAPP
@@ -533,6 +905,9 @@ REPORTS_CONFIG = [
         "label": "Queijo do Reino",
         "keywords": ["queijo", "reino"],
         "type": "client_code_details",
+        # Colunas que identificam a linha (atualização incremental por linha);
+        # sem elas a linha é identificada pelo conteúdo
+        "key_columns": ["Código Cliente"],
         "url": "https://docs.google.com/spreadsheets/d/e/2PACX-1vR9lG9sbtgRqV0PLkyjT8R9znpC9ECGurgfelIhn_q5BwgThg6SpdfE2R30obAAaawk0FIGLlBowjt_/pub?gid=1824827366&single=true&output=csv"
     },
     {
@@ -544,11 +919,18 @@ REPORTS_CONFIG = [
     }
 ]
 
-# Cache em memória para os dados das planilhas
-report_data_cache: Dict[str, List[Dict]] = {}
-report_validation_status: Dict[str, Dict] = {}
-is_loading_sheets = False
-last_update_time = None
+# Idade máxima do cache SQLite aceita na inicialização (horas)
+SHEETS_CACHE_MAX_HORAS = int(os.getenv("SHEETS_CACHE_MAX_HORAS", "24"))
+
+# Dados, validação, estado de carga e prontidão das planilhas: snapshot
+# imutável em sheets_state (leitores usam sheets_state.atual() uma vez por requisição)
+# ETag/Last-Modified e hash do último CSV baixado de cada planilha
+report_source_meta: Dict[str, Dict] = {}
+# Relatórios cuja última gravação no SQLite falhou (a próxima grava tudo)
+report_sqlite_pendente: set = set()
+# Versão colunar de cada planilha (paginação/ordenação): (lista de origem, store)
+report_store_cache: Dict[str, tuple] = {}
+carga_inicial_task: Optional[asyncio.Task] = None
 
 # Schemas esperados para validação
 REPORT_SCHEMAS = {
@@ -567,6 +949,42 @@ REPORT_SCHEMAS = {
 }
 
 
+def obter_store_planilha(report_id: str, data: List[Dict]) -> ReportStore:
+    """Versão colunar das linhas de uma planilha, vindas do snapshot do leitor (criada sob demanda)"""
+    origem, store = report_store_cache.get(report_id, (None, None))
+    if origem is not data:
+        store = ReportStore.from_rows(data)
+        report_store_cache[report_id] = (data, store)
+    return store
+
+
+def atualizar_relatorio(
+    report_id: str, data: List[Dict], validation: Optional[Dict] = None, store: Optional[ReportStore] = None
+):
+    """Publica os dados de um relatório; o snapshot avança a versão se o conteúdo mudou
+    
+    Args:
+        store: Versão colunar já montada na ingestão (evita refazê-la sob demanda)
+    """
+    if store is not None:
+        report_store_cache[report_id] = (data, store)
+    sheets_state.publicar({report_id: (data, validation)})
+
+
+def publicar_caches(caches: Dict[str, Dict[str, Any]], validation_padrao: Dict, **estado):
+    """Publica as versões do SQLite (dados, validação e versão do histórico)
+    
+    Todas as planilhas entram num único snapshot, junto com o estado de
+    carga informado (loading / last_update).
+    """
+    for report_id, cached in caches.items():
+        sheet_changes.definir_versao(report_id, cached.get("version", 0))
+    sheets_state.publicar({
+        report_id: (cached["data"], cached.get("validation_status", validation_padrao))
+        for report_id, cached in caches.items()
+    }, **estado)
+
+
 def validate_report_schema(report_id: str, data: List[Dict]) -> Dict:
     """Valida se os dados correspondem ao schema esperado"""
     if not data:
@@ -591,14 +1009,229 @@ def validate_report_schema(report_id: str, data: List[Dict]) -> Dict:
     }
 
 
-def parse_csv_text(text: str) -> List[Dict[str, str]]:
-    """Parser de CSV robusto"""
-    lines = [line for line in text.split('\n') if line.strip()]
-    if not lines:
-        return []
+def processar_planilha(config: Dict[str, Any], csv_ingerido, meta: Dict[str, Any], salvar: bool = True):
+    """Valida e publica o CSV já ingerido de uma planilha
     
-    reader = csv.DictReader(io.StringIO('\n'.join(lines)))
-    return [row for row in reader]
+    Args:
+        csv_ingerido: Linhas e versão colunar montadas durante o download
+        meta: Validadores HTTP e hash do conteúdo baixado
+        salvar: False quando o SQLite já tem exatamente este conteúdo
+    
+    Returns:
+        Evento "report" publicado (também usado no progresso da recarga)
+    """
+    report_id = config["id"]
+    novas = csv_ingerido.rows
+    
+    # Validar schema
+    validation = validate_report_schema(report_id, novas)
+    
+    # Diferença por linha em relação à versão publicada (None = sem base)
+    key_columns = config.get("key_columns")
+    chaves_novas = chaves_linhas(novas, key_columns)
+    anteriores = sheets_state.atual().data.get(report_id)
+    if anteriores is not None:
+        chaves_anteriores = sheet_changes.chaves(report_id, anteriores, key_columns)
+        delta = calcular_delta(anteriores, chaves_anteriores, novas, chaves_novas)
+        data = delta.rows
+    else:
+        delta = None
+        data = novas
+    atualizar_relatorio(report_id, data, validation, csv_ingerido.store)  # Carrega mesmo com erro
+    
+    if validation["ok"]:
+        print(f"✅ {config['label']} carregado ({len(data)} linhas) - Schema v{validation['version']} OK")
+    else:
+        print(f"⚠️ {config['label']} carregado ({len(data)} linhas) - Schema inválido")
+        print(f"   Colunas faltando: {validation.get('missing_columns', [])}")
+        if validation.get('extra_columns'):
+            print(f"   Colunas extras: {validation['extra_columns']}")
+    
+    # Salvar no cache SQLite só as linhas alteradas, com nova versão. Sem
+    # base por linha no SQLite (relatório legado em blob, versão 0 ou
+    # gravação anterior que falhou) o delta não basta: grava todas as linhas
+    versao_atual = sheet_changes.versao(report_id) or cache_service.get_report_version(report_id)
+    pendente = report_id in report_sqlite_pendente
+    salvo = True
+    if not salvar:
+        sheet_changes.definir_versao(report_id, versao_atual)
+    else:
+        reset = (
+            delta is None or pendente or versao_atual == 0
+            or cache_service.get_report_storage(report_id) != "rows"
+        )
+        if reset or not delta.vazio:
+            versao = versao_atual + 1
+            if reset:
+                upserts = [(chave, pos, row) for pos, (chave, row) in enumerate(zip(chaves_novas, data))]
+                deletes, movidas = [], []
+            else:
+                upserts, deletes, movidas = delta.upserts, delta.deletes, delta.movidas
+                print(f"   Δ v{versao}: +{delta.inserts} ~{delta.updates} -{len(deletes)} linhas")
+            salvo = cache_service.save_report_delta(
+                report_id=report_id,
+                label=config["label"],
+                version=versao,
+                row_count=len(data),
+                validation_status=validation,
+                upserts=upserts,
+                deletes=deletes,
+                moved=movidas,
+                reset=reset
+            )
+            if salvo:
+                # Após uma falha os clientes podem ter perdido alterações: reset
+                sheet_changes.registrar(report_id, versao, None if pendente else delta)
+                report_sqlite_pendente.discard(report_id)
+            else:
+                print(f"   ⚠️ {config['label']}: falha ao gravar no SQLite, a próxima carga grava tudo")
+                report_sqlite_pendente.add(report_id)
+    
+    # Validadores HTTP só valem se o SQLite tem este conteúdo; senão a
+    # próxima carga daria 304 / mesmo hash e o SQLite nunca se atualizaria
+    if salvo:
+        cache_service.save_source_meta(report_id, **meta)
+        report_source_meta[report_id] = meta
+    
+    evento = dict(estado_relatorio(report_id), status="updated")
+    if delta is not None:
+        evento["changes"] = delta.resumo()
+    sheet_events.publicar("report", evento)
+    return evento
+
+
+def estado_relatorio(report_id: str, snapshot=None) -> Dict[str, Any]:
+    """Linhas, versão e validação de um relatório (eventos e status)"""
+    snapshot = snapshot or sheets_state.atual()
+    validation = snapshot.validacao(report_id)
+    return {
+        "id": report_id,
+        "rows": len(snapshot.rows(report_id)),
+        "version": sheet_changes.versao(report_id),
+        "validation": {
+            "ok": validation.get("ok", True),
+            "missing_columns": validation.get("missing_columns", [])
+        }
+    }
+
+
+def estado_planilhas() -> Dict[str, Any]:
+    """Estado completo enviado a cada cliente SSE ao conectar"""
+    snapshot = sheets_state.atual()
+    return {
+        "loading": snapshot.loading,
+        "lastUpdate": snapshot.last_update,
+        "reports": {config["id"]: estado_relatorio(config["id"], snapshot) for config in REPORTS_CONFIG}
+    }
+
+
+def planilha_sem_alteracoes(config: Dict[str, Any]):
+    """Origem sem alterações: só registra a verificação (sem parse nem histórico)"""
+    cache_service.touch_source_meta(config["id"])
+    print(f"⏭️ {config['label']} sem alterações")
+    evento = dict(estado_relatorio(config["id"]), status="unchanged")
+    sheet_events.publicar("report", evento)
+    return evento
+
+
+def usar_cache_planilha(config: Dict[str, Any], erro: Exception):
+    """Falha ao baixar a planilha
+    
+    Com a planilha já publicada (atualização em segundo plano), os dados
+    atuais continuam valendo e só o erro é registrado. Sem snapshot (início
+    a frio), publica a versão em cache SQLite ou, na falta dela, vazio.
+    """
+    print(f"❌ Falha em {config['label']}: {str(erro)}")
+    
+    if config["id"] in sheets_state.atual().data:
+        print("   ⏸️ Mantendo a versão publicada")
+    else:
+        cached = cache_service.get_report_cache(config["id"])
+        if cached:
+            print(f"   📦 Usando versão em cache ({cached['row_count']} linhas)")
+            publicar_caches({config["id"]: cached}, {"ok": False})
+        else:
+            atualizar_relatorio(config["id"], [])
+    evento = dict(estado_relatorio(config["id"]), status="error", error=str(erro))
+    sheet_events.publicar("report", evento)
+    return evento
+
+
+# Carga em andamento de cada planilha (recarga manual e agendada compartilham)
+cargas_planilha: Dict[str, asyncio.Task] = {}
+
+
+async def carregar_planilha(config: Dict[str, Any]):
+    """Baixa uma planilha, reaproveitando a carga dela que já estiver em andamento"""
+    tarefa = cargas_planilha.get(config["id"])
+    if tarefa is None or tarefa.done():
+        tarefa = asyncio.create_task(_carregar_planilha(config))
+        cargas_planilha[config["id"]] = tarefa
+    reload_jobs.progresso(config["id"], "fetching")
+    evento = await asyncio.shield(tarefa)
+    reload_jobs.progresso(config["id"], evento["status"], **{k: v for k, v in evento.items() if k != "status"})
+    return evento
+
+
+async def _carregar_planilha(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Baixa uma planilha; hash, parse e SQLite rodam fora do event loop
+    
+    Com os dados já em memória, a requisição é condicional (ETag /
+    Last-Modified) e um 304 ou corpo de mesmo hash encerra a carga
+    sem parse, validação ou gravação no SQLite: o corpo é só guardado
+    e hasheado, e o CSV é processado apenas quando o hash muda.
+    """
+    report_id = config["id"]
+    try:
+        meta = report_source_meta.get(report_id)
+        if meta is None:
+            meta = await asyncio.to_thread(cache_service.get_source_meta, report_id) or {}
+            report_source_meta[report_id] = meta
+        # Com o SQLite atrasado (gravação falhou) a carga segue até gravar
+        em_memoria = report_id in sheets_state.atual().data and report_id not in report_sqlite_pendente
+        
+        validadores = (meta.get("etag"), meta.get("last_modified")) if em_memoria and meta else (None, None)
+        async with sheets_service.abrir(config, *validadores) as response:
+            if response.status_code == 304:
+                return await asyncio.to_thread(planilha_sem_alteracoes, config)
+            
+            corpo = await baixar_stream(response.aiter_bytes())
+            encoding = response.charset_encoding or "utf-8"
+            novo_meta = {
+                "content_hash": corpo.content_hash,
+                "etag": response.headers.get("etag"),
+                "last_modified": response.headers.get("last-modified")
+            }
+        
+        try:
+            if em_memoria and meta.get("content_hash") == corpo.content_hash:
+                return await asyncio.to_thread(planilha_sem_alteracoes, config)
+            csv_ingerido = await asyncio.to_thread(ingerir_corpo, corpo, encoding)
+        finally:
+            corpo.fechar()
+        
+        salvar = report_id in report_sqlite_pendente or meta.get("content_hash") != csv_ingerido.content_hash
+        return await asyncio.to_thread(processar_planilha, config, csv_ingerido, novo_meta, salvar)
+    except Exception as e:
+        return await asyncio.to_thread(usar_cache_planilha, config, e)
+
+
+def publicar_cache_fresco() -> bool:
+    """Publica o SQLite se todas as planilhas estiverem dentro de SHEETS_CACHE_MAX_HORAS"""
+    for config in REPORTS_CONFIG:
+        if not cache_service.is_cache_fresh(config["id"], max_age_hours=SHEETS_CACHE_MAX_HORAS):
+            return False
+    
+    print(f"✅ Usando dados do cache (atualizados nas últimas {SHEETS_CACHE_MAX_HORAS}h)")
+    caches = {}
+    for config in REPORTS_CONFIG:
+        cached = cache_service.get_report_cache(config["id"])
+        if cached:
+            caches[config["id"]] = cached
+            print(f"  📋 {config['label']}: {cached['row_count']} linhas (cache)")
+            reload_jobs.progresso(config["id"], "cache", rows=cached["row_count"])
+    publicar_caches(caches, {"ok": True}, loading=False, last_update=datetime.now().isoformat())
+    return True
 
 
 async def carregar_dados_sheets(force_refresh: bool = False):
@@ -607,133 +1240,302 @@ async def carregar_dados_sheets(force_refresh: bool = False):
     Args:
         force_refresh: Se True, ignora cache e busca do Google Sheets
     """
-    global is_loading_sheets, last_update_time
-    is_loading_sheets = True
+    sheets_state.publicar(loading=True)
     print("📥 Carregando planilhas do Google Sheets...")
+    sheet_events.publicar("load_start", {"force": force_refresh, "reports": [c["id"] for c in REPORTS_CONFIG]})
     
-    # Se não forçar, tenta usar cache (24h)
-    if not force_refresh:
-        all_fresh = True
-        for config in REPORTS_CONFIG:
-            if not cache_service.is_cache_fresh(config["id"], max_age_hours=24):
-                all_fresh = False
-                break
-        
-        if all_fresh:
-            print("✅ Usando dados do cache (atualizados nas últimas 24h)")
-            for config in REPORTS_CONFIG:
-                cached = cache_service.get_report_cache(config["id"])
-                if cached:
-                    report_data_cache[config["id"]] = cached["data"]
-                    report_validation_status[config["id"]] = cached.get("validation_status", {"ok": True})
-                    print(f"  📋 {config['label']}: {cached['row_count']} linhas (cache)")
-            
-            is_loading_sheets = False
-            last_update_time = datetime.now().isoformat()
-            print("🟢 Carga concluída via cache")
-            return report_data_cache
+    # Se não forçar, tenta usar cache (SHEETS_CACHE_MAX_HORAS)
+    if not force_refresh and await asyncio.to_thread(publicar_cache_fresco):
+        query_cache.invalidate()
+        print("🟢 Carga concluída via cache")
+        sheet_events.publicar("load_finish", estado_planilhas())
+        return sheets_state.atual().data
     
-    for config in REPORTS_CONFIG:
-        try:
-            response = requests.get(config["url"], timeout=10)
-            response.raise_for_status()
-            
-            text = response.text
-            data = parse_csv_text(text)
-            
-            # Validar schema
-            validation = validate_report_schema(config["id"], data)
-            report_validation_status[config["id"]] = validation
-            
-            if validation["ok"]:
-                report_data_cache[config["id"]] = data
-                print(f"✅ {config['label']} carregado ({len(data)} linhas) - Schema v{validation['version']} OK")
-            else:
-                report_data_cache[config["id"]] = data  # Carrega mesmo com erro
-                print(f"⚠️ {config['label']} carregado ({len(data)} linhas) - Schema inválido")
-                print(f"   Colunas faltando: {validation.get('missing_columns', [])}")
-                if validation.get('extra_columns'):
-                    print(f"   Colunas extras: {validation['extra_columns']}")
-            
-            # Salvar no cache SQLite
-            cache_service.save_report_cache(
-                report_id=config["id"],
-                label=config["label"],
-                data=data,
-                validation_status=validation
-            )
-            
-        except Exception as e:
-            print(f"❌ Falha em {config['label']}: {str(e)}")
-            
-            # Tentar buscar do cache como fallback
-            cached = cache_service.get_report_cache(config["id"])
-            if cached:
-                print(f"   📦 Usando versão em cache ({cached['row_count']} linhas)")
-                report_data_cache[config["id"]] = cached["data"]
-                report_validation_status[config["id"]] = cached.get("validation_status", {"ok": False})
-            else:
-                report_data_cache[config["id"]] = []
+    # Downloads concorrentes: o tempo total tende ao da planilha mais lenta
+    await asyncio.gather(*(carregar_planilha(config) for config in REPORTS_CONFIG))
     
-    is_loading_sheets = False
-    last_update_time = datetime.now().isoformat()
+    sheets_state.publicar(loading=False, last_update=datetime.now().isoformat())
+    query_cache.invalidate()
     print("🟢 Carga finalizada")
-    return report_data_cache
+    sheet_events.publicar("load_finish", estado_planilhas())
+    return sheets_state.atual().data
+
+
+async def atualizar_planilha_agendada(config: Dict[str, Any]):
+    """Atualização periódica de uma planilha (os leitores seguem com a versão atual)"""
+    evento = await carregar_planilha(config)
+    if evento["status"] == "error":
+        # Dados publicados mantidos; o erro fica no status do agendador
+        raise RuntimeError(evento["error"])
+    sheets_state.publicar(last_update=datetime.now().isoformat())
+
+
+def carregar_snapshot() -> Dict[str, bool]:
+    """Publica a última versão salva no SQLite de cada planilha (qualquer idade)
+    
+    Returns:
+        Dict com "completo" (todas as planilhas no SQLite) e "fresco"
+        (todas dentro de SHEETS_CACHE_MAX_HORAS)
+    """
+    completo = fresco = True
+    caches = {}
+    for config in REPORTS_CONFIG:
+        cached = cache_service.get_report_cache(config["id"]) if cache_service else None
+        if not cached:
+            completo = fresco = False
+            continue
+        caches[config["id"]] = cached
+        print(f"  📋 {config['label']}: {cached['row_count']} linhas (snapshot)")
+        if not cache_service.is_cache_fresh(config["id"], max_age_hours=SHEETS_CACHE_MAX_HORAS):
+            fresco = False
+    if caches:
+        # Um único snapshot com todas as planilhas do SQLite
+        publicar_caches(caches, {"ok": True}, last_update=max(c["last_update"] for c in caches.values()))
+    return {"completo": completo, "fresco": fresco}
+
+
+async def carga_inicial(snapshot: Dict[str, bool]):
+    """Atualiza as planilhas da rede em segundo plano após o snapshot"""
+    try:
+        if not snapshot["fresco"]:
+            job = submeter_recarga(force=True, usuario="startup")
+            await reload_jobs.aguardar(job["job_id"])
+    finally:
+        sheets_state.publicar(ready=True)
+        sheets_scheduler.iniciar(REPORTS_CONFIG, atualizar_planilha_agendada)
 
 
 @app.on_event("startup")
 async def startup_event():
-    """Carrega dados das planilhas ao iniciar o servidor"""
-    await carregar_dados_sheets()
+    """Publica o snapshot do SQLite e atualiza da rede sem bloquear o início"""
+    global carga_inicial_task
+    sheet_events.configurar_loop(asyncio.get_running_loop())
+    snapshot = await asyncio.to_thread(carregar_snapshot)
+    # Pronto para tráfego: todas as planilhas no snapshot (mesmo antigas)
+    # ou, senão, quando a primeira carga terminar
+    sheets_state.publicar(ready=snapshot["completo"])
+    print(f"🚀 Snapshot {'completo' if snapshot['completo'] else 'parcial'}, atualizando em segundo plano")
+    carga_inicial_task = asyncio.create_task(carga_inicial(snapshot))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Para as atualizações agendadas e fecha o pool de conexões HTTP"""
+    if carga_inicial_task and not carga_inicial_task.done():
+        carga_inicial_task.cancel()
+        await asyncio.gather(carga_inicial_task, return_exceptions=True)
+    await sheets_scheduler.parar()
+    await sheets_service.fechar()
+
+
+def submeter_recarga(force: bool, usuario: str) -> Dict[str, Any]:
+    """Recarga de todas as planilhas (single-flight: reaproveita a que está em andamento)"""
+    return reload_jobs.submeter(
+        lambda: carregar_dados_sheets(force_refresh=force),
+        [config["id"] for config in REPORTS_CONFIG],
+        force=force,
+        usuario=usuario
+    )
 
 
 @app.get("/api/sheets/reload")
-def reload_sheets(force: bool = True, user: dict = Depends(get_user)):
+async def reload_sheets(force: bool = True, wait: bool = True, user: dict = Depends(get_user)):
     """Recarrega dados das planilhas do Google Sheets
     
+    Chamadas simultâneas compartilham a mesma recarga.
+    
     Args:
         force: Se True (padrão), ignora cache e busca do Google Sheets
+        wait: Se False, responde na hora (202) com o job; o progresso fica em
+              /api/sheets/reload/{job_id} e nos eventos SSE
+    """
+    job = submeter_recarga(force, user["email"])
+    if not wait:
+        return RespostaJSON(job, status_code=202)
+    
+    status = await reload_jobs.aguardar(job["job_id"])
+    if status["erro"]:
+        raise HTTPException(500, f"Erro ao recarregar planilhas: {status['erro']}")
+    
+    snapshot = sheets_state.atual()
+    summary = {
+        config["id"]: {
+            "label": config["label"],
+            "rows": len(snapshot.rows(config["id"]))
+        }
+        for config in REPORTS_CONFIG
+    }
+    
+    return {
+        "status": "success",
+        "message": "Dados recarregados com sucesso",
+        "timestamp": datetime.now().isoformat(),
+        "data": summary,
+        "job": dict(status, deduplicado=job["deduplicado"])
+    }
+
+
+@app.get("/api/sheets/reload/{job_id}")
+def reload_status(job_id: str, user: dict = Depends(get_user)):
+    """Status e progresso por relatório de uma recarga"""
+    status = reload_jobs.status(job_id)
+    if not status:
+        raise HTTPException(404, f"Recarga '{job_id}' não encontrada")
+    return status
+
+
+@app.get("/api/events")
+async def sheet_events_stream(request: Request, user: dict = Depends(get_user_sse)):
+    """Eventos das planilhas (SSE): load_start, report, load_finish
+    
+    Ao conectar, o cliente recebe um evento "status" com o estado completo
+    (ou, ao reconectar com Last-Event-ID, os eventos perdidos). Substitui o
+    polling de /api/status com uma conexão ociosa por aba.
     """
     try:
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        result = loop.run_until_complete(carregar_dados_sheets(force_refresh=force))
-        
-        summary = {
-            config["id"]: {
-                "label": config["label"],
-                "rows": len(report_data_cache.get(config["id"], []))
-            }
-            for config in REPORTS_CONFIG
+        ultimo_id = int(request.headers.get("last-event-id", ""))
+    except ValueError:
+        ultimo_id = None
+    return StreamingResponse(
+        sheet_events.assinar(estado_planilhas, ultimo_id, request.is_disconnected),
+        media_type=MEDIA_TYPE_SSE,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/api/sheets/schedule")
+def sheets_schedule(user: dict = Depends(get_user)):
+    """Última e próxima atualização automática de cada planilha"""
+    return {
+        "reports": sheets_scheduler.status(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+@app.get("/api/sheets/{report_id}/changes")
+def get_sheet_changes(report_id: str, request: Request, since: int = 0, user: dict = Depends(get_user)):
+    """Linhas incluídas, alteradas ou removidas desde a versão do cliente
+    
+    Args:
+        since: Última versão que o cliente tem (0 = nenhuma)
+    
+    Quando o histórico não cobre o intervalo (ou o delta seria maior que o
+    relatório), devolve o snapshot completo com "full": true. As linhas
+    são identificadas pela chave em "keys"/"upserts".
+    """
+    # Versão lida antes do snapshot: no pior caso o cliente recebe de novo
+    # alterações já aplicadas (upserts/deletes são idempotentes)
+    version = sheet_changes.versao(report_id)
+    snapshot = sheets_state.atual()
+    config = next((c for c in REPORTS_CONFIG if c["id"] == report_id), None)
+    if config is None or report_id not in snapshot.data:
+        raise HTTPException(404, f"Relatório '{report_id}' não encontrado")
+    
+    etag = snapshot.etag(report_id, extra=["changes", since, version])
+    resposta = nao_modificado(request, etag)
+    if resposta:
+        return resposta
+    
+    data = snapshot.rows(report_id)
+    alteracoes = sheet_changes.desde(report_id, since)
+    if alteracoes is not None and len(alteracoes["upserts"]) < max(len(data), 1):
+        corpo = {
+            "id": report_id,
+            "full": False,
+            "since": since,
+            "version": version,
+            "upserts": alteracoes["upserts"],
+            "deletes": alteracoes["deletes"],
+            "count": len(data)
         }
-        
-        return {
-            "status": "success",
-            "message": "Dados recarregados com sucesso",
-            "timestamp": datetime.now().isoformat(),
-            "data": summary
+    else:
+        corpo = {
+            "id": report_id,
+            "full": True,
+            "since": since,
+            "version": version,
+            "keys": sheet_changes.chaves(report_id, data, config.get("key_columns")),
+            "data": data,
+            "count": len(data)
         }
-    except Exception as e:
-        raise HTTPException(500, f"Erro ao recarregar planilhas: {str(e)}")
+    return RespostaJSON(corpo, headers=cabecalhos_cache(etag))
 
 
 @app.get("/api/sheets/{report_id}")
-def get_sheet_data(report_id: str, user: dict = Depends(get_user)):
-    """Retorna dados de uma planilha específica"""
-    if report_id not in report_data_cache:
-        raise HTTPException(404, f"Relatório '{report_id}' não encontrado")
+def get_sheet_data(
+    report_id: str,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    order_by: Optional[str] = None,
+    stream: Optional[str] = None,
+    request: Request = None,
+    user: dict = Depends(get_user)
+):
+    """Retorna dados de uma planilha específica
     
-    data = report_data_cache[report_id]
-    validation = report_validation_status.get(report_id, {"ok": True})
+    Args:
+        limit: Tamanho da página (sem limit, retorna todas as linhas)
+        cursor: Cursor devolvido pela página anterior (next_cursor)
+        fields: Colunas a retornar, separadas por vírgula
+        order_by: Coluna de ordenação ("-coluna" para decrescente)
+        stream: "ndjson" ou "json" para enviar as linhas incrementalmente
+            (também ativado por Accept: application/x-ndjson)
+    
+    Com Accept: application/msgpack ou application/vnd.apache.arrow.stream
+    a resposta vem em MessagePack ou Arrow IPC (colunar).
+    """
+    snapshot = sheets_state.atual()
+    if report_id not in snapshot.data:
+        raise HTTPException(404, f"Relatório '{report_id}' não encontrado")
     
-    return {
+    data = snapshot.data[report_id]
+    validation = snapshot.validacao(report_id)
+    
+    binario = formato_binario(request)
+    modo = None if binario else modo_stream(stream, request)
+    
+    # Nada mudou desde a última leitura do cliente: 304 sem serializar.
+    # ETag, Last-Modified e a versão do cursor vêm do mesmo snapshot das linhas
+    etag = snapshot.etag(report_id, extra=[limit, cursor, fields, order_by, binario, modo])
+    modificado = snapshot.modificado(report_id)
+    resposta = nao_modificado(request, etag, modificado)
+    if resposta:
+        return resposta
+    cache_headers = cabecalhos_cache(etag, modificado)
+    versao = snapshot.versao(report_id)
+    
+    if binario or modo:
+        store = obter_store_planilha(report_id, data)
+        pagina = selecionar_pagina(store, range(len(store)), limit, cursor, fields, order_by, versao)
+        envelope = {"id": report_id, "count": len(data), "validation": validation, "timestamp": snapshot.last_update}
+        if binario:
+            resposta = resposta_binaria(binario, envelope, "data", store, pagina, len(store))
+        else:
+            resposta = resposta_stream(modo, envelope, "data", store, pagina, len(store))
+        resposta.headers.update(cache_headers)
+        return resposta
+    
+    if limit is None and not cursor and not fields and not order_by:
+        return RespostaJSON({
+            "id": report_id,
+            "data": data,
+            "count": len(data),
+            "validation": validation,
+            "timestamp": snapshot.last_update
+        }, headers=cache_headers)
+    
+    store = obter_store_planilha(report_id, data)
+    pagina = paginar(store, range(len(store)), limit, cursor, fields, order_by, versao)
+    
+    return RespostaJSON({
         "id": report_id,
-        "data": data,
+        "data": pagina["dados"],
         "count": len(data),
+        "next_cursor": pagina["next_cursor"],
         "validation": validation,
-        "timestamp": last_update_time
-    }
+        "timestamp": snapshot.last_update
+    }, headers=cache_headers)
     config = next((c for c in REPORTS_CONFIG if c["id"] == report_id), None)
     
     return {
@@ -746,22 +1548,39 @@ def get_sheet_data(report_id: str, user: dict = Depends(get_user)):
 
 
 @app.get("/api/status")
-def get_status():
+def get_status(request: Request):
     """Retorna status do carregamento das planilhas"""
-    return {
-        "loading": is_loading_sheets,
-        "lastUpdate": last_update_time,
-        "reports": list(report_data_cache.keys())
-    }
+    snapshot = sheets_state.atual()
+    chaves = list(snapshot.data.keys())
+    # Sem Last-Modified: loading/lastUpdate mudam sem mudar a versão dos dados
+    uploads = (versoes_dados.obter("uploads") or {}).get("hash")
+    etag = snapshot.etag(*chaves, extra=[uploads, snapshot.loading, snapshot.last_update])
+    resposta = nao_modificado(request, etag)
+    if resposta:
+        return resposta
+    
+    return RespostaJSON({
+        "loading": snapshot.loading,
+        "lastUpdate": snapshot.last_update,
+        "reports": chaves
+    }, headers=cabecalhos_cache(etag))
 
 
 @app.get("/api/sheets")
-def list_sheets(user: dict = Depends(get_user)):
+def list_sheets(request: Request, user: dict = Depends(get_user)):
     """Lista todas as planilhas disponíveis com status de validação"""
+    snapshot = sheets_state.atual()
+    chaves = [config["id"] for config in REPORTS_CONFIG]
+    etag = snapshot.etag(*chaves)
+    modificado = snapshot.modificado(*chaves)
+    resposta = nao_modificado(request, etag, modificado)
+    if resposta:
+        return resposta
+    
     sheets = []
     for config in REPORTS_CONFIG:
-        data = report_data_cache.get(config["id"], [])
-        validation = report_validation_status.get(config["id"], {"ok": True})
+        data = snapshot.rows(config["id"])
+        validation = snapshot.validacao(config["id"])
         
         sheets.append({
             "id": config["id"],
@@ -777,31 +1596,36 @@ def list_sheets(user: dict = Depends(get_user)):
             }
         })
     
-    return {
+    return RespostaJSON({
         "sheets": sheets,
         "total": len(sheets),
         "timestamp": datetime.now().isoformat()
-    }
+    }, headers=cabecalhos_cache(etag, modificado))
 
 
 @app.get("/api/health")
 def api_health():
     """Endpoint de saúde com informações detalhadas dos relatórios"""
     reports_status = {}
+    agenda = sheets_scheduler.status()
+    snapshot = sheets_state.atual()
     
     for config in REPORTS_CONFIG:
-        data = report_data_cache.get(config["id"], [])
+        data = snapshot.rows(config["id"])
+        refresh = agenda.get(config["id"], {})
         reports_status[config["id"]] = {
             "ok": len(data) > 0,
             "rows": len(data),
-            "lastUpdate": last_update_time,
+            "lastUpdate": snapshot.last_update,
+            "lastRefresh": refresh.get("last_refresh"),
+            "nextRefresh": refresh.get("next_refresh"),
             "label": config["label"]
         }
     
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "loading": is_loading_sheets,
+        "loading": snapshot.loading,
         "reports": reports_status
     }
 
@@ -819,12 +1643,28 @@ def cache_info(user: dict = Depends(get_user)):
             "cached_reports": cached_reports,
             "total_cached": len(cached_reports),
             "recent_updates": history,
+            "source_cache": source_cache.stats(),
+            "export_cache": export_cache.stats(),
+            "query_cache": query_cache.stats(),
+            "versions": versoes_dados.stats(),
+            "change_log": sheet_changes.stats(),
+            "events": sheet_events.stats(),
+            "snapshot": sheets_state.stats(),
             "database_path": str(cache_service.db_path)
         }
     except Exception as e:
         raise HTTPException(500, f"Erro ao buscar informações do cache: {str(e)}")
 
 
+@app.get("/api/metrics/compressao")
+def compression_metrics(user: dict = Depends(get_user)):
+    """Bytes antes/depois da compressão por rota"""
+    return {
+        "timestamp": datetime.now().isoformat(),
+        **metricas_compressao.stats()
+    }
+
+
 @app.post("/api/cache/clear")
 def clear_cache(days_old: int = 30, user: dict = Depends(get_user)):
     """Remove caches mais antigos que X dias
@@ -845,9 +1685,24 @@ def clear_cache(days_old: int = 30, user: dict = Depends(get_user)):
 
 @app.get("/health")
 def health():
+    """Liveness: o processo está de pé (não depende das planilhas)"""
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
 
+@app.get("/health/ready")
+def readiness():
+    """Readiness: 503 até haver dados das planilhas para servir"""
+    snapshot = sheets_state.atual()
+    corpo = {
+        "ready": snapshot.ready,
+        "loading": snapshot.loading,
+        "lastUpdate": snapshot.last_update,
+        "reports": {config["id"]: len(snapshot.rows(config["id"])) for config in REPORTS_CONFIG},
+        "timestamp": datetime.now().isoformat()
+    }
+    return RespostaJSON(corpo, status_code=200 if snapshot.ready else 503)
+
+
 
 if __name__ == "__main__":
     import uvicorn
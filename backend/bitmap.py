@@ -0,0 +1,144 @@
+"""
+Bitmap compactado de posições de linhas (estilo "roaring")
+Usado pelos índices de STATUS/CODVD do armazenamento de relatórios
+"""
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, Iterator, Union
+
+# Cada contêiner cobre 2^16 posições. Contêineres esparsos guardam as
+# posições (16 bits baixos) num array ordenado; os densos viram um int
+# usado como conjunto de bits.
+CHUNK_BITS = 16
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+ARRAY_MAX = 4096
+BITSET_BYTES = (1 << CHUNK_BITS) // 8
+
+Container = Union[array, int]
+
+
+def _array_to_bitset(valores: Iterable[int]) -> int:
+    buffer = bytearray(BITSET_BYTES)
+    for v in valores:
+        buffer[v >> 3] |= 1 << (v & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def _bitset_to_array(bits: int) -> array:
+    resultado = array("H")
+    buffer = bits.to_bytes(BITSET_BYTES, "little")
+    for i, byte in enumerate(buffer):
+        if byte:
+            base = i << 3
+            for j in range(8):
+                if byte >> j & 1:
+                    resultado.append(base + j)
+    return resultado
+
+
+def _normalizar(container: Container) -> Container:
+    """Escolhe a representação mais compacta para o contêiner"""
+    if isinstance(container, int):
+        if container.bit_count() <= ARRAY_MAX:
+            return _bitset_to_array(container)
+        return container
+    if len(container) > ARRAY_MAX:
+        return _array_to_bitset(container)
+    return container
+
+
+def _tamanho(container: Container) -> int:
+    return container.bit_count() if isinstance(container, int) else len(container)
+
+
+def _and(a: Container, b: Container) -> Container:
+    if isinstance(a, int) and isinstance(b, int):
+        return _normalizar(a & b)
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        buffer = b.to_bytes(BITSET_BYTES, "little")
+        return array("H", (v for v in a if buffer[v >> 3] >> (v & 7) & 1))
+    menor, maior = (a, b) if len(a) <= len(b) else (b, a)
+    conjunto = set(maior)
+    return array("H", (v for v in menor if v in conjunto))
+
+
+def _or(a: Container, b: Container) -> Container:
+    if isinstance(a, int) and isinstance(b, int):
+        return a | b
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        return b | _array_to_bitset(a)
+    return _normalizar(array("H", sorted(set(a) | set(b))))
+
+
+class Bitmap:
+    """Conjunto imutável de posições (inteiros >= 0) com operações de bitmap"""
+
+    __slots__ = ("_containers",)
+
+    def __init__(self, containers: Dict[int, Container] = None):
+        self._containers = containers or {}
+
+    @classmethod
+    def from_sorted(cls, posicoes: Iterable[int]) -> "Bitmap":
+        """Cria o bitmap a partir de posições em ordem crescente"""
+        containers: Dict[int, Container] = {}
+        atual = None
+        chave = -1
+        for pos in posicoes:
+            alta = pos >> CHUNK_BITS
+            if alta != chave:
+                if atual is not None:
+                    containers[chave] = _normalizar(atual)
+                atual = array("H")
+                chave = alta
+            atual.append(pos & CHUNK_MASK)
+        if atual is not None:
+            containers[chave] = _normalizar(atual)
+        return cls(containers)
+
+    def __and__(self, other: "Bitmap") -> "Bitmap":
+        containers = {}
+        for chave, container in self._containers.items():
+            outro = other._containers.get(chave)
+            if outro is None:
+                continue
+            resultado = _and(container, outro)
+            if _tamanho(resultado):
+                containers[chave] = resultado
+        return Bitmap(containers)
+
+    def __or__(self, other: "Bitmap") -> "Bitmap":
+        containers = dict(self._containers)
+        for chave, outro in other._containers.items():
+            container = containers.get(chave)
+            containers[chave] = outro if container is None else _or(container, outro)
+        return Bitmap(containers)
+
+    def __len__(self) -> int:
+        return sum(_tamanho(c) for c in self._containers.values())
+
+    def __bool__(self) -> bool:
+        return bool(self._containers)
+
+    def __iter__(self) -> Iterator[int]:
+        for chave in sorted(self._containers):
+            container = self._containers[chave]
+            if isinstance(container, int):
+                container = _bitset_to_array(container)
+            base = chave << CHUNK_BITS
+            for v in container:
+                yield base + v
+
+    def __contains__(self, pos: int) -> bool:
+        container = self._containers.get(pos >> CHUNK_BITS)
+        if container is None:
+            return False
+        baixa = pos & CHUNK_MASK
+        if isinstance(container, int):
+            return bool(container >> baixa & 1)
+        i = bisect_left(container, baixa)
+        return i < len(container) and container[i] == baixa
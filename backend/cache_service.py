@@ -13,7 +13,7 @@ import logging
 logger = logging.getLogger(__name__)
 
 # Caminho do banco de dados
-DB_DIR = Path(__file__).parent.parent / "data"
+DB_DIR = Path(os.getenv("CACHE_DB_DIR", Path(__file__).parent.parent / "data"))
 DB_PATH = DB_DIR / "cache.db"
 
 class CacheService:
@@ -57,6 +57,35 @@ class CacheService:
                 )
             """)
             
+            # Colunas adicionadas depois da criação da tabela
+            colunas = {row[1] for row in cursor.execute("PRAGMA table_info(report_cache)")}
+            if "version" not in colunas:
+                cursor.execute("ALTER TABLE report_cache ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            if "storage" not in colunas:
+                cursor.execute("ALTER TABLE report_cache ADD COLUMN storage TEXT NOT NULL DEFAULT 'blob'")
+            
+            # Linhas dos relatórios gravados por linha (storage = 'rows')
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS report_rows (
+                    report_id TEXT NOT NULL,
+                    row_key TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (report_id, row_key)
+                )
+            """)
+            
+            # Metadados HTTP da origem de cada relatório (requisição condicional)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS report_source (
+                    id TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    content_hash TEXT NOT NULL,
+                    checked_at TEXT NOT NULL
+                )
+            """)
+            
             # Tabela de log de queries de usuários
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS user_queries (
@@ -109,6 +138,7 @@ class CacheService:
                 (id, label, data, row_count, last_update, validation_status)
                 VALUES (?, ?, ?, ?, ?, ?)
             """, (report_id, label, data_json, row_count, timestamp, validation_json))
+            cursor.execute("DELETE FROM report_rows WHERE report_id = ?", (report_id,))
             
             # Registra no histórico
             cursor.execute("""
@@ -127,6 +157,120 @@ class CacheService:
         finally:
             conn.close()
     
+    def save_report_delta(
+        self,
+        report_id: str,
+        label: str,
+        version: int,
+        row_count: int,
+        validation_status: Optional[Dict],
+        upserts: List[tuple],
+        deletes: List[str],
+        moved: List[tuple],
+        reset: bool = False
+    ) -> bool:
+        """
+        Aplica as alterações de uma carga gravando apenas as linhas afetadas
+        
+        Args:
+            report_id: ID único do relatório
+            label: Nome amigável do relatório
+            version: Nova versão (histórico de alterações)
+            row_count: Total de linhas após as alterações
+            validation_status: Status de validação do schema
+            upserts: (chave, posição, linha) incluídas ou alteradas
+            deletes: Chaves das linhas excluídas
+            moved: (chave, nova posição) das linhas iguais que mudaram de lugar
+            reset: Substitui todas as linhas do relatório
+            
+        Returns:
+            True se salvou com sucesso
+        """
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            timestamp = datetime.now().isoformat()
+            validation_json = json.dumps(validation_status) if validation_status else None
+            
+            if reset:
+                cursor.execute("DELETE FROM report_rows WHERE report_id = ?", (report_id,))
+            else:
+                # Delta só se aplica sobre linhas já gravadas por linha; sobre
+                # um blob legado as linhas inalteradas se perderiam
+                atual = cursor.execute(
+                    "SELECT storage FROM report_cache WHERE id = ?", (report_id,)
+                ).fetchone()
+                if not atual or atual[0] != "rows":
+                    raise ValueError(f"{report_id} não está gravado por linha; use reset=True")
+            cursor.executemany("""
+                INSERT OR REPLACE INTO report_rows (report_id, row_key, position, data)
+                VALUES (?, ?, ?, ?)
+            """, ((report_id, key, pos, json.dumps(row, ensure_ascii=False)) for key, pos, row in upserts))
+            cursor.executemany(
+                "DELETE FROM report_rows WHERE report_id = ? AND row_key = ?",
+                ((report_id, key) for key in deletes)
+            )
+            cursor.executemany(
+                "UPDATE report_rows SET position = ? WHERE report_id = ? AND row_key = ?",
+                ((pos, report_id, key) for key, pos in moved)
+            )
+            
+            # Linhas ficam em report_rows; data guarda só um marcador
+            cursor.execute("""
+                INSERT INTO report_cache
+                (id, label, data, row_count, last_update, validation_status, version, storage)
+                VALUES (?, ?, '[]', ?, ?, ?, ?, 'rows')
+                ON CONFLICT(id) DO UPDATE SET
+                    label = excluded.label, data = excluded.data, row_count = excluded.row_count,
+                    last_update = excluded.last_update, validation_status = excluded.validation_status,
+                    version = excluded.version, storage = excluded.storage
+            """, (report_id, label, row_count, timestamp, validation_json, version))
+            
+            # Registra no histórico
+            cursor.execute("""
+                INSERT INTO update_history 
+                (report_id, timestamp, row_count, success, error_message)
+                VALUES (?, ?, ?, 1, NULL)
+            """, (report_id, timestamp, row_count))
+            
+            conn.commit()
+            logger.info(
+                f"💾 Cache atualizado: {label} v{version} "
+                f"(+{len(upserts)} ~{len(moved)} -{len(deletes)} linhas)"
+            )
+            return True
+            
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"❌ Erro ao salvar alterações no cache: {e}")
+            return False
+        finally:
+            conn.close()
+    
+    def get_report_version(self, report_id: str) -> int:
+        """Versão atual do relatório no cache (0 se não existir)"""
+        conn = self._get_connection()
+        try:
+            row = conn.execute("SELECT version FROM report_cache WHERE id = ?", (report_id,)).fetchone()
+            return row[0] if row else 0
+        except Exception as e:
+            logger.error(f"❌ Erro ao buscar versão do cache: {e}")
+            return 0
+        finally:
+            conn.close()
+    
+    def get_report_storage(self, report_id: str) -> Optional[str]:
+        """Formato das linhas no cache ('rows' ou 'blob'; None se não existir)"""
+        conn = self._get_connection()
+        try:
+            row = conn.execute("SELECT storage FROM report_cache WHERE id = ?", (report_id,)).fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            logger.error(f"❌ Erro ao buscar formato do cache: {e}")
+            return None
+        finally:
+            conn.close()
+    
     def get_report_cache(self, report_id: str) -> Optional[Dict[str, Any]]:
         """
         Busca relatório do cache
@@ -135,13 +279,13 @@ class CacheService:
             report_id: ID do relatório
             
         Returns:
-            Dict com {data, row_count, last_update, validation_status} ou None
+            Dict com {data, row_count, last_update, validation_status, version} ou None
         """
         conn = self._get_connection()
         try:
             cursor = conn.cursor()
             cursor.execute("""
-                SELECT data, row_count, last_update, validation_status, label
+                SELECT data, row_count, last_update, validation_status, label, version, storage
                 FROM report_cache
                 WHERE id = ?
             """, (report_id,))
@@ -150,14 +294,25 @@ class CacheService:
             if not row:
                 return None
             
-            data_json, row_count, last_update, validation_json, label = row
+            data_json, row_count, last_update, validation_json, label, version, storage = row
+            
+            if storage == "rows":
+                cursor.execute("""
+                    SELECT data FROM report_rows
+                    WHERE report_id = ?
+                    ORDER BY position
+                """, (report_id,))
+                data = [json.loads(linha) for (linha,) in cursor]
+            else:
+                data = json.loads(data_json)
             
             return {
-                "data": json.loads(data_json),
+                "data": data,
                 "row_count": row_count,
                 "last_update": last_update,
                 "validation_status": json.loads(validation_json) if validation_json else None,
-                "label": label
+                "label": label,
+                "version": version
             }
             
         except Exception as e:
@@ -168,7 +323,8 @@ class CacheService:
     
     def is_cache_fresh(self, report_id: str, max_age_hours: int = 24) -> bool:
         """
-        Verifica se o cache está atualizado
+        Verifica se o cache está atualizado (salvo ou confirmado sem
+        alterações na origem dentro do prazo)
         
         Args:
             report_id: ID do relatório
@@ -177,15 +333,111 @@ class CacheService:
         Returns:
             True se o cache existe e está dentro do prazo
         """
-        cached = self.get_report_cache(report_id)
-        if not cached:
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT c.last_update, s.checked_at
+                FROM report_cache c
+                LEFT JOIN report_source s ON s.id = c.id
+                WHERE c.id = ?
+            """, (report_id,))
+            row = cursor.fetchone()
+        except Exception as e:
+            logger.error(f"❌ Erro ao verificar cache: {e}")
             return False
+        finally:
+            conn.close()
         
-        last_update = datetime.fromisoformat(cached["last_update"])
+        if not row:
+            return False
+        
+        last_update = max(datetime.fromisoformat(v) for v in row if v)
         age = datetime.now() - last_update
         
         return age < timedelta(hours=max_age_hours)
     
+    def get_source_meta(self, report_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Busca ETag/Last-Modified e hash do conteúdo da origem do relatório
+        
+        Returns:
+            Dict com {etag, last_modified, content_hash, checked_at} ou None
+        """
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT etag, last_modified, content_hash, checked_at
+                FROM report_source
+                WHERE id = ?
+            """, (report_id,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            
+            etag, last_modified, content_hash, checked_at = row
+            return {
+                "etag": etag,
+                "last_modified": last_modified,
+                "content_hash": content_hash,
+                "checked_at": checked_at
+            }
+            
+        except Exception as e:
+            logger.error(f"❌ Erro ao buscar metadados da origem: {e}")
+            return None
+        finally:
+            conn.close()
+    
+    def save_source_meta(
+        self,
+        report_id: str,
+        content_hash: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None
+    ) -> bool:
+        """
+        Salva os metadados da origem após baixar um conteúdo novo
+        
+        Args:
+            report_id: ID do relatório
+            content_hash: Hash do corpo baixado
+            etag: ETag devolvida pela origem
+            last_modified: Last-Modified devolvido pela origem
+        """
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT OR REPLACE INTO report_source
+                (id, etag, last_modified, content_hash, checked_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (report_id, etag, last_modified, content_hash, datetime.now().isoformat()))
+            conn.commit()
+            return True
+            
+        except Exception as e:
+            logger.error(f"❌ Erro ao salvar metadados da origem: {e}")
+            return False
+        finally:
+            conn.close()
+    
+    def touch_source_meta(self, report_id: str):
+        """Marca a origem como verificada agora (conteúdo sem alterações)"""
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE report_source SET checked_at = ? WHERE id = ?
+            """, (datetime.now().isoformat(), report_id))
+            conn.commit()
+            
+        except Exception as e:
+            logger.error(f"❌ Erro ao atualizar metadados da origem: {e}")
+        finally:
+            conn.close()
+    
     def list_cached_reports(self) -> List[Dict[str, Any]]:
         """
         Lista todos os relatórios em cache
@@ -310,12 +562,22 @@ class CacheService:
             cursor = conn.cursor()
             cutoff = (datetime.now() - timedelta(days=days_old)).isoformat()
             
+            # Relatórios confirmados sem alterações recentemente não são obsoletos
             cursor.execute("""
                 DELETE FROM report_cache
                 WHERE last_update < ?
-            """, (cutoff,))
+                AND id NOT IN (SELECT id FROM report_source WHERE checked_at >= ?)
+            """, (cutoff, cutoff))
             
             deleted = cursor.rowcount
+            cursor.execute("""
+                DELETE FROM report_source
+                WHERE id NOT IN (SELECT id FROM report_cache)
+            """)
+            cursor.execute("""
+                DELETE FROM report_rows
+                WHERE report_id NOT IN (SELECT id FROM report_cache)
+            """)
             conn.commit()
             
             if deleted > 0:
@@ -0,0 +1,189 @@
+"""
+Ingestão de CSV em streaming (planilhas publicadas do Google Sheets)
+Os blocos de bytes da resposta HTTP são guardados em spool enquanto o hash
+do corpo é calculado; só quando o hash muda o corpo passa pelo decodificador
+incremental e pelo csv.DictReader direto para as linhas e colunas do
+relatório, sem montar o texto inteiro em memória
+"""
+import asyncio
+import codecs
+import csv
+import hashlib
+import os
+import queue
+import tempfile
+import threading
+from typing import Any, AsyncIterator, BinaryIO, Dict, Iterable, Iterator, List
+
+from report_store import ReportStore
+
+# Blocos aguardando o parser (limita a memória se a rede for mais rápida)
+INGEST_BLOCOS_EM_FILA = int(os.getenv("INGEST_BLOCOS_EM_FILA", "16"))
+# Corpo acima disso sai da memória para um arquivo temporário
+INGEST_SPOOL_MAX_MB = int(os.getenv("INGEST_SPOOL_MAX_MB", "16"))
+INGEST_BLOCO_LEITURA = 64 * 1024
+
+_FIM = object()
+
+
+class CorpoBaixado:
+    """Corpo da resposta guardado em spool, com hash e tamanho"""
+
+    __slots__ = ("arquivo", "content_hash", "bytes")
+
+    def __init__(self, arquivo: BinaryIO, content_hash: str, total_bytes: int):
+        self.arquivo = arquivo
+        self.content_hash = content_hash
+        self.bytes = total_bytes
+
+    def blocos(self) -> Iterator[bytes]:
+        """Relê o corpo do início em blocos"""
+        self.arquivo.seek(0)
+        while True:
+            bloco = self.arquivo.read(INGEST_BLOCO_LEITURA)
+            if not bloco:
+                return
+            yield bloco
+
+    def fechar(self):
+        self.arquivo.close()
+
+
+class CSVIngerido:
+    """Resultado da ingestão: linhas (dicts), versão colunar e hash do corpo"""
+
+    __slots__ = ("rows", "store", "content_hash", "bytes")
+
+    def __init__(self, rows: List[Dict[str, Any]], store: ReportStore, content_hash: str, total_bytes: int):
+        self.rows = rows
+        self.store = store
+        self.content_hash = content_hash
+        self.bytes = total_bytes
+
+
+def linhas_csv(blocos: Iterable[bytes], encoding: str = "utf-8") -> Iterator[str]:
+    """
+    Decodifica os blocos incrementalmente e devolve as linhas do CSV,
+    descartando linhas em branco ou só com espaços
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    resto = ""
+    for bloco in blocos:
+        partes = (resto + decoder.decode(bloco)).split("\n")
+        resto = partes.pop()
+        for linha in partes:
+            if linha.strip():
+                yield linha + "\n"
+    resto += decoder.decode(b"", final=True)
+    if resto.strip():
+        yield resto
+
+
+def ler_csv(linhas: Iterable[str]):
+    """
+    Lê as linhas com csv.DictReader, preenchendo ao mesmo tempo a lista de
+    dicts e as colunas do ReportStore
+
+    Returns:
+        (rows, store)
+    """
+    reader = csv.DictReader(linhas)
+    rows: List[Dict[str, Any]] = []
+    headers: List[Any] = []
+    columns: Dict[Any, List[Any]] = {}
+    destinos = []
+    for row in reader:
+        if len(row) != len(destinos):
+            # Primeira linha ou campos extras (chave None): novas colunas
+            for h in row:
+                if h not in columns:
+                    columns[h] = [None] * len(rows)
+                    headers.append(h)
+            destinos = list(columns.items())
+        rows.append(row)
+        for h, coluna in destinos:
+            coluna.append(row.get(h))
+    return rows, ReportStore(headers, columns, len(rows))
+
+
+def spool_blocos(blocos: Iterable[bytes]) -> "CorpoBaixado":
+    """Guarda os blocos num arquivo temporário (em memória até INGEST_SPOOL_MAX_MB) calculando o hash"""
+    digest = hashlib.blake2b(digest_size=16)
+    arquivo = tempfile.SpooledTemporaryFile(max_size=INGEST_SPOOL_MAX_MB * 1024 * 1024)
+    total = 0
+    try:
+        for bloco in blocos:
+            digest.update(bloco)
+            arquivo.write(bloco)
+            total += len(bloco)
+    except BaseException:
+        arquivo.close()
+        raise
+    return CorpoBaixado(arquivo, digest.hexdigest(), total)
+
+
+def ingerir_corpo(corpo: "CorpoBaixado", encoding: str = "utf-8") -> CSVIngerido:
+    """Decodifica e processa o corpo já baixado (linhas + ReportStore)"""
+    rows, store = ler_csv(linhas_csv(corpo.blocos(), encoding))
+    return CSVIngerido(rows, store, corpo.content_hash, corpo.bytes)
+
+
+def _blocos_da_fila(fila: queue.Queue) -> Iterator[bytes]:
+    while True:
+        bloco = fila.get()
+        if bloco is _FIM:
+            return
+        yield bloco
+
+
+def _fechar_corpo(futuro: asyncio.Future):
+    if not futuro.cancelled() and futuro.exception() is None:
+        futuro.result().fechar()
+
+
+async def baixar_stream(blocos: AsyncIterator[bytes]) -> "CorpoBaixado":
+    """
+    Recebe um stream assíncrono calculando o hash do corpo: o spool roda
+    numa thread, alimentada por uma fila limitada, enquanto o event loop
+    segue recebendo os blocos. O parse fica para depois da comparação do hash.
+    """
+    fila: queue.Queue = queue.Queue(maxsize=INGEST_BLOCOS_EM_FILA)
+    parado = threading.Event()
+
+    def consumir():
+        try:
+            return spool_blocos(_blocos_da_fila(fila))
+        finally:
+            parado.set()
+
+    def colocar(item):
+        # Espera espaço na fila, a não ser que o spool tenha parado (erro)
+        while not parado.is_set():
+            try:
+                fila.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    async def enviar(item):
+        try:
+            fila.put_nowait(item)
+        except queue.Full:
+            await asyncio.to_thread(colocar, item)
+
+    futuro = asyncio.get_running_loop().run_in_executor(None, consumir)
+    completo = False
+    try:
+        async for bloco in blocos:
+            if parado.is_set():
+                break
+            if bloco:
+                await enviar(bloco)
+        completo = True
+    finally:
+        # Encerra o spool também quando o download falha no meio
+        if not parado.is_set():
+            await enviar(_FIM)
+        if not completo:
+            futuro.add_done_callback(_fechar_corpo)
+    return await futuro
@@ -0,0 +1,646 @@
+"""
+Serviço de exportação de relatórios (Excel e PDF)
+Gera os arquivos em modo streaming, sem manter a planilha inteira em memória,
+e renderiza num pool de processos fora da thread da requisição, inclusive
+como jobs em segundo plano com acompanhamento de status. Os arquivos gerados
+ficam num cache endereçado por conteúdo com limite de tamanho/idade (LRU)
+"""
+import asyncio
+import hashlib
+import io
+import json
+import os
+import queue
+import threading
+import uuid
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from functools import lru_cache
+from itertools import chain, islice
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Union, BinaryIO
+import logging
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill
+from openpyxl.utils import get_column_letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib import colors
+from reportlab.lib.units import cm
+
+logger = logging.getLogger(__name__)
+
+# Linhas usadas para estimar a largura das colunas
+LARGURA_AMOSTRA = 500
+LARGURA_MAXIMA = 50
+
+# Tamanho dos blocos enviados ao cliente durante o streaming
+CHUNK_SIZE = 64 * 1024
+CHUNKS_EM_FILA = 16
+
+MEDIA_TYPE_EXCEL = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Processos de renderização (PDF e jobs de exportação)
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+EXPORT_MAX_JOBS_PENDENTES = int(os.getenv("EXPORT_MAX_JOBS_PENDENTES", "50"))
+EXPORT_RETENCAO_JOBS = 3600  # segundos que um job finalizado fica consultável
+
+# Orçamento do cache de arquivos exportados (data/exports)
+EXPORT_CACHE_MAX_MB = int(os.getenv("EXPORT_CACHE_MAX_MB", "500"))
+EXPORT_CACHE_MAX_HORAS = int(os.getenv("EXPORT_CACHE_MAX_HORAS", "24"))
+
+EXTENSOES = {"excel": "xlsx", "pdf": "pdf"}
+
+# PDF: linhas por bloco de tabela (tabelas menores paginam muito mais
+# rápido no reportlab)
+PDF_LINHAS_POR_TABELA = 500
+PDF_FONTE_CORPO = 7
+PDF_COLUNAS_RETRATO = 6
+
+
+def _largura(valor: Any) -> int:
+    return len(str(valor)) if valor is not None else 0
+
+
+def escrever_excel(destino: Union[Path, str, BinaryIO], headers: List[Any], linhas: Iterable[Sequence[Any]]):
+    """
+    Escreve um relatório Excel em uma única passada (workbook write-only)
+
+    Args:
+        destino: Caminho ou arquivo binário de saída (não precisa ser seekable)
+        headers: Nomes das colunas
+        linhas: Valores de cada linha, na ordem dos headers
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Relatório')
+
+    if headers:
+        # Estimar largura das colunas a partir de uma amostra limitada
+        linhas = iter(linhas)
+        amostra = list(islice(linhas, LARGURA_AMOSTRA))
+        larguras = [_largura(h) for h in headers]
+        for linha in amostra:
+            for i, valor in enumerate(linha):
+                tamanho = _largura(valor)
+                if tamanho > larguras[i]:
+                    larguras[i] = tamanho
+        for i, tamanho in enumerate(larguras, start=1):
+            ws.column_dimensions[get_column_letter(i)].width = min(tamanho + 2, LARGURA_MAXIMA)
+
+        # Cabeçalho estilizado
+        fonte = Font(bold=True)
+        fundo = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+        cabecalho = []
+        for h in headers:
+            cell = WriteOnlyCell(ws, value=h)
+            cell.font = fonte
+            cell.fill = fundo
+            cabecalho.append(cell)
+        ws.append(cabecalho)
+
+        for linha in chain(amostra, linhas):
+            ws.append(list(linha))
+
+    wb.save(destino)
+
+
+def _arquivo_temporario(destino: Path) -> Path:
+    return destino.with_name(f".{destino.name}.{uuid.uuid4().hex[:8]}.tmp")
+
+
+def _renderizar_atomico(funcao: Callable, destino: Union[Path, str], *args):
+    """Renderiza num arquivo temporário e só então o move para o destino"""
+    destino = Path(destino)
+    temporario = _arquivo_temporario(destino)
+    try:
+        funcao(temporario, *args)
+        os.replace(temporario, destino)
+    finally:
+        if temporario.exists():
+            temporario.unlink()
+
+
+class _SaidaEmFila(io.RawIOBase):
+    """Arquivo somente-escrita que entrega os bytes em blocos numa fila"""
+
+    def __init__(self, fila: "queue.Queue", cancelado: threading.Event, copia: Optional[BinaryIO] = None):
+        self._fila = fila
+        self._cancelado = cancelado
+        self._copia = copia
+        self._buffer = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, dados) -> int:
+        if self._cancelado.is_set():
+            raise IOError("Exportação cancelada pelo cliente")
+        self._buffer += dados
+        if len(self._buffer) >= CHUNK_SIZE:
+            self._enviar()
+        return len(dados)
+
+    def _enviar(self):
+        bloco = bytes(self._buffer)
+        self._buffer.clear()
+        if self._copia is not None:
+            self._copia.write(bloco)
+        while not self._cancelado.is_set():
+            try:
+                self._fila.put(bloco, timeout=1)
+                return
+            except queue.Full:
+                continue
+        raise IOError("Exportação cancelada pelo cliente")
+
+    def finalizar(self):
+        if self._buffer:
+            self._enviar()
+
+
+_FIM = object()
+
+
+def excel_stream(
+    headers: List[Any],
+    linhas: Iterable[Sequence[Any]],
+    destino: Optional[Path] = None,
+    ao_concluir: Optional[Callable[[Path], Any]] = None
+) -> Iterator[bytes]:
+    """
+    Gera o arquivo Excel em blocos enquanto ele é produzido
+
+    A escrita roda numa thread separada e a fila limitada aplica
+    backpressure: a planilha nunca fica inteira em memória.
+
+    Args:
+        destino: Se fornecido, grava também uma cópia do arquivo em disco
+        ao_concluir: Chamado com o destino quando a cópia estiver completa
+    """
+    fila: "queue.Queue" = queue.Queue(maxsize=CHUNKS_EM_FILA)
+    cancelado = threading.Event()
+
+    def produzir():
+        temporario = _arquivo_temporario(destino) if destino else None
+        copia = open(temporario, "wb") if temporario else None
+        saida = _SaidaEmFila(fila, cancelado, copia)
+        try:
+            escrever_excel(saida, headers, linhas)
+            saida.finalizar()
+            if copia is not None:
+                copia.close()
+                os.replace(temporario, destino)
+                if ao_concluir:
+                    ao_concluir(destino)
+            fila.put(_FIM)
+        except Exception as e:
+            if not cancelado.is_set():
+                logger.error(f"❌ Erro ao gerar Excel: {e}")
+                fila.put(e)
+        finally:
+            if copia is not None:
+                copia.close()
+                if temporario.exists():
+                    temporario.unlink()
+
+    threading.Thread(target=produzir, daemon=True).start()
+    try:
+        while True:
+            bloco = fila.get()
+            if bloco is _FIM:
+                return
+            if isinstance(bloco, Exception):
+                raise bloco
+            yield bloco
+    finally:
+        cancelado.set()
+
+
+# =========================
+# PDF
+# =========================
+
+@lru_cache(maxsize=None)
+def _estilos_pdf():
+    """Estilos de parágrafo e da tabela, criados uma vez por processo"""
+    styles = getSampleStyleSheet()
+    tabela = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), PDF_FONTE_CORPO + 1),
+        ('FONTSIZE', (0, 1), (-1, -1), PDF_FONTE_CORPO),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 6),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.black)
+    ])
+    return styles, tabela
+
+
+def _rodape(canvas, doc):
+    canvas.saveState()
+    canvas.setFont('Helvetica', PDF_FONTE_CORPO)
+    canvas.drawRightString(doc.pagesize[0] - doc.rightMargin, doc.bottomMargin / 2, f"Página {doc.page}")
+    canvas.restoreState()
+
+
+def _texto_celula(valor: Any, limite: int) -> str:
+    texto = "" if valor is None else str(valor)
+    return texto if len(texto) <= limite else texto[:limite - 1] + "…"
+
+
+def escrever_pdf(destino: Union[Path, str], titulo: str, headers: List[Any], linhas: List[Sequence[Any]], gerado_em: str):
+    """
+    Escreve o relatório completo em PDF, paginado e com cabeçalho repetido
+
+    Args:
+        destino: Caminho de saída
+        titulo: Título do relatório
+        headers: Nomes das colunas
+        linhas: Valores de cada linha, na ordem dos headers
+        gerado_em: Data/hora exibida no cabeçalho do documento
+    """
+    pagesize = landscape(A4) if len(headers) > PDF_COLUNAS_RETRATO else A4
+    doc = SimpleDocTemplate(
+        str(destino), pagesize=pagesize, title=titulo,
+        leftMargin=1 * cm, rightMargin=1 * cm, topMargin=1 * cm, bottomMargin=1.5 * cm
+    )
+    styles, estilo_tabela = _estilos_pdf()
+
+    elementos = [
+        Paragraph(titulo, styles['Title']),
+        Paragraph(f"Gerado em: {gerado_em}", styles['Normal']),
+        Paragraph(f"Total de registros: {len(linhas)}", styles['Normal']),
+        Spacer(1, 0.5 * cm)
+    ]
+
+    if headers and linhas:
+        largura_coluna = doc.width / len(headers)
+        # Aproximação de caracteres que cabem na coluna (Helvetica ~0,5em)
+        limite = max(4, int(largura_coluna / (PDF_FONTE_CORPO * 0.5)))
+        cabecalho = [_texto_celula(h, limite) for h in headers]
+
+        for inicio in range(0, len(linhas), PDF_LINHAS_POR_TABELA):
+            bloco = [cabecalho]
+            for linha in linhas[inicio:inicio + PDF_LINHAS_POR_TABELA]:
+                bloco.append([_texto_celula(v, limite) for v in linha])
+            table = Table(bloco, colWidths=[largura_coluna] * len(headers), repeatRows=1)
+            table.setStyle(estilo_tabela)
+            elementos.append(table)
+
+    doc.build(elementos, onFirstPage=_rodape, onLaterPages=_rodape)
+
+
+_export_pool = None
+_export_pool_lock = threading.Lock()
+
+
+def _obter_export_pool() -> ProcessPoolExecutor:
+    global _export_pool
+    with _export_pool_lock:
+        if _export_pool is None:
+            # "spawn": o processo do servidor tem várias threads ativas
+            _export_pool = ProcessPoolExecutor(
+                max_workers=EXPORT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _export_pool
+
+
+def _descartar_export_pool():
+    global _export_pool
+    with _export_pool_lock:
+        _export_pool = None
+
+
+def _submeter(funcao, *args):
+    try:
+        return _obter_export_pool().submit(funcao, *args)
+    except BrokenProcessPool:
+        logger.error("❌ Pool de exportação interrompido, recriando")
+        _descartar_export_pool()
+        return _obter_export_pool().submit(funcao, *args)
+
+
+def _args_pdf(destino, titulo, headers, linhas) -> tuple:
+    return (
+        str(destino), titulo, list(headers), [list(linha) for linha in linhas],
+        datetime.now().strftime('%d/%m/%Y %H:%M')
+    )
+
+
+def _submeter_render(formato: str, destino: Path, titulo: str, headers: List[Any], linhas: Iterable[Sequence[Any]]):
+    """Envia a renderização de um arquivo (excel ou pdf) para o pool"""
+    if formato == "pdf":
+        return _submeter(_renderizar_atomico, escrever_pdf, *_args_pdf(destino, titulo, headers, linhas))
+    linhas = [list(linha) for linha in linhas]
+    return _submeter(_renderizar_atomico, escrever_excel, str(destino), list(headers), linhas)
+
+
+# =========================
+# CACHE DE EXPORTAÇÕES
+# =========================
+
+class ExportCache:
+    """
+    Cache de arquivos exportados, endereçado pelo conteúdo da exportação
+
+    O nome do arquivo é o hash da chave (tipo, codvd, vendedor, formato,
+    versão dos dados), então uma exportação repetida é servida do disco.
+    O diretório tem limite de tamanho e de idade, com remoção LRU (o mtime
+    é atualizado a cada acerto).
+    """
+
+    def __init__(self, diretorio: Path, max_bytes: int = EXPORT_CACHE_MAX_MB * 1024 * 1024,
+                 max_idade: int = EXPORT_CACHE_MAX_HORAS * 3600):
+        self.diretorio = Path(diretorio)
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_idade = max_idade
+        self.hits = 0
+        self.misses = 0
+        self.evicoes = 0
+        self._lock = threading.Lock()
+
+    def caminho(self, chave: tuple) -> Path:
+        """Caminho do arquivo de uma chave (o formato é o 4º elemento)"""
+        digest = hashlib.sha256(json.dumps(list(chave), default=str).encode("utf-8")).hexdigest()[:24]
+        return self.diretorio / f"{chave[0]}_{digest}.{EXTENSOES[chave[3]]}"
+
+    def obter(self, chave: tuple) -> Optional[Path]:
+        """Retorna o arquivo em cache da chave (e marca o acesso) ou None"""
+        path = self.caminho(chave)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def abrir(self, chave: tuple) -> Optional[BinaryIO]:
+        """
+        Abre o arquivo em cache da chave (e marca o acesso) ou retorna None
+
+        A abertura acontece sob o lock do evict: depois de aberto, o arquivo
+        continua legível mesmo que seja removido do diretório
+        """
+        path = self.caminho(chave)
+        with self._lock:
+            try:
+                arquivo = open(path, "rb")
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+            os.utime(path)
+        self.hits += 1
+        return arquivo
+
+    def registrar(self, path: Path):
+        """Chamado após gravar um arquivo novo; aplica o orçamento do diretório"""
+        self.evict()
+
+    def evict(self):
+        """Remove arquivos expirados e os menos usados até caber no limite"""
+        with self._lock:
+            agora = datetime.now().timestamp()
+            arquivos = []
+            for path in self.diretorio.iterdir():
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                if path.is_file():
+                    arquivos.append((stat.st_mtime, stat.st_size, path))
+
+            arquivos.sort()
+            total = sum(tamanho for _, tamanho, _ in arquivos)
+            for mtime, tamanho, path in arquivos:
+                em_uso = path.suffix == ".tmp" and agora - mtime < self.max_idade
+                if em_uso or (total <= self.max_bytes and agora - mtime <= self.max_idade):
+                    continue
+                try:
+                    path.unlink()
+                    self.evicoes += 1
+                    total -= tamanho
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Estatísticas do cache para monitoramento"""
+        arquivos = [path.stat().st_size for path in self.diretorio.iterdir() if path.is_file()]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicoes": self.evicoes,
+            "arquivos": len(arquivos),
+            "bytes": sum(arquivos),
+            "max_bytes": self.max_bytes,
+            "max_idade_horas": self.max_idade // 3600
+        }
+
+
+def ler_arquivo(arquivo: BinaryIO) -> Iterator[bytes]:
+    """Lê um arquivo já aberto em blocos de CHUNK_SIZE e o fecha no fim"""
+    with arquivo:
+        while True:
+            bloco = arquivo.read(CHUNK_SIZE)
+            if not bloco:
+                return
+            yield bloco
+
+
+def _abrir_ou_submeter(cache: "ExportCache", itens: List[tuple], pendentes: List[int]):
+    """Abre os arquivos já em cache e envia os que faltam para o pool"""
+    arquivos = {}
+    futures = []
+    for i in pendentes:
+        chave, titulo, headers, linhas = itens[i]
+        arquivo = cache.abrir(chave)
+        if arquivo is None:
+            futures.append(_submeter_render(chave[3], cache.caminho(chave), titulo, headers, linhas))
+        else:
+            arquivos[i] = arquivo
+    return arquivos, futures
+
+
+async def renderizar_lote(cache: "ExportCache", itens: List[tuple], tentativas: int = 3) -> List[BinaryIO]:
+    """
+    Renderiza várias exportações em paralelo no pool de processos
+
+    Os arquivos são devolvidos já abertos, então um evict concorrente não
+    os afeta; um arquivo removido entre a renderização e a abertura é
+    renderizado de novo.
+
+    Args:
+        cache: Cache de exportações (arquivos já existentes são reaproveitados)
+        itens: Tuplas (chave, titulo, headers, linhas), com as linhas em
+            listas (podem ser renderizadas mais de uma vez)
+        tentativas: Rodadas de abertura/renderização antes de desistir
+
+    Returns:
+        Arquivo aberto (binário) de cada item, na ordem dos itens; quem
+        chama fecha os arquivos
+    """
+    abertos: Dict[int, BinaryIO] = {}
+    pendentes = list(range(len(itens)))
+    try:
+        for _ in range(tentativas):
+            arquivos, futures = await asyncio.to_thread(_abrir_ou_submeter, cache, itens, pendentes)
+            abertos.update(arquivos)
+            pendentes = [i for i in pendentes if i not in abertos]
+            if not pendentes:
+                return [abertos[i] for i in range(len(itens))]
+            await asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+        raise RuntimeError(f"{len(pendentes)} arquivo(s) do lote removidos do cache antes da leitura")
+    except BaseException:
+        for arquivo in abertos.values():
+            arquivo.close()
+        raise
+
+
+# =========================
+# JOBS DE EXPORTAÇÃO
+# =========================
+
+class ExportQueueFull(Exception):
+    """A fila de exportações atingiu o limite de jobs pendentes"""
+
+
+class ExportJobManager:
+    """
+    Fila de exportações em segundo plano
+
+    Cada job é renderizado no pool de processos. Jobs idênticos em andamento
+    (mesma chave: tipo, codvd, vendedor, formato e versão dos dados) são
+    deduplicados e compartilham o mesmo arquivo; se o arquivo já estiver no
+    cache de exportações o job nasce concluído.
+    """
+
+    def __init__(self, cache: ExportCache, max_pendentes: int = EXPORT_MAX_JOBS_PENDENTES,
+                 retencao: int = EXPORT_RETENCAO_JOBS):
+        self.cache = cache
+        self.max_pendentes = max_pendentes
+        self.retencao = retencao
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._em_andamento: Dict[tuple, str] = {}
+        self._lock = threading.RLock()
+
+    def submeter(
+        self,
+        chave: tuple,
+        titulo: str,
+        headers: List[Any],
+        linhas: Iterable[Sequence[Any]],
+        usuario: str
+    ) -> Dict[str, Any]:
+        """
+        Enfileira uma exportação (ou reaproveita um job idêntico em andamento)
+
+        Args:
+            chave: (tipo, codvd, vendedor, formato, versão dos dados)
+            titulo: Título do relatório (PDF)
+            headers: Nomes das colunas
+            linhas: Valores de cada linha, na ordem dos headers
+            usuario: Email de quem solicitou
+
+        Returns:
+            Status do job
+        """
+        with self._lock:
+            self._limpar()
+
+            job_id = self._em_andamento.get(chave)
+            if job_id:
+                job = self._jobs[job_id]
+                job["usuarios"].add(usuario)
+                return dict(self.status(job_id), deduplicado=True)
+
+            pendentes = sum(1 for job in self._jobs.values() if job["status"] == "pendente")
+            if pendentes >= self.max_pendentes:
+                raise ExportQueueFull(f"Limite de {self.max_pendentes} exportações pendentes atingido")
+
+            formato = chave[3]
+            destino = self.cache.obter(chave)
+            if destino is not None:
+                future = Future()
+                future.set_result(None)
+            else:
+                destino = self.cache.caminho(chave)
+                future = _submeter_render(formato, destino, titulo, headers, linhas)
+
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "formato": formato,
+                "path": destino,
+                "chave": chave,
+                "usuarios": {usuario},
+                "status": "pendente",
+                "criado_em": datetime.now().isoformat(),
+                "concluido_em": None,
+                "erro": None,
+                "_future": future
+            }
+            self._em_andamento[chave] = job_id
+            future.add_done_callback(lambda f, job_id=job_id: self._finalizar(job_id, f))
+            return dict(self.status(job_id), deduplicado=False)
+
+    def _finalizar(self, job_id: str, future):
+        """Registra o resultado do job; é o único lugar que encerra o status"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return
+            erro = future.exception()
+            if erro is not None:
+                job["erro"] = str(erro)
+                logger.error(f"❌ Falha na exportação {job_id}: {erro}")
+            else:
+                self.cache.registrar(job["path"])
+            job["concluido_em"] = datetime.now().isoformat()
+            job["status"] = "erro" if erro is not None else "concluido"
+            if self._em_andamento.get(job["chave"]) == job_id:
+                del self._em_andamento[job["chave"]]
+
+    def _limpar(self):
+        """Remove jobs finalizados há mais tempo que a retenção"""
+        limite = datetime.now().timestamp() - self.retencao
+        for job_id, job in list(self._jobs.items()):
+            concluido = job["concluido_em"]
+            if concluido and datetime.fromisoformat(concluido).timestamp() < limite:
+                del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self._jobs.get(job_id)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Status público de um job (sem campos internos)
+
+        O status final (concluido/erro) é o registrado por _finalizar, junto
+        com o erro e o arquivo; o future só distingue pendente de processando.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return None
+
+            status = job["status"]
+            if status == "pendente" and job["_future"].running():
+                status = "processando"
+
+            return {
+                "job_id": job_id,
+                "status": status,
+                "formato": job["formato"],
+                "criado_em": job["criado_em"],
+                "concluido_em": job["concluido_em"],
+                "erro": job["erro"]
+            }
+
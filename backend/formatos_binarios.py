@@ -0,0 +1,93 @@
+"""
+Formatos binários para clientes de máquina (MessagePack e Arrow IPC)
+Escolhidos pelo cabeçalho Accept; navegadores continuam recebendo JSON.
+O Arrow é montado direto das colunas do ReportStore, sem criar dicts por linha
+"""
+from typing import Any, Dict, List, Optional
+
+from respostas import _json_default, dumps
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+MEDIA_TYPE_MSGPACK = "application/msgpack"
+MEDIA_TYPE_ARROW = "application/vnd.apache.arrow.stream"
+
+FORMATOS = {
+    MEDIA_TYPE_MSGPACK: "msgpack",
+    "application/x-msgpack": "msgpack",
+    MEDIA_TYPE_ARROW: "arrow",
+}
+
+# Linhas por record batch do Arrow
+ARROW_LINHAS_POR_LOTE = 65536
+
+
+class FormatoIndisponivel(Exception):
+    """Formato pedido, mas a biblioteca correspondente não está instalada"""
+
+
+def formato_aceito(accept: str) -> Optional[str]:
+    """Formato binário pedido no Accept ("msgpack", "arrow") ou None"""
+    for parte in accept.split(","):
+        tipo, _, params = parte.strip().partition(";")
+        formato = FORMATOS.get(tipo.strip().lower())
+        if formato and params.replace(" ", "") not in ("q=0", "q=0.0"):
+            if (formato == "msgpack" and msgpack is None) or (formato == "arrow" and pa is None):
+                raise FormatoIndisponivel(formato)
+            return formato
+    return None
+
+
+def media_type(formato: str) -> str:
+    return MEDIA_TYPE_ARROW if formato == "arrow" else MEDIA_TYPE_MSGPACK
+
+
+def serializar_msgpack(envelope: Dict[str, Any], campo: str, store, posicoes, campos: Optional[List[Any]] = None) -> bytes:
+    """Mesmo formato da resposta JSON (envelope + registros em "campo")"""
+    corpo = dict(envelope)
+    corpo[campo] = store.rows(posicoes, campos)
+    return msgpack.packb(corpo, default=_json_default, use_bin_type=True)
+
+
+def _array_coluna(valores: List[Any]):
+    """Array Arrow de uma coluna; tipos mistos (comum no Excel) viram texto"""
+    try:
+        return pa.array(valores)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, OverflowError):
+        return pa.array([None if v is None else str(v) for v in valores], type=pa.string())
+
+
+def serializar_arrow(envelope: Dict[str, Any], store, posicoes, campos: Optional[List[Any]] = None) -> bytes:
+    """
+    Stream IPC do Arrow com as colunas selecionadas. Os metadados do
+    envelope (id, contagem, cursor...) vão nos metadados do schema
+    """
+    nomes = store.headers if campos is None else campos
+    arrays = []
+    for nome in nomes:
+        coluna = store.columns[nome]
+        if isinstance(posicoes, range) and len(posicoes) == len(coluna) and posicoes.step == 1:
+            valores = coluna
+        else:
+            valores = [coluna[pos] for pos in posicoes]
+        arrays.append(_array_coluna(valores))
+
+    metadados = {chave: dumps(valor) for chave, valor in envelope.items()}
+    schema = pa.schema(
+        [pa.field("" if nome is None else str(nome), array.type) for nome, array in zip(nomes, arrays)],
+        metadata=metadados
+    )
+    tabela = pa.Table.from_arrays(arrays, schema=schema)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_table(tabela, max_chunksize=ARROW_LINHAS_POR_LOTE)
+    return sink.getvalue().to_pybytes()
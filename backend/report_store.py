@@ -0,0 +1,500 @@
+"""
+Cache de fontes de dados dos relatórios (planilhas em data/uploads)
+Mantém em memória o conteúdo já processado de cada arquivo, em formato
+colunar com índices por CODVD e STATUS, evitando reprocessar o Excel com openpyxl
+a cada requisição, e um cache dos resultados das consultas
+"""
+import hashlib
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Optional, Dict, List, Any, Tuple, Callable
+import logging
+
+from openpyxl import load_workbook
+
+from bitmap import Bitmap
+
+logger = logging.getLogger(__name__)
+
+# Cache de resultados das consultas
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", "300"))
+QUERY_CACHE_MAX_ENTRADAS = int(os.getenv("QUERY_CACHE_MAX_ENTRADAS", "2000"))
+QUERY_CACHE_MAX_LINHAS = int(os.getenv("QUERY_CACHE_MAX_LINHAS", "500000"))
+
+
+class ReportStore:
+    """
+    Armazenamento colunar (somente leitura) das linhas de uma fonte
+
+    Cada coluna é guardada como uma lista indexada pela posição da linha.
+    As colunas-chave (STATUS, CODVD, VENDEDOR) são normalizadas uma única
+    vez na carga. Cada valor distinto de CODVD e de STATUS ganha um bitmap
+    das posições das linhas, de modo que um filtro vira uma interseção.
+    Linhas repetidas são marcadas na carga pela impressão digital (64 bits)
+    dos valores, e as consultas retornam apenas a primeira ocorrência.
+    """
+
+    def __init__(self, headers: List[Any], columns: Dict[Any, List[Any]], size: int):
+        self.headers = headers
+        self.columns = columns
+        self.size = size
+
+        # Colunas-chave normalizadas (mesmas regras do filtro original)
+        self.status_norm = [str(v).upper().strip() for v in self._coluna("STATUS", "")]
+        self.codvd_norm = [str(v).strip() for v in self._coluna("CODVD", "")]
+        self.vendedor_norm = [str(v).upper() for v in self._coluna("VENDEDOR", "")]
+
+        # Bitmaps por valor: CODVD -> posições e STATUS -> posições
+        self.codvd_bitmaps = _indexar(self.codvd_norm)
+        self.status_bitmaps = _indexar(self.status_norm)
+        self._status_unioes: Dict[frozenset, Bitmap] = {}
+        self._ordenacoes: Dict[Any, Tuple[array, array]] = {}
+
+        # Impressão digital por linha e marcação de duplicatas
+        self.fingerprints = array("Q")
+        self.duplicada: List[bool] = []
+        self._marcar_duplicatas()
+
+    @classmethod
+    def from_tuples(cls, headers: List[Any], linhas) -> "ReportStore":
+        """Monta o armazenamento a partir de tuplas de valores (ordem dos headers)"""
+        # Cabeçalhos repetidos: vale a última coluna, como em dict(zip(...))
+        indices = {h: i for i, h in enumerate(headers)}
+        campos = list(dict.fromkeys(headers))
+        columns: Dict[Any, List[Any]] = {h: [] for h in campos}
+        destinos = [(columns[h], indices[h]) for h in campos]
+        largura = len(headers)
+        size = 0
+        for linha in linhas:
+            if len(linha) < largura:
+                linha = tuple(linha) + (None,) * (largura - len(linha))
+            for coluna, i in destinos:
+                coluna.append(linha[i])
+            size += 1
+        return cls(campos, columns, size)
+
+    @classmethod
+    def from_rows(cls, rows: List[Dict[Any, Any]]) -> "ReportStore":
+        """Monta o armazenamento a partir de uma lista de dicts (ex.: CSV)"""
+        campos = list(dict.fromkeys(k for row in rows for k in row)) if rows else []
+        columns = {h: [row.get(h) for row in rows] for h in campos}
+        return cls(campos, columns, len(rows))
+
+    def _marcar_duplicatas(self):
+        colunas = [self.columns[h] for h in self.headers]
+        primeiras: Dict[int, List[int]] = {}
+        unicas = []
+        for pos in range(self.size):
+            valores = tuple(coluna[pos] for coluna in colunas)
+            fingerprint = fingerprint_valores(valores)
+            self.fingerprints.append(fingerprint)
+
+            # Mesma impressão digital: confirma comparando os valores
+            candidatas = primeiras.get(fingerprint)
+            if candidatas is None:
+                primeiras[fingerprint] = [pos]
+            elif any(valores == tuple(coluna[p] for coluna in colunas) for p in candidatas):
+                self.duplicada.append(True)
+                continue
+            else:
+                candidatas.append(pos)
+            self.duplicada.append(False)
+            unicas.append(pos)
+
+        # Bitmap das linhas únicas (None quando não há duplicatas)
+        self.unicas = Bitmap.from_sorted(unicas) if len(unicas) < self.size else None
+
+    def _coluna(self, nome: str, default: Any) -> List[Any]:
+        coluna = self.columns.get(nome)
+        return coluna if coluna is not None else [default] * self.size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def row(self, pos: int) -> Dict[Any, Any]:
+        """Materializa uma linha como dict"""
+        return {h: self.columns[h][pos] for h in self.headers}
+
+    def rows(self, posicoes, campos: Optional[List[Any]] = None) -> List[Dict[Any, Any]]:
+        """
+        Materializa as linhas das posições informadas
+
+        Args:
+            posicoes: Posições das linhas
+            campos: Colunas a incluir (projeção); None = todas
+        """
+        colunas = [(h, self.columns[h]) for h in (self.headers if campos is None else campos)]
+        return [{h: coluna[pos] for h, coluna in colunas} for pos in posicoes]
+
+    def valores(self, posicoes):
+        """Valores de cada linha na ordem dos headers (sem montar dicts)"""
+        colunas = [self.columns[h] for h in self.headers]
+        return ([coluna[pos] for coluna in colunas] for pos in posicoes)
+
+    def ordenacao(self, coluna: Any) -> Tuple[array, array]:
+        """
+        Permutação ordenada das posições por uma coluna (memoizada)
+
+        Returns:
+            (posições em ordem crescente do valor, posto de cada posição)
+        """
+        ordenacao = self._ordenacoes.get(coluna)
+        if ordenacao is None:
+            valores = self.columns[coluna]
+            permutacao = array("I", sorted(range(self.size), key=lambda pos: _chave_ordenacao(valores[pos])))
+            postos = array("I", bytes(4 * self.size))
+            for posto, pos in enumerate(permutacao):
+                postos[pos] = posto
+            ordenacao = self._ordenacoes[coluna] = (permutacao, postos)
+        return ordenacao
+
+    def ordenar(self, posicoes, coluna: Any, decrescente: bool = False) -> List[int]:
+        """Ordena um subconjunto de posições pelo valor de uma coluna"""
+        _, postos = self.ordenacao(coluna)
+        return sorted(posicoes, key=postos.__getitem__, reverse=decrescente)
+
+    def status_bitmap(self, status_permitidos: set) -> Bitmap:
+        """União (memoizada) dos bitmaps dos valores de STATUS aceitos"""
+        chave = frozenset(status_permitidos)
+        bitmap = self._status_unioes.get(chave)
+        if bitmap is None:
+            bitmap = Bitmap()
+            for status in chave:
+                bitmap = bitmap | self.status_bitmaps.get(status, Bitmap())
+            self._status_unioes[chave] = bitmap
+        return bitmap
+
+    def selecionar(self, codvd: Any, status_permitidos: Optional[set] = None) -> Bitmap:
+        """
+        Bitmap das linhas (sem duplicatas) de um CODVD com STATUS aceito
+
+        Args:
+            codvd: Código do vendedor (comparado após strip)
+            status_permitidos: Valores de STATUS aceitos (None = qualquer)
+        """
+        bitmap = self.codvd_bitmaps.get(str(codvd).strip())
+        if bitmap is None:
+            return Bitmap()
+        if status_permitidos is not None:
+            bitmap = bitmap & self.status_bitmap(status_permitidos)
+        if self.unicas is not None:
+            bitmap = bitmap & self.unicas
+        return bitmap
+
+    def filtrar(self, codvd: Any, status_permitidos: Optional[set] = None, vendedor: str = "") -> List[int]:
+        """
+        Retorna as posições das linhas de um CODVD que atendem aos filtros
+
+        Args:
+            codvd: Código do vendedor (comparado após strip)
+            status_permitidos: Valores de STATUS aceitos (None = qualquer)
+            vendedor: Trecho do nome do vendedor (case-insensitive)
+        """
+        posicoes = self.selecionar(codvd, status_permitidos)
+
+        if vendedor:
+            trecho = vendedor.upper()
+            nomes = self.vendedor_norm
+            return [pos for pos in posicoes if trecho in nomes[pos]]
+
+        return list(posicoes)
+
+    def particionar(self, consultas: List[Tuple[Any, str]], status_permitidos: Optional[set] = None) -> List[List[int]]:
+        """
+        Filtra vários CODVDs com uma única passada pelas linhas selecionadas
+
+        Args:
+            consultas: Pares (codvd, vendedor); vendedor vazio = qualquer
+            status_permitidos: Valores de STATUS aceitos (None = qualquer)
+
+        Returns:
+            Posições das linhas de cada consulta, na ordem das consultas
+        """
+        destinos: Dict[str, List[int]] = {}
+        for i, (codvd, _) in enumerate(consultas):
+            destinos.setdefault(str(codvd).strip(), []).append(i)
+
+        selecao = Bitmap()
+        for codvd in destinos:
+            bitmap = self.codvd_bitmaps.get(codvd)
+            if bitmap is not None:
+                selecao = selecao | bitmap
+        if status_permitidos is not None:
+            selecao = selecao & self.status_bitmap(status_permitidos)
+        if self.unicas is not None:
+            selecao = selecao & self.unicas
+
+        trechos = [(vendedor or "").upper() for _, vendedor in consultas]
+        resultado: List[List[int]] = [[] for _ in consultas]
+        codvds = self.codvd_norm
+        nomes = self.vendedor_norm
+        for pos in selecao:
+            for i in destinos[codvds[pos]]:
+                trecho = trechos[i]
+                if not trecho or trecho in nomes[pos]:
+                    resultado[i].append(pos)
+        return resultado
+
+    def contar(self, codvd: Any, status_permitidos: Optional[set] = None) -> Dict[str, int]:
+        """Contagem de linhas de um CODVD por STATUS, sem materializar linhas"""
+        selecao = self.selecionar(codvd, status_permitidos)
+        contagem = {}
+        for status, bitmap in self.status_bitmaps.items():
+            total = len(selecao & bitmap)
+            if total:
+                contagem[status] = total
+        return contagem
+
+
+def _chave_ordenacao(valor: Any) -> tuple:
+    """Números (inclusive texto numérico) antes de texto; vazios por último"""
+    if valor is None or valor == "":
+        return (2, 0, "")
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return (0, valor, "")
+    texto = str(valor)
+    try:
+        numero = float(texto)
+    except ValueError:
+        return (1, 0, texto.casefold())
+    if numero != numero:  # NaN não é ordenável
+        return (1, 0, texto.casefold())
+    return (0, numero, "")
+
+
+def fingerprint_valores(valores: tuple) -> int:
+    """Impressão digital estável de 64 bits dos valores de uma linha"""
+    digest = hashlib.blake2b(repr(valores).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _indexar(valores: List[str]) -> Dict[str, Bitmap]:
+    """Monta um bitmap de posições para cada valor distinto da coluna"""
+    posicoes: Dict[str, List[int]] = {}
+    for pos, valor in enumerate(valores):
+        lista = posicoes.get(valor)
+        if lista is None:
+            lista = posicoes[valor] = []
+        lista.append(pos)
+    return {valor: Bitmap.from_sorted(lista) for valor, lista in posicoes.items()}
+
+
+class ParsedSource:
+    """Conteúdo processado de um arquivo de dados (somente leitura)"""
+
+    def __init__(self, path: Path, store: ReportStore, assinatura: Tuple[int, int]):
+        self.path = path
+        self.store = store
+        self.assinatura = assinatura
+
+    @property
+    def version(self) -> str:
+        """Versão dos dados derivada de (mtime, tamanho) do arquivo"""
+        mtime_ns, size = self.assinatura
+        return f"{mtime_ns:x}-{size:x}"
+
+
+def _assinatura(path: Path) -> Tuple[int, int]:
+    stat = path.stat()
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _ler_planilha(path: Path) -> ReportStore:
+    """Lê a primeira aba do arquivo direto para o armazenamento colunar"""
+    wb = load_workbook(path, read_only=True)
+    try:
+        ws = wb.active
+        linhas = ws.iter_rows(values_only=True)
+        headers = list(next(linhas, ()))
+        return ReportStore.from_tuples(headers, linhas)
+    finally:
+        wb.close()
+
+
+class SourceCache:
+    """
+    Cache de processo para arquivos de dados já processados
+
+    Cada arquivo é lido uma única vez e compartilhado por todos os tipos de
+    relatório que usam o mesmo arquivo. A entrada é descartada quando o
+    mtime/tamanho do arquivo muda ou quando invalidate() é chamado.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, ParsedSource] = {}
+        self._path_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _lock_for(self, key: str) -> threading.Lock:
+        with self._lock:
+            lock = self._path_locks.get(key)
+            if lock is None:
+                lock = self._path_locks[key] = threading.Lock()
+            return lock
+
+    def get(self, path: Path) -> ParsedSource:
+        """
+        Retorna o conteúdo processado do arquivo, lendo do disco se necessário
+
+        Args:
+            path: Caminho do arquivo de dados
+
+        Returns:
+            ParsedSource com o armazenamento colunar do arquivo
+        """
+        key = str(Path(path).resolve())
+        entry = self._entries.get(key)
+        if entry is not None and entry.assinatura == _assinatura(path):
+            self.hits += 1
+            return entry
+
+        # Apenas uma thread processa cada arquivo; as demais aguardam o resultado
+        with self._lock_for(key):
+            assinatura = _assinatura(path)
+            entry = self._entries.get(key)
+            if entry is not None and entry.assinatura == assinatura:
+                self.hits += 1
+                return entry
+
+            self.misses += 1
+            entry = ParsedSource(Path(path), _ler_planilha(path), assinatura)
+            self._entries[key] = entry
+            logger.info(f"📄 Fonte carregada: {path} ({len(entry.store)} linhas)")
+            return entry
+
+    def invalidate(self, path: Optional[Path] = None):
+        """
+        Descarta entradas do cache
+
+        Args:
+            path: Se fornecido, descarta apenas esse arquivo; senão, todos
+        """
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(str(Path(path).resolve()), None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Retorna estatísticas do cache para monitoramento"""
+        entries = list(self._entries.values())
+        return {
+            "arquivos": [
+                {"arquivo": entry.path.name, "linhas": len(entry.store), "versao": entry.version}
+                for entry in entries
+            ],
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+class QueryCache:
+    """
+    Cache LRU com TTL dos resultados de consultas de relatório
+
+    A chave inclui a versão dos dados, então uma fonte nova nunca devolve
+    resultado antigo. O tamanho é limitado por número de entradas e pelo
+    total de linhas guardadas. Requisições idênticas simultâneas aguardam
+    um único cálculo em andamento (single-flight).
+    """
+
+    def __init__(self, ttl: int = QUERY_CACHE_TTL, max_entradas: int = QUERY_CACHE_MAX_ENTRADAS,
+                 max_linhas: int = QUERY_CACHE_MAX_LINHAS):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.max_linhas = max_linhas
+        self._entradas: "OrderedDict[tuple, Tuple[float, List]]" = OrderedDict()
+        self._em_andamento: Dict[tuple, Future] = {}
+        self._linhas = 0
+        self._geracao = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalescidas = 0
+
+    def get_or_compute(self, chave: tuple, calcular: Callable[[], List]) -> List:
+        """
+        Retorna o resultado em cache ou calcula (uma única vez por chave)
+
+        Args:
+            chave: Parâmetros normalizados + versão dos dados
+            calcular: Função que produz o resultado (lista de linhas)
+        """
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None:
+                expira, resultado = entrada
+                if expira > time.monotonic():
+                    self._entradas.move_to_end(chave)
+                    self.hits += 1
+                    return resultado
+                self._remover(chave)
+
+            future = self._em_andamento.get(chave)
+            if future is not None:
+                self.coalescidas += 1
+                lider = False
+            else:
+                future = self._em_andamento[chave] = Future()
+                self.misses += 1
+                lider = True
+            geracao = self._geracao
+
+        if not lider:
+            return future.result()
+
+        try:
+            resultado = calcular()
+        except Exception as e:
+            with self._lock:
+                self._em_andamento.pop(chave, None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._em_andamento.pop(chave, None)
+            # Invalidação durante o cálculo: entrega, mas não guarda
+            if geracao == self._geracao and len(resultado) <= self.max_linhas:
+                self._entradas[chave] = (time.monotonic() + self.ttl, resultado)
+                self._linhas += len(resultado)
+                self._aplicar_limites()
+        future.set_result(resultado)
+        return resultado
+
+    def _remover(self, chave: tuple):
+        _, resultado = self._entradas.pop(chave)
+        self._linhas -= len(resultado)
+
+    def _aplicar_limites(self):
+        while self._entradas and (len(self._entradas) > self.max_entradas or self._linhas > self.max_linhas):
+            self._remover(next(iter(self._entradas)))
+
+    def invalidate(self):
+        """Descarta todos os resultados (dados de origem mudaram)"""
+        with self._lock:
+            self._entradas.clear()
+            self._linhas = 0
+            self._geracao += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Estatísticas do cache para monitoramento"""
+        return {
+            "entradas": len(self._entradas),
+            "linhas": self._linhas,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalescidas": self.coalescidas,
+            "ttl": self.ttl
+        }
+
+
+# Instâncias globais dos caches
+source_cache = SourceCache()
+query_cache = QueryCache()
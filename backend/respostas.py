@@ -0,0 +1,306 @@
+"""
+Serialização JSON rápida e compressão das respostas da API
+Usa orjson quando instalado (com fallback para o json da biblioteca padrão)
+e comprime com brotli/gzip conforme o Accept-Encoding do cliente
+"""
+import json
+import os
+import threading
+import zlib
+from datetime import datetime
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Respostas menores que isso não compensam o custo da compressão
+COMPRESSAO_MIN_BYTES = int(os.getenv("COMPRESSAO_MIN_BYTES", "1024"))
+GZIP_NIVEL = int(os.getenv("GZIP_NIVEL", "6"))
+BROTLI_NIVEL = int(os.getenv("BROTLI_NIVEL", "4"))
+
+# Formatos já compactados (xlsx, pdf, zip) ou que não podem ser
+# retidos em buffer (text/event-stream) ficam de fora
+TIPOS_COMPRIMIVEIS = (
+    "application/json",
+    "application/x-ndjson",
+    "application/msgpack",
+    "application/vnd.apache.arrow.stream",
+    "application/javascript",
+    "text/csv",
+    "text/html",
+    "text/plain",
+)
+
+
+def _json_default(valor: Any) -> Any:
+    """Datas do openpyxl (datetime/date/time) viram ISO 8601"""
+    if hasattr(valor, "isoformat"):
+        return valor.isoformat()
+    return str(valor)
+
+
+def dumps(obj: Any) -> bytes:
+    """Serializa para JSON em UTF-8 (chaves não-texto viram texto)"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, default=_json_default).encode("utf-8")
+
+
+class RespostaJSON(JSONResponse):
+    """
+    JSONResponse serializada com orjson. Retornar a instância diretamente
+    do endpoint evita também a passada do jsonable_encoder do FastAPI
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+# =========================
+# REQUISIÇÕES CONDICIONAIS
+# =========================
+
+def cabecalhos_cache(etag: str, modificado: Optional[datetime] = None) -> Dict[str, str]:
+    """ETag/Last-Modified; no-cache obriga o cliente a revalidar sempre"""
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept, Accept-Encoding"}
+    if modificado is not None:
+        headers["Last-Modified"] = format_datetime(modificado, usegmt=True)
+    return headers
+
+
+def _etags(valor: str):
+    # Comparação fraca: W/"x" e "x" equivalem (a compressão enfraquece a ETag)
+    return {parte.strip().removeprefix("W/") for parte in valor.split(",") if parte.strip()}
+
+
+def nao_modificado(request, etag: str, modificado: Optional[datetime] = None) -> Optional[Response]:
+    """
+    Resposta 304 (sem corpo) se o cliente já tem a versão atual, senão None.
+    If-None-Match tem precedência sobre If-Modified-Since
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        etags = _etags(if_none_match)
+        valido = "*" in etags or etag.removeprefix("W/") in etags
+    else:
+        if_modified_since = request.headers.get("if-modified-since")
+        if not if_modified_since or modificado is None:
+            return None
+        try:
+            valido = modificado <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return None
+    if valido:
+        return Response(status_code=304, headers=cabecalhos_cache(etag, modificado))
+    return None
+
+
+# =========================
+# COMPRESSÃO
+# =========================
+
+def escolher_codificacao(accept_encoding: str) -> Optional[str]:
+    """Escolhe "br" ou "gzip" a partir do Accept-Encoding (q=0 recusa)"""
+    aceitas = set()
+    for parte in accept_encoding.lower().split(","):
+        nome, _, params = parte.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00", "0.000"):
+            continue
+        aceitas.add(nome.strip())
+    if brotli is not None and ("br" in aceitas or "*" in aceitas):
+        return "br"
+    if "gzip" in aceitas or "*" in aceitas:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    """Compressão incremental (cada bloco é liberado para o cliente)"""
+
+    def __init__(self, codificacao: str):
+        self.codificacao = codificacao
+        if codificacao == "br":
+            self._br = brotli.Compressor(quality=BROTLI_NIVEL)
+        else:
+            # wbits=31: formato gzip (cabeçalho + CRC)
+            self._gz = zlib.compressobj(GZIP_NIVEL, zlib.DEFLATED, 31)
+
+    def parcial(self, dados: bytes) -> bytes:
+        if self.codificacao == "br":
+            return self._br.process(dados) + self._br.flush()
+        return self._gz.compress(dados) + self._gz.flush(zlib.Z_SYNC_FLUSH)
+
+    def final(self, dados: bytes = b"") -> bytes:
+        if self.codificacao == "br":
+            return self._br.process(dados) + self._br.finish()
+        return self._gz.compress(dados) + self._gz.flush()
+
+
+class MetricasCompressao:
+    """Bytes antes/depois da compressão, agregados por rota"""
+
+    def __init__(self):
+        self._rotas: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, rota: str, codificacao: Optional[str], originais: int, enviados: int):
+        with self._lock:
+            m = self._rotas.setdefault(rota, {
+                "respostas": 0, "comprimidas": 0, "bytes_originais": 0, "bytes_enviados": 0
+            })
+            m["respostas"] += 1
+            if codificacao:
+                m["comprimidas"] += 1
+            m["bytes_originais"] += originais
+            m["bytes_enviados"] += enviados
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            rotas = {rota: dict(m) for rota, m in self._rotas.items()}
+        for m in rotas.values():
+            m["taxa"] = round(m["bytes_enviados"] / m["bytes_originais"], 4) if m["bytes_originais"] else None
+        return {
+            "orjson": orjson is not None,
+            "brotli": brotli is not None,
+            "min_bytes": COMPRESSAO_MIN_BYTES,
+            "rotas": rotas,
+        }
+
+
+metricas_compressao = MetricasCompressao()
+
+
+class CompressaoMiddleware:
+    """
+    Middleware ASGI que comprime respostas (brotli ou gzip) acima de
+    COMPRESSAO_MIN_BYTES. Respostas em streaming são comprimidas bloco a
+    bloco, sem bufferizar o corpo inteiro
+    """
+
+    def __init__(self, app, metricas: MetricasCompressao = metricas_compressao, min_bytes: int = COMPRESSAO_MIN_BYTES):
+        self.app = app
+        self.metricas = metricas
+        self.min_bytes = min_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept = ""
+        for nome, valor in scope.get("headers", []):
+            if nome == b"accept-encoding":
+                accept = valor.decode("latin-1")
+                break
+        codificacao = escolher_codificacao(accept) if accept else None
+
+        estado = {"inicio": None, "compressor": None, "originais": 0, "enviados": 0, "ativo": False}
+
+        def rota() -> str:
+            # O roteador do FastAPI grava a rota no scope (caminho com parâmetros)
+            route = scope.get("route")
+            return getattr(route, "path", None) or scope.get("path", "")
+
+        async def enviar_corpo(corpo: bytes):
+            estado["enviados"] += len(corpo)
+            await send({"type": "http.response.body", "body": corpo, "more_body": True})
+
+        async def send_wrapper(message):
+            tipo = message["type"]
+            if tipo == "http.response.start":
+                estado["inicio"] = message
+                return
+            if tipo != "http.response.body":
+                await send(message)
+                return
+
+            corpo = message.get("body", b"")
+            mais = message.get("more_body", False)
+            estado["originais"] += len(corpo)
+
+            inicio = estado["inicio"]
+            if inicio is not None:
+                # Primeiro bloco do corpo: decide se comprime
+                estado["inicio"] = None
+                headers = list(inicio.get("headers", []))
+                comprimir = codificacao is not None and self._comprimivel(headers) and (
+                    mais or len(corpo) >= self.min_bytes
+                )
+                if not comprimir:
+                    await send(inicio)
+                else:
+                    estado["ativo"] = True
+                    estado["compressor"] = _Compressor(codificacao)
+                    headers = [self._etag_fraco(n, v) for n, v in headers if n != b"content-length"]
+                    headers.append((b"content-encoding", codificacao.encode()))
+                    headers = self._vary_accept_encoding(headers)
+                    if not mais:
+                        comprimido = estado["compressor"].final(corpo)
+                        headers.append((b"content-length", str(len(comprimido)).encode()))
+                        await send({**inicio, "headers": headers})
+                        estado["enviados"] += len(comprimido)
+                        await send({"type": "http.response.body", "body": comprimido, "more_body": False})
+                        self._finalizar(rota(), codificacao, estado)
+                        return
+                    await send({**inicio, "headers": headers})
+
+            if not estado["ativo"]:
+                estado["enviados"] += len(corpo)
+                await send(message)
+            elif mais:
+                parte = estado["compressor"].parcial(corpo)
+                if parte:
+                    await enviar_corpo(parte)
+                return
+            else:
+                final = estado["compressor"].final(corpo)
+                estado["enviados"] += len(final)
+                await send({"type": "http.response.body", "body": final, "more_body": False})
+
+            if not mais:
+                self._finalizar(rota(), codificacao if estado["ativo"] else None, estado)
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _comprimivel(headers) -> bool:
+        tipo = b""
+        for nome, valor in headers:
+            if nome == b"content-encoding":
+                return False
+            if nome == b"content-type":
+                tipo = valor
+        tipo = tipo.split(b";")[0].strip().decode("latin-1").lower()
+        return tipo in TIPOS_COMPRIMIVEIS
+
+    @staticmethod
+    def _vary_accept_encoding(headers):
+        # Junta Accept-Encoding ao Vary existente (ex.: de cabecalhos_cache) em vez de repetir o header
+        for i, (nome, valor) in enumerate(headers):
+            if nome == b"vary":
+                campos = [c.strip().lower() for c in valor.split(b",")]
+                if b"accept-encoding" in campos or b"*" in campos:
+                    return headers
+                return headers[:i] + [(nome, valor + b", Accept-Encoding")] + headers[i + 1:]
+        return headers + [(b"vary", b"Accept-Encoding")]
+
+    @staticmethod
+    def _etag_fraco(nome: bytes, valor: bytes):
+        # O corpo comprimido não é byte a byte o mesmo: ETag forte vira fraca
+        if nome == b"etag" and not valor.startswith(b"W/"):
+            return nome, b"W/" + valor
+        return nome, valor
+
+    def _finalizar(self, rota: str, codificacao: Optional[str], estado: Dict[str, Any]):
+        self.metricas.registrar(rota, codificacao, estado["originais"], estado["enviados"])
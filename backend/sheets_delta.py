@@ -0,0 +1,198 @@
+"""
+Atualização incremental (por linha) dos dados das planilhas
+Compara cada nova carga com a versão em memória pela chave de cada linha
+(colunas-chave do REPORTS_CONFIG ou impressão digital do conteúdo) e
+registra as inclusões, alterações e exclusões num histórico versionado
+"""
+import os
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from report_store import fingerprint_valores
+from respostas import dumps
+
+# Histórico mantido por relatório: número de versões e total de linhas
+DELTA_MAX_VERSOES = int(os.getenv("DELTA_MAX_VERSOES", "50"))
+DELTA_MAX_LINHAS = int(os.getenv("DELTA_MAX_LINHAS", "100000"))
+
+
+def chaves_linhas(rows: List[Dict[Any, Any]], key_columns: Optional[List[str]] = None) -> List[str]:
+    """
+    Chave estável de cada linha: valores das colunas-chave ou, sem elas,
+    a impressão digital da linha. Repetições ganham o sufixo "#n"
+    """
+    chaves = []
+    vistas: Dict[str, int] = {}
+    for row in rows:
+        if key_columns:
+            chave = dumps([row.get(k) for k in key_columns]).decode("utf-8")
+        else:
+            chave = f"{fingerprint_valores(tuple(row.items())):016x}"
+        n = vistas.get(chave, 0)
+        vistas[chave] = n + 1
+        chaves.append(chave if n == 0 else f"{chave}#{n}")
+    return chaves
+
+
+class Delta:
+    """Diferença entre duas cargas de uma planilha"""
+
+    __slots__ = ("rows", "chaves", "upserts", "deletes", "movidas", "inserts", "updates")
+
+    def __init__(self):
+        self.rows: List[Dict[Any, Any]] = []
+        self.chaves: List[str] = []
+        self.upserts: List[Tuple[str, int, Dict[Any, Any]]] = []
+        self.deletes: List[str] = []
+        self.movidas: List[Tuple[str, int]] = []
+        self.inserts = 0
+        self.updates = 0
+
+    @property
+    def vazio(self) -> bool:
+        return not self.upserts and not self.deletes and not self.movidas
+
+    def resumo(self) -> Dict[str, int]:
+        return {"inserts": self.inserts, "updates": self.updates, "deletes": len(self.deletes)}
+
+
+def calcular_delta(
+    anteriores: List[Dict[Any, Any]], chaves_anteriores: List[str],
+    novas: List[Dict[Any, Any]], chaves_novas: List[str]
+) -> Delta:
+    """
+    Compara as cargas pela chave das linhas. Linhas iguais reaproveitam o
+    dict da versão anterior (a nova lista compartilha a memória)
+
+    Returns:
+        Delta com a nova lista de linhas, upserts (chave, posição, linha),
+        deletes (chaves) e movidas (chave, nova posição)
+    """
+    delta = Delta()
+    posicoes_anteriores = {chave: i for i, chave in enumerate(chaves_anteriores)}
+    for pos, (chave, row) in enumerate(zip(chaves_novas, novas)):
+        i = posicoes_anteriores.pop(chave, None)
+        if i is None:
+            delta.upserts.append((chave, pos, row))
+            delta.inserts += 1
+        elif anteriores[i] != row:
+            delta.upserts.append((chave, pos, row))
+            delta.updates += 1
+        else:
+            row = anteriores[i]
+            if i != pos:
+                delta.movidas.append((chave, pos))
+        delta.rows.append(row)
+    delta.chaves = list(chaves_novas)
+    delta.deletes = list(posicoes_anteriores)
+    return delta
+
+
+class ChangeLog:
+    """
+    Histórico compacto e limitado das alterações de cada relatório
+
+    Cada entrada guarda a versão, as linhas incluídas/alteradas (por chave)
+    e as chaves excluídas. Uma entrada "reset" marca uma carga completa
+    sem base anterior (os clientes precisam do snapshot inteiro).
+    """
+
+    def __init__(self, max_versoes: int = DELTA_MAX_VERSOES, max_linhas: int = DELTA_MAX_LINHAS):
+        self.max_versoes = max_versoes
+        self.max_linhas = max_linhas
+        self._logs: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._versoes: Dict[str, int] = {}
+        self._chaves: Dict[str, Tuple[List[Dict[Any, Any]], List[str]]] = {}
+        self._lock = threading.Lock()
+
+    def versao(self, report_id: str) -> int:
+        return self._versoes.get(report_id, 0)
+
+    def chaves(self, report_id: str, rows: List[Dict[Any, Any]], key_columns: Optional[List[str]] = None) -> List[str]:
+        """Chaves das linhas publicadas (memoizadas pela identidade da lista)"""
+        origem, chaves = self._chaves.get(report_id, (None, None))
+        if origem is not rows:
+            chaves = chaves_linhas(rows, key_columns)
+            self._chaves[report_id] = (rows, chaves)
+        return chaves
+
+    def definir_versao(self, report_id: str, versao: int):
+        """Versão vinda do SQLite (snapshot); descarta o histórico se divergir"""
+        with self._lock:
+            if self._versoes.get(report_id) != versao:
+                self._versoes[report_id] = versao
+                self._logs.pop(report_id, None)
+
+    def registrar(self, report_id: str, versao: int, delta: Optional[Delta]):
+        """
+        Registra a versão nova do relatório
+
+        Args:
+            delta: Alterações em relação à versão anterior; None = reset
+        """
+        entrada = {"version": versao, "timestamp": datetime.now().isoformat(), "reset": delta is None}
+        if delta is not None:
+            entrada["upserts"] = {chave: row for chave, _, row in delta.upserts}
+            entrada["deletes"] = delta.deletes
+            entrada["summary"] = delta.resumo()
+            self._chaves[report_id] = (delta.rows, delta.chaves)
+        with self._lock:
+            log = self._logs.setdefault(report_id, deque())
+            log.append(entrada)
+            self._versoes[report_id] = versao
+            self._limitar(log)
+
+    def desde(self, report_id: str, versao: int) -> Optional[Dict[str, Any]]:
+        """
+        Alterações acumuladas desde a versão informada
+
+        Returns:
+            Dict com "upserts" (chave -> linha) e "deletes" (chaves), ou
+            None se o histórico não cobre o intervalo (cliente precisa do
+            snapshot completo)
+        """
+        with self._lock:
+            atual = self._versoes.get(report_id, 0)
+            if versao == atual:
+                return {"upserts": {}, "deletes": []}
+            if versao < 0 or versao > atual:
+                return None
+            entradas = [e for e in self._logs.get(report_id, ()) if e["version"] > versao]
+
+        if not entradas or entradas[0]["version"] != versao + 1 or any(e["reset"] for e in entradas):
+            return None
+
+        upserts: Dict[str, Dict[Any, Any]] = {}
+        deletes: Dict[str, None] = {}
+        for entrada in entradas:
+            for chave in entrada["deletes"]:
+                upserts.pop(chave, None)
+                deletes[chave] = None
+            for chave, row in entrada["upserts"].items():
+                deletes.pop(chave, None)
+                upserts[chave] = row
+        return {"upserts": upserts, "deletes": list(deletes)}
+
+    def _limitar(self, log: Deque[Dict[str, Any]]):
+        while len(log) > self.max_versoes:
+            log.popleft()
+        linhas = sum(len(e.get("upserts", ())) + len(e.get("deletes", ())) for e in log)
+        while len(log) > 1 and linhas > self.max_linhas:
+            antiga = log.popleft()
+            linhas -= len(antiga.get("upserts", ())) + len(antiga.get("deletes", ()))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                report_id: {
+                    "version": self._versoes.get(report_id, 0),
+                    "entries": len(log),
+                    "oldest_version": log[0]["version"] if log else None,
+                }
+                for report_id, log in self._logs.items()
+            }
+
+
+sheet_changes = ChangeLog()
@@ -0,0 +1,137 @@
+"""
+Eventos das planilhas via Server-Sent Events (SSE)
+Um único difusor em processo distribui os eventos de carga (início/fim,
+linhas por relatório, validação, novas versões) para as abas conectadas,
+cada uma com sua fila limitada
+"""
+import asyncio
+import os
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Set, Tuple
+
+from respostas import dumps
+
+MEDIA_TYPE_SSE = "text/event-stream"
+
+# Eventos pendentes por cliente; quem ficar para trás é desconectado e,
+# ao reconectar (o EventSource faz isso sozinho), recebe o estado atual
+EVENTOS_FILA_MAX = int(os.getenv("EVENTOS_FILA_MAX", "100"))
+# Eventos recentes guardados para retomar a partir do Last-Event-ID
+EVENTOS_HISTORICO = int(os.getenv("EVENTOS_HISTORICO", "200"))
+EVENTOS_HEARTBEAT = float(os.getenv("EVENTOS_HEARTBEAT", "15"))
+
+_DESCONECTAR = object()
+
+
+def formatar_evento(evento_id: Optional[int], tipo: str, dados: Any) -> bytes:
+    """Um evento no formato text/event-stream"""
+    cabecalho = f"id: {evento_id}\n" if evento_id is not None else ""
+    return f"{cabecalho}event: {tipo}\n".encode("utf-8") + b"data: " + dumps(dados) + b"\n\n"
+
+
+class Broadcaster:
+    """Difusor de eventos: publica de qualquer thread, entrega no event loop"""
+
+    def __init__(self, fila_max: int = EVENTOS_FILA_MAX, historico: int = EVENTOS_HISTORICO):
+        self.fila_max = fila_max
+        self._clientes: Set[asyncio.Queue] = set()
+        self._historico: Deque[Tuple[int, str, Any]] = deque(maxlen=historico)
+        self._proximo_id = 1
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        self.desconectados = 0
+
+    def configurar_loop(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    def publicar(self, tipo: str, dados: Dict[str, Any]):
+        """Publica um evento (seguro a partir de threads de trabalho)"""
+        with self._lock:
+            evento = (self._proximo_id, tipo, dados)
+            self._proximo_id += 1
+            self._historico.append(evento)
+        loop = self._loop
+        if loop is None or loop.is_closed() or not self._clientes:
+            return
+        try:
+            em_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            em_loop = False
+        if em_loop:
+            self._distribuir(evento)
+        else:
+            loop.call_soon_threadsafe(self._distribuir, evento)
+
+    def _distribuir(self, evento: Tuple[int, str, Any]):
+        for fila in list(self._clientes):
+            try:
+                fila.put_nowait(evento)
+            except asyncio.QueueFull:
+                # Cliente lento: descarta a fila e encerra a conexão
+                while not fila.empty():
+                    fila.get_nowait()
+                fila.put_nowait(_DESCONECTAR)
+                self._clientes.discard(fila)
+                self.desconectados += 1
+
+    def _pendentes(self, ultimo_id: Optional[int]):
+        """Eventos após ultimo_id, ou None se já saíram do histórico"""
+        if ultimo_id is None:
+            return None
+        with self._lock:
+            eventos = list(self._historico)
+        if not eventos or ultimo_id < eventos[0][0] - 1 or ultimo_id >= self._proximo_id:
+            return None
+        return [e for e in eventos if e[0] > ultimo_id]
+
+    async def assinar(self, estado_atual, ultimo_id: Optional[int] = None, is_disconnected=None) -> AsyncIterator[bytes]:
+        """
+        Stream SSE de um cliente
+
+        Args:
+            estado_atual: Função que devolve o estado completo (evento "status")
+            ultimo_id: Last-Event-ID enviado na reconexão
+            is_disconnected: Corrotina que indica se o cliente saiu
+        """
+        self._loop = asyncio.get_running_loop()
+        fila: asyncio.Queue = asyncio.Queue(maxsize=self.fila_max)
+        # Assina antes de ler o histórico; repetidos são ignorados pelo id
+        self._clientes.add(fila)
+        enviado = self._proximo_id - 1
+        pendentes = self._pendentes(ultimo_id)
+        try:
+            yield b"retry: 3000\n\n"
+            if pendentes is None:
+                yield formatar_evento(enviado, "status", estado_atual())
+            else:
+                for evento in pendentes:
+                    enviado = evento[0]
+                    yield formatar_evento(*evento)
+
+            while True:
+                try:
+                    evento = await asyncio.wait_for(fila.get(), timeout=EVENTOS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    if is_disconnected is not None and await is_disconnected():
+                        return
+                    yield b": ping\n\n"
+                    continue
+                if evento is _DESCONECTAR:
+                    return
+                if evento[0] <= enviado:
+                    continue
+                enviado = evento[0]
+                yield formatar_evento(*evento)
+        finally:
+            self._clientes.discard(fila)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "clients": len(self._clientes),
+            "last_event_id": self._proximo_id - 1,
+            "dropped_clients": self.desconectados,
+        }
+
+
+sheet_events = Broadcaster()
@@ -0,0 +1,132 @@
+"""
+Recarga das planilhas sob demanda (/api/sheets/reload)
+A recarga roda como tarefa no event loop do servidor; chamadas simultâneas
+compartilham o mesmo job (single-flight), com progresso por relatório
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Tempo (segundos) que um job concluído continua consultável
+RELOAD_RETENCAO_JOBS = int(os.getenv("RELOAD_RETENCAO_JOBS", "3600"))
+
+
+class ReloadJobManager:
+    """
+    Uma recarga por vez
+
+    Quem pede a recarga enquanto outra está em andamento recebe o mesmo job
+    (deduplicado=True) em vez de disparar outra rodada de downloads.
+    """
+
+    def __init__(self, retencao: int = RELOAD_RETENCAO_JOBS):
+        self.retencao = retencao
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._atual: Optional[str] = None
+
+    def submeter(
+        self,
+        executar: Callable[[], Awaitable[Any]],
+        report_ids: List[str],
+        force: bool,
+        usuario: str
+    ) -> Dict[str, Any]:
+        """
+        Inicia a recarga (ou reaproveita a que está em andamento)
+
+        Args:
+            executar: Corrotina que recarrega todas as planilhas
+            report_ids: Relatórios acompanhados no progresso
+            force: Ignorar o cache SQLite (vale o do job em andamento)
+            usuario: Email de quem solicitou
+
+        Returns:
+            Status do job
+        """
+        self._limpar()
+
+        job_id = self._atual
+        if job_id and not self._jobs[job_id]["_task"].done():
+            self._jobs[job_id]["usuarios"].add(usuario)
+            return dict(self.status(job_id), deduplicado=True)
+
+        job_id = uuid.uuid4().hex
+        self._jobs[job_id] = {
+            "job_id": job_id,
+            "force": force,
+            "usuarios": {usuario},
+            "relatorios": {report_id: {"status": "pending"} for report_id in report_ids},
+            "criado_em": datetime.now().isoformat(),
+            "concluido_em": None,
+            "erro": None,
+            "_task": asyncio.create_task(self._executar(job_id, executar))
+        }
+        self._atual = job_id
+        return dict(self.status(job_id), deduplicado=False)
+
+    async def _executar(self, job_id: str, executar):
+        job = self._jobs[job_id]
+        try:
+            await executar()
+        except Exception as e:
+            job["erro"] = str(e)
+            logger.error(f"❌ Falha na recarga {job_id}: {e}")
+        finally:
+            job["concluido_em"] = datetime.now().isoformat()
+
+    async def aguardar(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Espera o job terminar; desistir da espera não cancela a recarga"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        await asyncio.shield(job["_task"])
+        return self.status(job_id)
+
+    def progresso(self, report_id: str, status: str, **info: Any):
+        """Atualiza um relatório no job em andamento (sem job, ignora)"""
+        job = self._jobs.get(self._atual) if self._atual else None
+        if job is not None and job["concluido_em"] is None:
+            job["relatorios"][report_id] = dict(info, status=status)
+
+    def _limpar(self):
+        """Remove jobs finalizados há mais tempo que a retenção"""
+        limite = datetime.now().timestamp() - self.retencao
+        for job_id, job in list(self._jobs.items()):
+            concluido = job["concluido_em"]
+            if concluido and datetime.fromisoformat(concluido).timestamp() < limite:
+                del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self._jobs.get(job_id)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Status público de um job (sem campos internos)"""
+        job = self._jobs.get(job_id)
+        if not job:
+            return None
+
+        if job["concluido_em"] is None:
+            status = "processando"
+        else:
+            status = "erro" if job["erro"] else "concluido"
+
+        relatorios = {report_id: dict(r) for report_id, r in job["relatorios"].items()}
+        return {
+            "job_id": job_id,
+            "status": status,
+            "force": job["force"],
+            "relatorios": relatorios,
+            "concluidos": sum(1 for r in relatorios.values() if r["status"] not in ("pending", "fetching")),
+            "total": len(relatorios),
+            "criado_em": job["criado_em"],
+            "concluido_em": job["concluido_em"],
+            "erro": job["erro"]
+        }
+
+
+reload_jobs = ReloadJobManager()
@@ -0,0 +1,108 @@
+"""
+Atualização periódica das planilhas em segundo plano
+Cada relatório é recarregado no próprio intervalo (com jitter), enquanto as
+leituras continuam servindo a versão atual em memória (stale-while-revalidate)
+"""
+import asyncio
+import os
+import random
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Intervalo padrão entre atualizações (segundos; 0 desliga) e jitter
+# (fração do intervalo); cada entrada do REPORTS_CONFIG pode definir
+# o próprio "refresh_interval"
+SHEETS_REFRESH_INTERVAL = float(os.getenv("SHEETS_REFRESH_INTERVAL", "900"))
+SHEETS_REFRESH_JITTER = float(os.getenv("SHEETS_REFRESH_JITTER", "0.1"))
+
+
+def _iso(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp else None
+
+
+class SheetsScheduler:
+    """Uma tarefa asyncio por relatório, no event loop do servidor"""
+
+    def __init__(self, interval: float = SHEETS_REFRESH_INTERVAL, jitter: float = SHEETS_REFRESH_JITTER):
+        self.interval = interval
+        self.jitter = max(0.0, min(jitter, 1.0))
+        self._tarefas: Dict[str, asyncio.Task] = {}
+        self._estado: Dict[str, Dict[str, Any]] = {}
+
+    def _proxima_espera(self, intervalo: float) -> float:
+        return intervalo * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def iniciar(self, configs: List[Dict[str, Any]], atualizar: Callable[[Dict[str, Any]], Awaitable[Any]]):
+        """
+        Agenda a atualização de cada relatório
+
+        Args:
+            configs: Entradas do REPORTS_CONFIG
+            atualizar: Corrotina que recarrega um relatório
+        """
+        for config in configs:
+            intervalo = float(config.get("refresh_interval", self.interval))
+            if intervalo <= 0 or config["id"] in self._tarefas:
+                continue
+            self._estado[config["id"]] = {
+                "interval": intervalo,
+                "last_refresh": None,
+                "last_duration": None,
+                "last_error": None,
+                "next_refresh": None,
+                "running": False,
+            }
+            self._tarefas[config["id"]] = asyncio.create_task(self._executar(config, intervalo, atualizar))
+        if self._tarefas:
+            print(f"⏰ Atualização automática agendada para {len(self._tarefas)} planilha(s)")
+
+    async def _executar(self, config: Dict[str, Any], intervalo: float, atualizar):
+        estado = self._estado[config["id"]]
+        while True:
+            espera = self._proxima_espera(intervalo)
+            estado["next_refresh"] = time.time() + espera
+            await asyncio.sleep(espera)
+
+            estado["running"] = True
+            inicio = time.time()
+            try:
+                await atualizar(config)
+                estado["last_error"] = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                estado["last_error"] = str(e)
+                logger.error(f"❌ Atualização agendada de {config['id']} falhou: {e}")
+            finally:
+                estado["running"] = False
+                estado["last_refresh"] = inicio
+                estado["last_duration"] = round(time.time() - inicio, 3)
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """Última e próxima atualização de cada relatório"""
+        return {
+            report_id: {
+                "interval": e["interval"],
+                "running": e["running"],
+                "last_refresh": _iso(e["last_refresh"]),
+                "last_duration": e["last_duration"],
+                "last_error": e["last_error"],
+                "next_refresh": None if e["running"] else _iso(e["next_refresh"]),
+            }
+            for report_id, e in self._estado.items()
+        }
+
+    async def parar(self):
+        """Cancela as tarefas (desligamento do servidor)"""
+        tarefas = list(self._tarefas.values())
+        for tarefa in tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*tarefas, return_exceptions=True)
+        self._tarefas.clear()
+
+
+sheets_scheduler = SheetsScheduler()
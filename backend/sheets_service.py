@@ -0,0 +1,94 @@
+"""
+Cliente HTTP assíncrono para as planilhas publicadas do Google Sheets
+Um único httpx.AsyncClient com pool de conexões, compartilhado por todas as
+cargas, e um limite de downloads simultâneos
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+import logging
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Downloads simultâneos e timeout padrão (segundos) por planilha;
+# cada entrada do REPORTS_CONFIG pode definir o próprio "timeout"
+SHEETS_MAX_CONCORRENCIA = int(os.getenv("SHEETS_MAX_CONCORRENCIA", "4"))
+SHEETS_TIMEOUT = float(os.getenv("SHEETS_TIMEOUT", "10"))
+SHEETS_CONNECT_TIMEOUT = float(os.getenv("SHEETS_CONNECT_TIMEOUT", "5"))
+
+
+class SheetsService:
+    """Downloads concorrentes das planilhas com um cliente HTTP compartilhado"""
+
+    def __init__(self, max_concorrencia: int = SHEETS_MAX_CONCORRENCIA, timeout: float = SHEETS_TIMEOUT):
+        self.max_concorrencia = max(1, max_concorrencia)
+        self.timeout = timeout
+        self._cliente: Optional[httpx.AsyncClient] = None
+        self._semaforo: Optional[asyncio.Semaphore] = None
+        self._loop = None
+
+    def _obter_cliente(self):
+        # Cliente e semáforo ficam presos ao event loop em que foram criados
+        loop = asyncio.get_running_loop()
+        if self._cliente is None or self._loop is not loop:
+            self._cliente = httpx.AsyncClient(
+                follow_redirects=True,  # CSV publicado redireciona para googleusercontent
+                timeout=httpx.Timeout(self.timeout, connect=SHEETS_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=self.max_concorrencia,
+                    max_keepalive_connections=self.max_concorrencia
+                ),
+            )
+            self._semaforo = asyncio.Semaphore(self.max_concorrencia)
+            self._loop = loop
+        return self._cliente, self._semaforo
+
+    @asynccontextmanager
+    async def abrir(
+        self, config: Dict[str, Any], etag: Optional[str] = None, last_modified: Optional[str] = None
+    ) -> AsyncIterator[httpx.Response]:
+        """
+        Abre o download do CSV de uma planilha em streaming; o corpo é lido
+        com response.aiter_bytes() dentro do bloco (que ocupa uma vaga do
+        limite de concorrência até terminar)
+
+        Args:
+            config: Entrada do REPORTS_CONFIG
+            etag, last_modified: Validadores da última versão baixada; com
+                eles a requisição é condicional e pode voltar 304 (sem corpo)
+
+        Raises:
+            httpx.HTTPError: Falha de rede, timeout ou status de erro
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        cliente, semaforo = self._obter_cliente()
+        timeout = config.get("timeout", self.timeout)
+        async with semaforo:
+            async with cliente.stream(
+                "GET",
+                config["url"],
+                headers=headers,
+                timeout=httpx.Timeout(timeout, connect=min(timeout, SHEETS_CONNECT_TIMEOUT))
+            ) as response:
+                if response.status_code != 304:
+                    response.raise_for_status()
+                yield response
+
+    async def fechar(self):
+        """Fecha o pool de conexões (desligamento do servidor)"""
+        if self._cliente is not None and self._loop is asyncio.get_running_loop():
+            await self._cliente.aclose()
+        self._cliente = None
+        self._semaforo = None
+        self._loop = None
+
+
+sheets_service = SheetsService()
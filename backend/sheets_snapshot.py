@@ -0,0 +1,146 @@
+"""
+Estado publicado das planilhas em snapshots imutáveis e versionados
+Cada publicação monta um snapshot novo ao lado do atual e o troca com uma
+única atribuição; quem está lendo continua com o snapshot que pegou
+"""
+import threading
+from datetime import datetime, timezone
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from versoes import hash_conteudo
+
+_MANTER = object()
+
+
+class SheetsSnapshot:
+    """
+    Dados, validação, versão e estado de carga das planilhas num dado momento
+
+    A versão de cada relatório (hash do conteúdo e data da última mudança)
+    é publicada junto com as linhas, então ETag, Last-Modified e cursores
+    derivados do snapshot sempre correspondem aos dados que ele contém.
+
+    Imutável: os mapas são somente leitura e as listas de linhas publicadas
+    nunca são alteradas (uma carga nova gera uma lista nova). Um leitor pega
+    o snapshot uma vez por requisição e enxerga tudo consistente, sem lock;
+    o snapshot antigo é liberado quando o último leitor solta a referência.
+    """
+
+    __slots__ = ("version", "data", "validation", "versoes", "loading", "last_update", "ready")
+
+    def __init__(
+        self,
+        version: int = 0,
+        data: Optional[Dict[str, List[Dict]]] = None,
+        validation: Optional[Dict[str, Dict]] = None,
+        versoes: Optional[Dict[str, Tuple[str, datetime]]] = None,
+        loading: bool = False,
+        last_update: Optional[str] = None,
+        ready: bool = False
+    ):
+        object.__setattr__(self, "version", version)
+        object.__setattr__(self, "data", MappingProxyType(dict(data or {})))
+        object.__setattr__(self, "validation", MappingProxyType(dict(validation or {})))
+        object.__setattr__(self, "versoes", MappingProxyType(dict(versoes or {})))
+        object.__setattr__(self, "loading", loading)
+        object.__setattr__(self, "last_update", last_update)
+        object.__setattr__(self, "ready", ready)
+
+    def __setattr__(self, nome, valor):
+        raise AttributeError("SheetsSnapshot é imutável; publique um novo com SheetsState.publicar")
+
+    def rows(self, report_id: str) -> List[Dict]:
+        return self.data.get(report_id, [])
+
+    def validacao(self, report_id: str) -> Dict:
+        return self.validation.get(report_id, {"ok": True})
+
+    def versao(self, report_id: str) -> Optional[str]:
+        """Hash do conteúdo (linhas + validação) do relatório neste snapshot"""
+        versao = self.versoes.get(report_id)
+        return versao[0] if versao else None
+
+    def etag(self, *report_ids: str, extra: Any = None) -> str:
+        """ETag dos relatórios informados (+ parâmetros que alteram a resposta)"""
+        partes = [(report_id, self.versao(report_id)) for report_id in report_ids]
+        return f'"{hash_conteudo(partes, extra)}"'
+
+    def modificado(self, *report_ids: str) -> Optional[datetime]:
+        """Última mudança de conteúdo entre os relatórios informados"""
+        datas = [self.versoes[r][1] for r in report_ids if r in self.versoes]
+        return max(datas) if datas else None
+
+
+class SheetsState:
+    """Referência ao snapshot atual; as publicações são serializadas"""
+
+    def __init__(self):
+        self._atual = SheetsSnapshot()
+        self._lock = threading.Lock()
+
+    def atual(self) -> SheetsSnapshot:
+        """Snapshot vigente (leitura sem lock)"""
+        return self._atual
+
+    def publicar(
+        self,
+        relatorios: Optional[Mapping[str, Tuple[List[Dict], Optional[Dict]]]] = None,
+        loading: Any = _MANTER,
+        last_update: Any = _MANTER,
+        ready: Any = _MANTER
+    ) -> SheetsSnapshot:
+        """
+        Publica um snapshot novo a partir do atual
+
+        Args:
+            relatorios: report_id -> (linhas, validação); validação None
+                mantém a anterior. A versão (hash) de cada relatório é
+                recalculada e só avança quando o conteúdo muda
+            loading: Novo estado de carga (omitido = mantém)
+            last_update: Nova data da última carga (omitida = mantém)
+            ready: Pronto para tráfego (omitido = mantém)
+
+        Returns:
+            O snapshot publicado
+        """
+        with self._lock:
+            base = self._atual
+            data = dict(base.data)
+            validation = dict(base.validation)
+            versoes = dict(base.versoes)
+            for report_id, (rows, validacao) in (relatorios or {}).items():
+                data[report_id] = rows
+                if validacao is not None:
+                    validation[report_id] = validacao
+                conteudo = hash_conteudo(rows, validation.get(report_id, {"ok": True}))
+                if report_id not in versoes or versoes[report_id][0] != conteudo:
+                    versoes[report_id] = (conteudo, datetime.now(timezone.utc).replace(microsecond=0))
+            novo = SheetsSnapshot(
+                version=base.version + 1,
+                data=data,
+                validation=validation,
+                versoes=versoes,
+                loading=base.loading if loading is _MANTER else loading,
+                last_update=base.last_update if last_update is _MANTER else last_update,
+                ready=base.ready if ready is _MANTER else ready
+            )
+            self._atual = novo
+            return novo
+
+    def stats(self) -> Dict[str, Any]:
+        atual = self._atual
+        return {
+            "version": atual.version,
+            "reports": {report_id: len(rows) for report_id, rows in atual.data.items()},
+            "versions": {
+                report_id: {"hash": conteudo, "modificado": modificado.isoformat()}
+                for report_id, (conteudo, modificado) in atual.versoes.items()
+            },
+            "loading": atual.loading,
+            "last_update": atual.last_update,
+            "ready": atual.ready,
+        }
+
+
+sheets_state = SheetsState()
@@ -0,0 +1,55 @@
+"""
+Respostas JSON em streaming (NDJSON ou array JSON enviado em blocos)
+Serializa as linhas aos poucos a partir do armazenamento colunar, com um
+buffer de tamanho fixo, para a memória do servidor não crescer com o relatório
+"""
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from respostas import dumps
+
+STREAM_BUFFER = 64 * 1024
+LINHAS_POR_LOTE = 500
+
+MEDIA_TYPE_NDJSON = "application/x-ndjson"
+
+
+def _linhas_serializadas(store, posicoes, campos: Optional[List[Any]]) -> Iterator[bytes]:
+    # Materializa poucas linhas por vez
+    for inicio in range(0, len(posicoes), LINHAS_POR_LOTE):
+        for row in store.rows(posicoes[inicio:inicio + LINHAS_POR_LOTE], campos):
+            yield dumps(row)
+
+
+def _em_blocos(partes: Iterable[bytes]) -> Iterator[bytes]:
+    """Agrupa as partes em blocos de até STREAM_BUFFER bytes"""
+    buffer = bytearray()
+    primeiro = True
+    for parte in partes:
+        buffer += parte
+        # O primeiro bloco sai imediatamente para o cliente começar a ler
+        if primeiro or len(buffer) >= STREAM_BUFFER:
+            yield bytes(buffer)
+            buffer.clear()
+            primeiro = False
+    if buffer:
+        yield bytes(buffer)
+
+
+def stream_ndjson(store, posicoes, campos: Optional[List[Any]] = None) -> Iterator[bytes]:
+    """Uma linha JSON por registro (application/x-ndjson)"""
+    return _em_blocos(linha + b"\n" for linha in _linhas_serializadas(store, posicoes, campos))
+
+
+def stream_json(envelope: Dict[str, Any], campo: str, store, posicoes, campos: Optional[List[Any]] = None) -> Iterator[bytes]:
+    """
+    Objeto JSON com os metadados do envelope e os registros em "campo",
+    no mesmo formato da resposta normal, mas serializado incrementalmente
+    """
+    def partes():
+        inicio = dumps(envelope)[:-1]
+        yield inicio + (b", " if envelope else b"") + dumps(campo) + b": ["
+        for i, linha in enumerate(_linhas_serializadas(store, posicoes, campos)):
+            yield linha if i == 0 else b", " + linha
+        yield b"]}"
+
+    return _em_blocos(partes())
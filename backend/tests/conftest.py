@@ -0,0 +1,44 @@
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# Os módulos do backend se importam pelo nome (from report_store import ...)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# O cache_service cria o banco ao ser importado: aponta para um diretório
+# temporário antes disso para o teste não deixar data/cache.db na árvore
+DB_DIR_TESTES = tempfile.mkdtemp(prefix="cache-testes-")
+os.environ["CACHE_DB_DIR"] = DB_DIR_TESTES
+
+import cache_service as cache_module
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(DB_DIR_TESTES, ignore_errors=True)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """CacheService com um banco SQLite temporário"""
+    monkeypatch.setattr(cache_module, "DB_DIR", tmp_path)
+    monkeypatch.setattr(cache_module, "DB_PATH", tmp_path / "cache.db")
+    return cache_module.CacheService()
+
+
+@pytest.fixture
+def app_isolado(cache, monkeypatch):
+    """app.py com banco, histórico e snapshot próprios do teste"""
+    app = pytest.importorskip("app")
+    from sheets_delta import ChangeLog
+    from sheets_snapshot import SheetsState
+
+    monkeypatch.setattr(app, "cache_service", cache)
+    monkeypatch.setattr(app, "sheet_changes", ChangeLog())
+    monkeypatch.setattr(app, "sheets_state", SheetsState())
+    monkeypatch.setattr(app, "report_source_meta", {})
+    monkeypatch.setattr(app, "report_sqlite_pendente", set())
+    return app
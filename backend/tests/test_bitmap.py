@@ -0,0 +1,34 @@
+import random
+
+import pytest
+
+from bitmap import Bitmap
+
+
+def conjunto(rnd, universo, densidade):
+    return sorted(p for p in range(universo) if rnd.random() < densidade)
+
+
+@pytest.mark.parametrize("densidade", [0.001, 0.05, 0.5, 0.95])
+def test_operacoes_iguais_as_de_conjunto(densidade):
+    rnd = random.Random(densidade)
+    universo = 200_000
+    a = conjunto(rnd, universo, densidade)
+    b = conjunto(rnd, universo, rnd.random())
+    bitmap_a, bitmap_b = Bitmap.from_sorted(a), Bitmap.from_sorted(b)
+
+    assert list(bitmap_a) == a
+    assert len(bitmap_a) == len(a)
+    assert list(bitmap_a & bitmap_b) == sorted(set(a) & set(b))
+    assert list(bitmap_a | bitmap_b) == sorted(set(a) | set(b))
+    for pos in rnd.sample(range(universo), 100):
+        assert (pos in bitmap_a) == (pos in set(a))
+
+
+def test_bitmap_vazio():
+    vazio = Bitmap()
+    cheio = Bitmap.from_sorted(range(10))
+    assert not vazio
+    assert len(vazio) == 0
+    assert list(vazio & cheio) == []
+    assert list(vazio | cheio) == list(range(10))
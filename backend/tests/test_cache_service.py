@@ -0,0 +1,164 @@
+import json
+import sqlite3
+
+import pytest
+
+import cache_service as cache_module
+from csv_ingest import ingerir_corpo, spool_blocos
+from sheets_delta import chaves_linhas
+
+KEY = ["Código Cliente"]
+
+
+def linhas(n, alterar=None):
+    rows = [{"Código Cliente": str(i), "Nome": f"cliente {i}", "Detalhes": "d"} for i in range(n)]
+    for i, nome in (alterar or {}).items():
+        rows[i] = dict(rows[i], Nome=nome)
+    return rows
+
+
+def upserts_completos(rows):
+    return [(chave, pos, row) for pos, (chave, row) in enumerate(zip(chaves_linhas(rows, KEY), rows))]
+
+
+def salvar(cache, rows, version, **kwargs):
+    params = dict(upserts=upserts_completos(rows), deletes=[], moved=[], reset=True)
+    params.update(kwargs)
+    return cache.save_report_delta(
+        report_id="queijo", label="Queijo", version=version, row_count=len(rows),
+        validation_status={"ok": True}, **params
+    )
+
+
+def criar_blob_legado(db_path, rows):
+    """Banco de antes do armazenamento por linha (sem version/storage)"""
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE report_cache (
+            id TEXT PRIMARY KEY, label TEXT NOT NULL, data TEXT NOT NULL,
+            row_count INTEGER NOT NULL, last_update TEXT NOT NULL, validation_status TEXT
+        )
+    """)
+    conn.execute(
+        "INSERT INTO report_cache VALUES ('queijo', 'Queijo', ?, ?, '2024-01-01T00:00:00', NULL)",
+        (json.dumps(rows), len(rows))
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_reset_e_delta_ida_e_volta(cache):
+    v1 = linhas(5)
+    assert salvar(cache, v1, 1)
+    assert cache.get_report_storage("queijo") == "rows"
+
+    # Altera a linha 1, exclui a 0 e inclui a 5: as demais mudam de posição
+    v2 = linhas(6, {1: "alterado"})[1:]
+    chaves = chaves_linhas(v2, KEY)
+    assert salvar(
+        cache, v2, 2,
+        upserts=[(chaves[0], 0, v2[0]), (chaves[4], 4, v2[4])],
+        deletes=['["0"]'],
+        moved=[(chaves[i], i) for i in (1, 2, 3)],
+        reset=False
+    )
+
+    cached = cache.get_report_cache("queijo")
+    assert cached["data"] == v2
+    assert cached["row_count"] == 5
+    assert cached["version"] == 2
+    assert cache.get_report_version("queijo") == 2
+
+
+def test_delta_sobre_blob_legado_e_recusado(tmp_path, monkeypatch):
+    criar_blob_legado(tmp_path / "cache.db", linhas(10))
+    monkeypatch.setattr(cache_module, "DB_DIR", tmp_path)
+    monkeypatch.setattr(cache_module, "DB_PATH", tmp_path / "cache.db")
+    cache = cache_module.CacheService()
+    assert cache.get_report_storage("queijo") == "blob"
+    assert cache.get_report_cache("queijo")["version"] == 0
+
+    novas = linhas(10, {3: "alterado"})
+    assert not salvar(cache, novas, 1, upserts=upserts_completos(novas)[3:4], reset=False)
+
+    # Nada mudou: o blob continua inteiro
+    cached = cache.get_report_cache("queijo")
+    assert cached["data"] == linhas(10)
+    assert cache.get_report_storage("queijo") == "blob"
+
+
+def test_reset_migra_blob_legado(tmp_path, monkeypatch):
+    criar_blob_legado(tmp_path / "cache.db", linhas(10))
+    monkeypatch.setattr(cache_module, "DB_DIR", tmp_path)
+    monkeypatch.setattr(cache_module, "DB_PATH", tmp_path / "cache.db")
+    cache = cache_module.CacheService()
+
+    novas = linhas(10, {3: "alterado"})
+    assert salvar(cache, novas, 1)
+
+    cached = cache.get_report_cache("queijo")
+    assert cache.get_report_storage("queijo") == "rows"
+    assert cached["data"] == novas
+    assert cached["row_count"] == 10
+
+
+def csv_ingerido(rows):
+    texto = "Código Cliente,Nome,Detalhes\n" + "".join(
+        f"{r['Código Cliente']},{r['Nome']},{r['Detalhes']}\n" for r in rows
+    )
+    return ingerir_corpo(spool_blocos([texto.encode("utf-8")]))
+
+
+def carregar(app, rows):
+    config = next(c for c in app.REPORTS_CONFIG if c["id"] == "queijo")
+    ingerido = csv_ingerido(rows)
+    meta = {"content_hash": ingerido.content_hash, "etag": None, "last_modified": None}
+    return app.processar_planilha(config, ingerido, meta)
+
+
+def test_recarga_sobre_blob_legado_grava_todas_as_linhas(app_isolado, tmp_path, monkeypatch):
+    app = app_isolado
+    legado = tmp_path / "legado"
+    legado.mkdir()
+    criar_blob_legado(legado / "cache.db", linhas(10))
+    monkeypatch.setattr(cache_module, "DB_DIR", legado)
+    monkeypatch.setattr(cache_module, "DB_PATH", legado / "cache.db")
+    monkeypatch.setattr(app, "cache_service", cache_module.CacheService())
+    app.carregar_snapshot()
+    assert len(app.sheets_state.atual().rows("queijo")) == 10
+
+    novas = linhas(10, {3: "alterado"})
+    carregar(app, novas)
+
+    cached = app.cache_service.get_report_cache("queijo")
+    assert app.cache_service.get_report_storage("queijo") == "rows"
+    assert cached["row_count"] == 10
+    assert cached["data"] == novas
+
+    # Carga seguinte já grava só o delta
+    novas = linhas(10, {3: "alterado", 7: "outro"})
+    evento = carregar(app, novas)
+    assert evento["changes"] == {"inserts": 0, "updates": 1, "deletes": 0}
+    assert app.cache_service.get_report_cache("queijo")["data"] == novas
+
+
+def test_falha_ao_gravar_nao_avanca_versao_nem_meta(app_isolado):
+    app = app_isolado
+    carregar(app, linhas(4))
+    versao = app.sheet_changes.versao("queijo")
+    meta = app.cache_service.get_source_meta("queijo")
+
+    app.cache_service.save_report_delta = lambda **kwargs: False
+    novas = linhas(4, {2: "alterado"})
+    carregar(app, novas)
+    assert app.sheet_changes.versao("queijo") == versao
+    assert app.cache_service.get_source_meta("queijo") == meta
+    assert app.report_sqlite_pendente == {"queijo"}
+
+    # Próxima carga (mesmo conteúdo, delta vazio) grava tudo e marca reset
+    del app.cache_service.save_report_delta
+    carregar(app, novas)
+    assert app.report_sqlite_pendente == set()
+    assert app.cache_service.get_report_cache("queijo")["data"] == novas
+    assert app.sheet_changes.versao("queijo") == versao + 1
+    assert app.sheet_changes.desde("queijo", versao) is None
@@ -0,0 +1,74 @@
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
+
+import pytest
+
+import csv_ingest
+from csv_ingest import baixar_stream, ingerir_corpo, spool_blocos
+
+CSV = "Código Cliente,Nome,Detalhes\n1,Ana,x\n\n   \n2,Bruno,y\n3,Célia,z"
+
+
+def em_blocos(texto, tamanho=5):
+    dados = texto.encode("utf-8")
+    return [dados[i:i + tamanho] for i in range(0, len(dados), tamanho)]
+
+
+async def stream(blocos):
+    for bloco in blocos:
+        yield bloco
+
+
+def test_baixar_stream_calcula_hash_sem_parse(monkeypatch):
+    monkeypatch.setattr(csv_ingest, "INGEST_BLOCOS_EM_FILA", 1)
+    monkeypatch.setattr(csv_ingest, "ler_csv", lambda linhas: pytest.fail("parse durante o download"))
+    corpo = asyncio.run(baixar_stream(stream(em_blocos(CSV))))
+    try:
+        assert corpo.content_hash == hashlib.blake2b(CSV.encode("utf-8"), digest_size=16).hexdigest()
+        assert corpo.bytes == len(CSV.encode("utf-8"))
+    finally:
+        corpo.fechar()
+
+
+def test_ingerir_corpo_decodifica_entre_blocos():
+    # Blocos de 5 bytes cortam os caracteres acentuados ao meio
+    corpo = spool_blocos(em_blocos(CSV))
+    ingerido = ingerir_corpo(corpo)
+    corpo.fechar()
+    assert ingerido.rows == [
+        {"Código Cliente": "1", "Nome": "Ana", "Detalhes": "x"},
+        {"Código Cliente": "2", "Nome": "Bruno", "Detalhes": "y"},
+        {"Código Cliente": "3", "Nome": "Célia", "Detalhes": "z"},
+    ]
+    assert ingerido.store.rows(range(3)) == ingerido.rows
+    assert ingerido.content_hash == corpo.content_hash
+
+
+class RespostaFalsa:
+    status_code = 200
+    charset_encoding = None
+    headers = {"etag": '"v1"'}
+
+    def __init__(self, texto):
+        self.texto = texto
+
+    def aiter_bytes(self):
+        return stream(em_blocos(self.texto))
+
+
+def test_corpo_com_mesmo_hash_nao_passa_pelo_parse(app_isolado, monkeypatch):
+    app = app_isolado
+    config = next(c for c in app.REPORTS_CONFIG if c["id"] == "queijo")
+
+    @asynccontextmanager
+    async def abrir(config, etag=None, last_modified=None):
+        yield RespostaFalsa(CSV)
+
+    monkeypatch.setattr(app.sheets_service, "abrir", abrir)
+    assert asyncio.run(app._carregar_planilha(config))["status"] == "updated"
+
+    parses = []
+    monkeypatch.setattr(app, "ingerir_corpo", lambda *args: parses.append(args))
+    assert asyncio.run(app._carregar_planilha(config))["status"] == "unchanged"
+    assert parses == []
@@ -0,0 +1,62 @@
+from export_service import ExportCache, ler_arquivo
+
+CHAVE = ("msl", "101", "", "excel", "v1")
+
+
+def test_arquivo_aberto_sobrevive_ao_evict(tmp_path):
+    cache = ExportCache(tmp_path, max_bytes=0)
+    conteudo = b"x" * 200_000
+    cache.caminho(CHAVE).write_bytes(conteudo)
+
+    arquivo = cache.abrir(CHAVE)
+    assert arquivo is not None
+    cache.evict()
+    assert not cache.caminho(CHAVE).exists()
+
+    assert b"".join(ler_arquivo(arquivo)) == conteudo
+    assert arquivo.closed
+    assert cache.abrir(CHAVE) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_nomes_do_lote_sem_caminhos():
+    app = __import__("pytest").importorskip("app")
+    consultas = [
+        ("../../etc/passwd", ""), ("C:\\Windows\\x", "a/b"), ("101", "João Silva"),
+        ("a/b", ""), ("a_b", ""), ("..", ".."), ("/abs", "")
+    ]
+    nomes = app.nomes_arquivos_lote("msl", consultas, "pdf")
+    assert nomes == [
+        "msl_etc_passwd.pdf", "msl_C_Windows_x_a_b.pdf", "msl_101_João_Silva.pdf",
+        "msl_a_b.pdf", "msl_a_b_2.pdf", "msl____.pdf", "msl_abs.pdf"
+    ]
+    for nome in nomes:
+        assert "/" not in nome and "\\" not in nome and ".." not in nome and ":" not in nome
+
+
+def test_status_do_job_so_encerra_em_finalizar(tmp_path, monkeypatch):
+    from concurrent.futures import Future
+
+    import export_service
+    from export_service import ExportJobManager
+
+    vistos = []
+    futures = []
+
+    def submeter_render(formato, destino, titulo, headers, linhas):
+        future = Future()
+        # Roda antes do _finalizar: o future já terminou, o job ainda não
+        future.add_done_callback(lambda f: vistos.append(jobs.status(next(iter(jobs._jobs)))["status"]))
+        futures.append(future)
+        return future
+
+    monkeypatch.setattr(export_service, "_submeter_render", submeter_render)
+    jobs = ExportJobManager(ExportCache(tmp_path))
+    job = jobs.submeter(CHAVE, "Título", ["a"], [[1]], "a@b.com")
+    assert job["status"] == "pendente"
+
+    futures[0].set_exception(RuntimeError("falhou"))
+    assert vistos == ["pendente"]
+    status = jobs.status(job["job_id"])
+    assert status["status"] == "erro"
+    assert status["erro"] == "falhou"
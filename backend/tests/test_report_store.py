@@ -0,0 +1,145 @@
+import random
+
+import pytest
+
+from report_store import ReportStore
+
+
+def filtro_antigo(rows, tipo, codvd, vendedor=""):
+    """Filtro linha a linha (com remoção de duplicatas) de antes do ReportStore"""
+    filtrados = []
+    for row in rows:
+        status = str(row.get("STATUS", "")).upper().strip()
+        codvd_val = str(row.get("CODVD", "")).strip()
+        vendedor_val = str(row.get("VENDEDOR", "")).upper()
+
+        if tipo.startswith("nao_cobertos"):
+            if status != "FALTA":
+                continue
+        elif tipo.startswith("msl") or tipo == "exp":
+            if status not in ["OK", "FALTA"]:
+                continue
+
+        if codvd_val != str(codvd).strip():
+            continue
+        if vendedor and vendedor.upper() not in vendedor_val:
+            continue
+        filtrados.append(row)
+
+    vistos = set()
+    unicos = []
+    for row in filtrados:
+        chave = tuple(sorted(row.items()))
+        if chave not in vistos:
+            vistos.add(chave)
+            unicos.append(row)
+    return unicos
+
+
+def gerar_linhas(seed, n=400, duplicatas=False):
+    """Linhas aleatórias; sem duplicatas, cada uma tem um ID próprio"""
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(n):
+        if duplicatas and rows and rnd.random() < 0.2:
+            rows.append(dict(rnd.choice(rows)))
+            continue
+        rows.append({
+            "ID": None if duplicatas else i,
+            "STATUS": rnd.choice(["OK", "ok ", " FALTA", "falta", "PENDENTE", "", None]),
+            "CODVD": rnd.choice([101, "101", " 101 ", "102", 103, "", None]),
+            "VENDEDOR": rnd.choice(["João Silva", "joão silva", "MARIA", "Maria Souza", "", None]),
+            "PRODUTO": rnd.choice(["queijo", "leite", "manteiga"]),
+        })
+    return rows
+
+
+CODVDS = (101, "101", " 102", "103", "", "999")
+VENDEDORES = ("", "joão", "MARIA", "souza", "ninguém")
+
+
+def test_from_rows_preserva_linhas():
+    rows = gerar_linhas(0)
+    store = ReportStore.from_rows(rows)
+    assert len(store) == len(rows)
+    assert store.rows(range(len(rows))) == rows
+    assert store.rows([3, 1], ["CODVD", "ID"]) == [
+        {"CODVD": rows[3]["CODVD"], "ID": 3},
+        {"CODVD": rows[1]["CODVD"], "ID": 1},
+    ]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_filtrar_por_codvd_e_vendedor_igual_ao_filtro_antigo(seed):
+    rows = gerar_linhas(seed)
+    store = ReportStore.from_rows(rows)
+    for codvd in CODVDS:
+        for vendedor in VENDEDORES:
+            esperado = filtro_antigo(rows, "outros", codvd, vendedor)
+            assert store.rows(store.filtrar(codvd, None, vendedor)) == esperado
+
+
+TIPOS = {
+    "nao_cobertos": {"FALTA"},
+    "msl": {"OK", "FALTA"},
+    "exp": {"OK", "FALTA"},
+    "outros": None,
+}
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("tipo", list(TIPOS))
+def test_filtrar_por_status_igual_ao_filtro_antigo(seed, tipo):
+    rows = gerar_linhas(seed)
+    store = ReportStore.from_rows(rows)
+    for codvd in CODVDS:
+        for vendedor in VENDEDORES:
+            esperado = filtro_antigo(rows, tipo, codvd, vendedor)
+            assert store.rows(store.filtrar(codvd, TIPOS[tipo], vendedor)) == esperado
+
+
+def test_contar_por_status():
+    rows = gerar_linhas(7)
+    store = ReportStore.from_rows(rows)
+    esperado = {}
+    for row in filtro_antigo(rows, "msl", "101"):
+        status = str(row["STATUS"]).upper().strip()
+        esperado[status] = esperado.get(status, 0) + 1
+    assert store.contar("101", {"OK", "FALTA"}) == esperado
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("tipo", list(TIPOS))
+def test_duplicatas_iguais_ao_dedupe_antigo(seed, tipo):
+    rows = gerar_linhas(seed, duplicatas=True)
+    store = ReportStore.from_rows(rows)
+    assert any(store.duplicada)
+    for codvd in CODVDS:
+        for vendedor in VENDEDORES:
+            esperado = filtro_antigo(rows, tipo, codvd, vendedor)
+            assert store.rows(store.filtrar(codvd, TIPOS[tipo], vendedor)) == esperado
+
+
+def test_colisao_de_fingerprint_compara_valores(monkeypatch):
+    import report_store
+
+    # Todas as linhas com a mesma impressão digital: só os valores decidem
+    monkeypatch.setattr(report_store, "fingerprint_valores", lambda valores: 0)
+    rows = gerar_linhas(3, n=100, duplicatas=True)
+    store = ReportStore.from_rows(rows)
+    unicas = {tuple(sorted(row.items())) for row in rows}
+    assert store.duplicada.count(False) == len(unicas)
+    for codvd in CODVDS:
+        assert store.rows(store.filtrar(codvd)) == filtro_antigo(rows, "outros", codvd)
+
+
+@pytest.mark.parametrize("tipo", list(TIPOS))
+def test_particionar_igual_a_filtrar(tipo):
+    rows = gerar_linhas(42, duplicatas=True)
+    store = ReportStore.from_rows(rows)
+    consultas = [("101", ""), (" 101", "maria"), ("102", "JOÃO"), ("103", ""), ("999", ""), ("101", "")]
+    particoes = store.particionar(consultas, TIPOS[tipo])
+    assert len(particoes) == len(consultas)
+    for (codvd, vendedor), posicoes in zip(consultas, particoes):
+        assert posicoes == store.filtrar(codvd, TIPOS[tipo], vendedor)
+        assert store.rows(posicoes) == filtro_antigo(rows, tipo, codvd, vendedor)
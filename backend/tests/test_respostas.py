@@ -0,0 +1,39 @@
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from respostas import CompressaoMiddleware, cabecalhos_cache
+
+CORPO = b'{"x": "' + b"a" * 5000 + b'"}'
+
+
+def cliente(headers):
+    async def rota(request):
+        return Response(CORPO, media_type="application/json", headers=headers)
+
+    app = Starlette(routes=[Route("/", rota)])
+    app.add_middleware(CompressaoMiddleware)
+    return TestClient(app)
+
+
+def vary(resposta):
+    return [v for n, v in resposta.headers.raw if n.lower() == b"vary"]
+
+
+def test_vary_existente_nao_e_repetido():
+    resposta = cliente(cabecalhos_cache('"abc"')).get("/", headers={"Accept-Encoding": "gzip"})
+    assert resposta.headers["content-encoding"] == "gzip"
+    assert vary(resposta) == [b"Accept, Accept-Encoding"]
+    assert resposta.headers["etag"] == 'W/"abc"'
+
+
+def test_vary_sem_accept_encoding_recebe_o_valor():
+    resposta = cliente({"Vary": "Accept"}).get("/", headers={"Accept-Encoding": "gzip"})
+    assert vary(resposta) == [b"Accept, Accept-Encoding"]
+
+
+def test_sem_vary_adiciona():
+    resposta = cliente({}).get("/", headers={"Accept-Encoding": "gzip"})
+    assert vary(resposta) == [b"Accept-Encoding"]
+    assert resposta.content == CORPO
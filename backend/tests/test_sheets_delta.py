@@ -0,0 +1,117 @@
+import pytest
+from sheets_delta import ChangeLog, calcular_delta, chaves_linhas
+
+
+def linha(codigo, nome):
+    return {"Código Cliente": codigo, "Nome": nome}
+
+
+def aplicar(base, alteracoes):
+    """Aplica um resultado de ChangeLog.desde sobre {chave: linha}"""
+    resultado = dict(base)
+    for chave in alteracoes["deletes"]:
+        resultado.pop(chave, None)
+    resultado.update(alteracoes["upserts"])
+    return resultado
+
+
+def test_chaves_por_coluna_e_repeticoes():
+    rows = [linha("1", "a"), linha("2", "b"), linha("1", "c")]
+    chaves = chaves_linhas(rows, ["Código Cliente"])
+    assert chaves == ['["1"]', '["2"]', '["1"]#1']
+
+
+def test_chaves_por_impressao_digital():
+    rows = [linha("1", "a"), linha("1", "a"), linha("2", "b")]
+    chaves = chaves_linhas(rows)
+    assert chaves[1] == chaves[0] + "#1"
+    assert chaves[2] != chaves[0]
+    assert chaves_linhas([linha("1", "a")]) == [chaves[0]]
+
+
+def test_calcular_delta():
+    anteriores = [linha("1", "a"), linha("2", "b"), linha("3", "c")]
+    novas = [linha("3", "c"), linha("2", "B"), linha("4", "d")]
+    chaves_ant = chaves_linhas(anteriores, ["Código Cliente"])
+    chaves_novas = chaves_linhas(novas, ["Código Cliente"])
+
+    delta = calcular_delta(anteriores, chaves_ant, novas, chaves_novas)
+
+    assert delta.rows == novas
+    assert delta.rows[0] is anteriores[2]  # linha igual reaproveita o dict
+    assert delta.chaves == chaves_novas
+    assert [(c, p) for c, p, _ in delta.upserts] == [('["2"]', 1), ('["4"]', 2)]
+    assert delta.deletes == ['["1"]']
+    assert delta.movidas == [('["3"]', 0)]
+    assert delta.resumo() == {"inserts": 1, "updates": 1, "deletes": 1}
+    assert not delta.vazio
+
+
+def test_calcular_delta_sem_alteracoes():
+    rows = [linha("1", "a"), linha("2", "b")]
+    chaves = chaves_linhas(rows, ["Código Cliente"])
+    delta = calcular_delta(rows, chaves, [dict(r) for r in rows], list(chaves))
+    assert delta.vazio
+    assert all(nova is antiga for nova, antiga in zip(delta.rows, rows))
+
+
+def _registrar(log, report_id, versao, anteriores, novas):
+    chaves_ant = chaves_linhas(anteriores, ["Código Cliente"])
+    delta = calcular_delta(anteriores, chaves_ant, novas, chaves_linhas(novas, ["Código Cliente"]))
+    log.registrar(report_id, versao, delta)
+    return delta
+
+
+def test_changelog_desde_acumula_versoes():
+    log = ChangeLog()
+    v0 = [linha("1", "a"), linha("2", "b")]
+    v1 = [linha("1", "a"), linha("2", "B"), linha("3", "c")]
+    v2 = [linha("2", "B"), linha("3", "C")]
+    log.registrar("r", 1, None)
+    _registrar(log, "r", 2, v0, v1)
+    _registrar(log, "r", 3, v1, v2)
+
+    base = dict(zip(chaves_linhas(v0, ["Código Cliente"]), v0))
+    esperado = dict(zip(chaves_linhas(v2, ["Código Cliente"]), v2))
+    assert aplicar(base, log.desde("r", 1)) == esperado
+
+    alteracoes = log.desde("r", 2)
+    assert alteracoes["deletes"] == ['["1"]']
+    assert set(alteracoes["upserts"]) == {'["3"]'}
+
+    assert log.desde("r", 3) == {"upserts": {}, "deletes": []}
+
+
+def test_changelog_desde_sem_cobertura():
+    log = ChangeLog()
+    log.registrar("r", 1, None)
+    _registrar(log, "r", 2, [linha("1", "a")], [linha("1", "b")])
+
+    assert log.desde("r", 0) is None  # atravessa o reset
+    assert log.desde("r", 5) is None  # versão do futuro
+    assert log.desde("r", -1) is None
+    assert log.desde("outro", 0) == {"upserts": {}, "deletes": []}
+
+
+def test_changelog_limita_historico():
+    log = ChangeLog(max_versoes=2)
+    rows = [linha("1", "0")]
+    log.registrar("r", 1, None)
+    for versao in range(2, 6):
+        novas = [linha("1", str(versao))]
+        _registrar(log, "r", versao, rows, novas)
+        rows = novas
+
+    assert log.stats()["r"] == {"version": 5, "entries": 2, "oldest_version": 4}
+    assert log.desde("r", 2) is None
+    assert log.desde("r", 3)["upserts"] == {'["1"]': linha("1", "5")}
+
+
+@pytest.mark.parametrize("versao_sqlite", [0, 7])
+def test_changelog_definir_versao(versao_sqlite):
+    log = ChangeLog()
+    log.registrar("r", 1, None)
+    log.definir_versao("r", versao_sqlite)
+    assert log.versao("r") == versao_sqlite
+    assert log.desde("r", versao_sqlite) == {"upserts": {}, "deletes": []}
+    assert log.stats() == {}
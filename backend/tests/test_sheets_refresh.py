@@ -0,0 +1,69 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+CSV = "Código Cliente,Nome,Detalhes\n1,Ana,x\n2,Bruno,y\n3,Célia,z\n"
+
+
+class RespostaFalsa:
+    status_code = 200
+    charset_encoding = None
+    headers = {"etag": '"v1"'}
+
+    async def aiter_bytes(self):
+        yield CSV.encode("utf-8")
+
+
+@asynccontextmanager
+async def abrir(config, etag=None, last_modified=None):
+    yield RespostaFalsa()
+
+
+@asynccontextmanager
+async def falhar(config, etag=None, last_modified=None):
+    raise ConnectionError("rede fora")
+    yield
+
+
+def test_falha_na_atualizacao_mantem_snapshot(app_isolado, monkeypatch):
+    app = app_isolado
+    config = next(c for c in app.REPORTS_CONFIG if c["id"] == "queijo")
+
+    monkeypatch.setattr(app.sheets_service, "abrir", abrir)
+    asyncio.run(app._carregar_planilha(config))
+    antes = app.sheets_state.atual()
+
+    monkeypatch.setattr(app.sheets_service, "abrir", falhar)
+    # Sem a planilha no SQLite, o fallback antigo publicaria o relatório vazio
+    monkeypatch.setattr(app.cache_service, "get_report_cache", lambda report_id: None)
+    evento = asyncio.run(app._carregar_planilha(config))
+    assert evento["status"] == "error"
+    assert app.sheets_state.atual() is antes
+    assert len(app.sheets_state.atual().rows("queijo")) == 3
+
+    with pytest.raises(RuntimeError, match="rede fora"):
+        asyncio.run(app.atualizar_planilha_agendada(config))
+    assert app.sheets_state.atual() is antes
+
+
+def test_falha_no_inicio_a_frio_usa_sqlite(app_isolado, monkeypatch):
+    app = app_isolado
+    config = next(c for c in app.REPORTS_CONFIG if c["id"] == "queijo")
+    monkeypatch.setattr(app.sheets_service, "abrir", falhar)
+
+    linhas = [{"Código Cliente": "9", "Nome": "SQLite", "Detalhes": "-"}]
+    cached = {"data": linhas, "row_count": 1, "version": 1, "validation_status": {"ok": True}}
+    monkeypatch.setattr(app.cache_service, "get_report_cache", lambda report_id: cached)
+    assert asyncio.run(app._carregar_planilha(config))["status"] == "error"
+    assert app.sheets_state.atual().rows("queijo") == linhas
+
+
+def test_falha_no_inicio_a_frio_sem_sqlite_publica_vazio(app_isolado, monkeypatch):
+    app = app_isolado
+    config = next(c for c in app.REPORTS_CONFIG if c["id"] == "queijo")
+    monkeypatch.setattr(app.sheets_service, "abrir", falhar)
+
+    assert asyncio.run(app._carregar_planilha(config))["status"] == "error"
+    assert "queijo" in app.sheets_state.atual().data
+    assert app.sheets_state.atual().rows("queijo") == []
@@ -0,0 +1,46 @@
+import pytest
+
+from sheets_snapshot import SheetsState
+from versoes import hash_conteudo
+
+
+def test_snapshot_imutavel():
+    snapshot = SheetsState().publicar({"a": ([{"x": 1}], None)})
+    with pytest.raises(AttributeError):
+        snapshot.ready = True
+    with pytest.raises(TypeError):
+        snapshot.data["b"] = []
+
+
+def test_versao_publicada_junto_com_as_linhas():
+    state = SheetsState()
+    v1 = state.publicar({"a": ([{"x": 1}], {"ok": True})})
+    assert v1.versao("a") == hash_conteudo([{"x": 1}], {"ok": True})
+    assert v1.modificado("a") is not None
+    assert v1.versao("b") is None
+
+    # Mesmo conteúdo: versão, data e ETag não mudam
+    v2 = state.publicar({"a": ([{"x": 1}], None)})
+    assert v2.versoes["a"] == v1.versoes["a"]
+    assert v2.etag("a", extra=[1]) == v1.etag("a", extra=[1])
+
+    # Conteúdo novo: ETag nova no mesmo snapshot das linhas novas
+    v3 = state.publicar({"a": ([{"x": 2}], None)})
+    assert v3.rows("a") == [{"x": 2}]
+    assert v3.versao("a") == hash_conteudo([{"x": 2}], {"ok": True})
+    assert v3.etag("a") != v1.etag("a")
+    # O snapshot antigo continua com a versão das linhas antigas
+    assert v1.rows("a") == [{"x": 1}]
+    assert v1.versao("a") == hash_conteudo([{"x": 1}], {"ok": True})
+
+    # Só a validação mudou: também é outra versão
+    v4 = state.publicar({"a": ([{"x": 2}], {"ok": False})})
+    assert v4.versao("a") != v3.versao("a")
+
+
+def test_estado_sem_relatorios_mantem_versoes():
+    state = SheetsState()
+    v1 = state.publicar({"a": ([{"x": 1}], None)})
+    v2 = state.publicar(loading=True, ready=True)
+    assert v2.versoes == v1.versoes
+    assert (v2.loading, v2.ready, v2.last_update) == (True, True, None)
@@ -0,0 +1,78 @@
+"""
+Versões dos dados dos relatórios (para ETag / Last-Modified)
+Cada relatório guarda um contador monotônico e o hash do conteúdo; a versão
+só avança quando o conteúdo realmente muda. As planilhas do Google Sheets
+têm a versão publicada no próprio snapshot (sheets_snapshot); aqui ficam
+as demais fontes (uploads)
+"""
+import hashlib
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from respostas import dumps
+
+
+def hash_conteudo(*partes: Any) -> str:
+    """Hash (blake2b, 128 bits) do conteúdo serializado"""
+    digest = hashlib.blake2b(digest_size=16)
+    for parte in partes:
+        digest.update(parte if isinstance(parte, bytes) else dumps(parte))
+    return digest.hexdigest()
+
+
+class VersoesDados:
+    """Versão e hash de conteúdo de cada relatório/fonte de dados"""
+
+    def __init__(self):
+        self._versoes: Dict[str, Dict[str, Any]] = {}
+        self._contador = 0
+        self._lock = threading.Lock()
+
+    def registrar(self, chave: str, conteudo_hash: str) -> Dict[str, Any]:
+        """
+        Registra o hash atual do conteúdo; avança a versão se mudou
+
+        Returns:
+            Dict com version, hash e modificado (datetime UTC)
+        """
+        with self._lock:
+            atual = self._versoes.get(chave)
+            if atual is not None and atual["hash"] == conteudo_hash:
+                return atual
+            self._contador += 1
+            atual = {
+                "version": self._contador,
+                "hash": conteudo_hash,
+                "modificado": datetime.now(timezone.utc).replace(microsecond=0),
+            }
+            self._versoes[chave] = atual
+            return atual
+
+    def obter(self, chave: str) -> Optional[Dict[str, Any]]:
+        return self._versoes.get(chave)
+
+    def etag(self, *chaves: str, extra: Any = None) -> str:
+        """
+        ETag das chaves informadas (+ parâmetros que alteram a resposta).
+        Inclui o hash do conteúdo, então continua válida após reinício
+        """
+        partes = []
+        for chave in chaves:
+            versao = self._versoes.get(chave)
+            partes.append((chave, versao["hash"]) if versao else (chave, None))
+        return f'"{hash_conteudo(partes, extra)}"'
+
+    def modificado(self, *chaves: str) -> Optional[datetime]:
+        """Última modificação entre as chaves informadas"""
+        datas = [self._versoes[c]["modificado"] for c in chaves if c in self._versoes]
+        return max(datas) if datas else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            chave: {"version": v["version"], "hash": v["hash"], "modificado": v["modificado"].isoformat()}
+            for chave, v in list(self._versoes.items())
+        }
+
+
+versoes_dados = VersoesDados()